@@ -1,22 +1,39 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from jinja2 import ChoiceLoader, FileSystemLoader
+from jinja2 import ChoiceLoader, FileSystemLoader, FileSystemBytecodeCache
 from chatbot import chatbot_bp
+from chatbot.metrics import TimedConnection, init_app as init_metrics
+from chatbot.tracing import tracer, init_app as init_tracing
+from chatbot.uploads import UploadRequest
+from chatbot.fastjson import FastJSONProvider
 import sqlite3
 import os
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import pytz
+import tempfile
 from functools import wraps
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Template yang sudah dikompilasi disimpan di sini dan dipakai bersama semua worker
+JINJA_CACHE_DIR = os.getenv('CALAVERA_JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'calavera_jinja'))
 
 app = Flask(__name__)
 app.jinja_loader = ChoiceLoader([
     FileSystemLoader(os.path.join(BASE_DIR, 'templates')),
     FileSystemLoader(os.path.join(BASE_DIR, 'chatbot'))
 ])
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
 app.register_blueprint(chatbot_bp, url_prefix='/calavera-ai')
+# Upload chatbot dibaca ke buffer memori dengan batas ukuran per mode
+app.request_class = UploadRequest
+# jsonify() memakai orjson (fallback ke json bawaan)
+app.json = FastJSONProvider(app)
+# Histogram latensi per route/template/session + endpoint /metrics
+init_metrics(app)
+# Span per request (X-Request-ID) ke file trace berputar
+init_tracing(app)
 
 app.secret_key = 'clv_secretkey'
 
@@ -51,7 +68,7 @@ def format_timestamp_iso(timestamp_str):
 
 
 def get_db_connection():
-    conn = sqlite3.connect(app.config['DATABASE'])
+    conn = sqlite3.connect(app.config['DATABASE'], factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -67,7 +84,7 @@ def login_required(f):
 
 
 def init_db():
-    conn = sqlite3.connect(app.config['DATABASE'])
+    conn = sqlite3.connect(app.config['DATABASE'], factory=TimedConnection)
     c = conn.cursor()
     
     c.execute('''CREATE TABLE IF NOT EXISTS admin
@@ -850,6 +867,14 @@ def edit_data(type, id):
             return redirect(url_for(f'admin_{type}') + f'?tab={type}')
 
 
+@app.route('/admin/traces')
+@login_required
+def admin_traces():
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    traces = tracer.slowest(limit)
+    return render_template('admin_traces.html', traces=traces, limit=limit)
+
+
 if __name__ == '__main__':
     print(f"[INFO] Database path: {app.config['DATABASE']}")
     print(f"[INFO] Upload folder: {app.config['UPLOAD_FOLDER']}")
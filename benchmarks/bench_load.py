@@ -0,0 +1,403 @@
+"""
+Load test /calavera-ai/api/chat terhadap mock provider lokal: berapa siswa
+bersamaan yang sanggup dilayani satu deployment.
+
+    python benchmarks/bench_load.py --modes text,stream,search,image,file --levels 1,8,32,64 --duration 15
+    python benchmarks/bench_load.py --compare benchmarks/results/load-<commit lama>.json
+
+Skrip menjalankan benchmarks/mock_provider.py dan gunicorn (gunicorn.conf.py,
+semua database di folder sementara) lalu untuk setiap mode menaikkan jumlah
+client bersamaan. Setiap client adalah satu session browser (history sendiri)
+yang mengirim request berturut-turut selama --duration detik.
+
+Per mode x level dicatat: throughput, latency p50/p95/p99 (TTFB untuk stream),
+persentase error, utilisasi thread gunicorn (hukum Little: throughput x latency
+rata-rata / (workers x threads)) dan CPU per worker dari /proc. Hasil disimpan
+sebagai JSON per commit di benchmarks/results/ agar bisa dibandingkan.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_provider import WORDS, provider_urls  # noqa: E402
+
+MODES = ('text', 'stream', 'search', 'image', 'file')
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+# Balasan sukses selalu memuat teks mock; pesan error ramah engine (status 200) tidak
+MOCK_MARKER = ' '.join(WORDS[:3])
+
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> dict:
+    def run(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": run('rev-parse', '--short', 'HEAD') or 'unknown',
+            "subject": run('log', '-1', '--format=%s'),
+            "dirty": bool(run('status', '--porcelain', '--untracked-files=no'))}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def make_image() -> bytes:
+    """Foto 1280x960 (JPEG) seperti hasil kamera HP yang sudah dikecilkan"""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (1280, 960), (240, 240, 230))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, 1280, 40):
+        draw.line((i, 0, 1280 - i, 960), fill=(i % 255, 80, 160), width=3)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def make_document() -> bytes:
+    paragraph = ("Fotosintesis adalah proses tumbuhan hijau mengubah energi cahaya menjadi energi kimia. "
+                 "Proses ini terjadi di kloroplas dan menghasilkan glukosa serta oksigen. ")
+    return (paragraph * 40).encode('utf-8')
+
+
+class Server:
+    """Mock provider + gunicorn sebagai subprocess dengan state di folder sementara"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='calavera_load_')
+        self.mock_port = free_port() if not args.mock_port else args.mock_port
+        self.port = free_port()
+        self.processes = []
+
+    def env(self) -> dict:
+        env = dict(os.environ)
+        env.update(provider_urls('127.0.0.1', self.mock_port))
+        env.update({
+            'PYTHONPATH': ROOT,
+            'GUNICORN_BIND': f'127.0.0.1:{self.port}',
+            'GUNICORN_WORKERS': str(self.args.workers),
+            'GUNICORN_THREADS': str(self.args.threads),
+            'CALAVERA_ASYNC_ENGINES': '1' if self.args.async_engines else '0',
+            'GEMINI_API_KEY': 'mock', 'GROQ_API_KEY': 'mock', 'MISTRAL_API_KEY': 'mock',
+            'DEEPSEEK_API_KEY': 'mock', 'LANGSEARCH_API_KEY': 'mock',
+            'CALAVERA_HTTP_WARMUP': '0',
+            # Gambar uji tidak ditulis ke static/img/chat_uploads di repo
+            'CALAVERA_PERSIST_CHAT_UPLOADS': '0',
+            'CALAVERA_HISTORY_DB': os.path.join(self.workdir, 'history.db'),
+            'CALAVERA_JOB_DB': os.path.join(self.workdir, 'jobs.db'),
+            'CALAVERA_USAGE_DB': os.path.join(self.workdir, 'usage.db'),
+            'CALAVERA_METRICS_DB': os.path.join(self.workdir, 'metrics.db'),
+            'CALAVERA_RATE_LIMIT_DB': os.path.join(self.workdir, 'ratelimit.db'),
+            'CALAVERA_CACHE_DB': os.path.join(self.workdir, 'cache.db'),
+            'CALAVERA_TRACE_FILE': os.path.join(self.workdir, 'traces.jsonl'),
+            'CALAVERA_JINJA_CACHE_DIR': os.path.join(self.workdir, 'jinja'),
+            'CALAVERA_VISION_CACHE_DB': os.path.join(self.workdir, 'vision_cache.db'),
+        })
+        if not self.args.provider_limits:
+            # Yang diukur kapasitas aplikasi, bukan kuota free tier (0 = tanpa batas)
+            env['CALAVERA_RATE_LIMITS'] = 'groq=0:0:0,openrouter=0:0:0,gemini=0:0:0'
+        if not self.args.caches:
+            # Prompt tiap request unik, tapi cache semantik bisa tetap cocok
+            env['CALAVERA_CACHE_ENABLED'] = '0'
+            env['CALAVERA_SEMANTIC_CACHE_ENABLED'] = '0'
+            env['CALAVERA_VISION_CACHE_ENABLED'] = '0'
+        return env
+
+    def start(self):
+        mock = [sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_provider.py'),
+                '--port', str(self.mock_port), '--latency', self.args.latency, '--ttft', self.args.ttft,
+                '--error-429', str(self.args.error_429), '--error-5xx', str(self.args.error_5xx),
+                '--seed', str(self.args.seed)]
+        log = open(os.path.join(self.workdir, 'server.log'), 'w')
+        self.processes.append(subprocess.Popen(mock, stdout=log, stderr=subprocess.STDOUT))
+        gunicorn = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), 'app:app']
+        self.gunicorn = subprocess.Popen(gunicorn, cwd=ROOT, env=self.env(), stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(self.gunicorn)
+
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f'{self.url}/calavera-ai/', timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            if self.gunicorn.poll() is not None:
+                break
+            time.sleep(0.3)
+        self.stop()
+        raise RuntimeError(f"Server tidak bisa start, lihat log: {os.path.join(self.workdir, 'server.log')}")
+
+    @property
+    def url(self) -> str:
+        return self.args.url or f'http://127.0.0.1:{self.port}'
+
+    def worker_pids(self) -> list:
+        """PID worker gunicorn (anak proses master) dari /proc"""
+        if self.args.url or not os.path.isdir('/proc'):
+            return []
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == self.gunicorn.pid:
+                pids.append(int(entry))
+        return pids
+
+    def mock_stats(self) -> dict:
+        try:
+            return requests.get(f'http://127.0.0.1:{self.mock_port}/stats', timeout=2).json()
+        except requests.RequestException:
+            return {}
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not self.args.keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def cpu_ticks(pids: list) -> dict:
+    ticks = {}
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks[pid] = int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return ticks
+
+
+def send(session: requests.Session, url: str, mode: str, model: str, counter: int, files: dict) -> dict:
+    """Satu request chat; kembalikan latency, TTFB (stream) dan status"""
+    data = {"message": f"Jelaskan materi nomor {counter} dengan singkat", "model": model,
+            "personality": "", "mode": "text" if mode == 'stream' else mode}
+    upload = None
+    if mode == 'image':
+        upload = {'image': ('soal.jpg', files['image'], 'image/jpeg')}
+    elif mode == 'file':
+        upload = {'file': ('catatan.txt', files['file'], 'text/plain')}
+    if mode == 'stream':
+        data["stream"] = "1"
+
+    start = time.perf_counter()
+    try:
+        response = session.post(f'{url}/calavera-ai/api/chat', data=data, files=upload,
+                                timeout=120, stream=mode == 'stream')
+        ttfb = None
+        if mode == 'stream':
+            body = []
+            for line in response.iter_lines(decode_unicode=True):
+                if ttfb is None and line.startswith('event: delta'):
+                    ttfb = time.perf_counter() - start
+                body.append(line)
+            # History sudah ditulis server sebelum event 'done'
+            done = next((json.loads(body[i + 1][6:]) for i, line in enumerate(body[:-1])
+                         if line == 'event: done'), None)
+            ok = response.status_code == 200 and done is not None and \
+                MOCK_MARKER in done.get('response', '')
+        else:
+            payload = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+            ok = response.status_code == 200 and MOCK_MARKER in (payload.get('response') or '')
+        return {"latency": time.perf_counter() - start, "ttfb": ttfb, "ok": ok, "status": response.status_code}
+    except requests.RequestException as e:
+        return {"latency": time.perf_counter() - start, "ttfb": None, "ok": False, "status": e.__class__.__name__}
+
+
+def run_level(server: Server, mode: str, concurrency: int, duration: float, model: str, files: dict) -> dict:
+    """concurrency client closed-loop selama duration detik"""
+    results = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    counter = iter(range(10 ** 9))
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.monotonic() < stop_at:
+            with lock:
+                n = next(counter)
+            local.append(send(session, server.url, mode, model, n, files))
+        with lock:
+            results.extend(local)
+
+    pids = server.worker_pids()
+    cpu_before = cpu_ticks(pids)
+    mock_before = server.mock_stats()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    cpu_after = cpu_ticks(pids)
+    mock_after = server.mock_stats()
+
+    latencies = [r["latency"] for r in results]
+    ttfbs = [r["ttfb"] for r in results if r["ttfb"] is not None]
+    errors = [r for r in results if not r["ok"]]
+    throughput = len(results) / elapsed if elapsed else 0.0
+    mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+    capacity = server.args.workers * server.args.threads
+    cpu = [(cpu_after.get(pid, 0) - ticks) / CLK_TCK / elapsed * 100 for pid, ticks in cpu_before.items()]
+    provider_calls = sum(stats.get("requests", 0) for stats in mock_after.values()) - \
+        sum(stats.get("requests", 0) for stats in mock_before.values())
+
+    status_counts = {}
+    for r in errors:
+        status_counts[str(r["status"])] = status_counts.get(str(r["status"]), 0) + 1
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "seconds": round(elapsed, 2),
+        "throughput": round(throughput, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "ttfb_p50_ms": round(percentile(ttfbs, 0.50) * 1000, 1) if ttfbs else None,
+        "ttfb_p95_ms": round(percentile(ttfbs, 0.95) * 1000, 1) if ttfbs else None,
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "errors": status_counts,
+        "thread_utilization": round(throughput * mean_latency / capacity, 3) if server.args.url is None else None,
+        "worker_cpu_percent": [round(value, 1) for value in cpu],
+        "provider_calls": provider_calls,
+    }
+
+
+def print_row(row: dict):
+    cpu = row["worker_cpu_percent"]
+    cpu_text = f"{max(cpu):5.0f}%" if cpu else "    -"
+    ttfb = f"{row['ttfb_p50_ms']:8.0f}" if row["ttfb_p50_ms"] is not None else "       -"
+    util = f"{row['thread_utilization'] * 100:5.1f}%" if row["thread_utilization"] is not None else "     -"
+    print(f"{row['mode']:<7} {row['concurrency']:>5} {row['requests']:>7} {row['throughput']:>8.1f} "
+          f"{row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f} {ttfb} "
+          f"{row['error_rate'] * 100:>6.1f}% {util} {cpu_text}", flush=True)
+
+
+def compare(current: dict, previous_path: str):
+    """Selisih throughput dan p95 terhadap hasil commit lain (mode x level yang sama)"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    old = {(row["mode"], row["concurrency"]): row for row in previous["results"]}
+    print(f"\nDibanding {previous['meta']['commit']} ({previous['meta']['subject'][:50]}):")
+    matched = [(row, old[(row["mode"], row["concurrency"])]) for row in current["results"]
+               if (row["mode"], row["concurrency"]) in old]
+    if not matched:
+        print("   Tidak ada mode x level yang sama")
+        return
+    print(f"{'mode':<7} {'conc':>5} {'req/s':>16} {'p95 ms':>18}")
+    for row, before in matched:
+
+        def delta(key):
+            return (row[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"{row['mode']:<7} {row['concurrency']:>5} {row['throughput']:>8.1f} ({delta('throughput'):+5.0f}%) "
+              f"{row['p95_ms']:>9.0f} ({delta('p95_ms'):+5.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test chat API Calavera dengan mock provider")
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--levels', default='1,8,32,64', help="Jumlah client bersamaan, dinaikkan bertahap")
+    parser.add_argument('--duration', type=float, default=15, help="Detik per level")
+    parser.add_argument('--model', default='gemini')
+    parser.add_argument('--workers', type=int, default=2, help="GUNICORN_WORKERS")
+    parser.add_argument('--threads', type=int, default=64, help="GUNICORN_THREADS")
+    parser.add_argument('--sync-engines', dest='async_engines', action='store_false',
+                        help="Pakai engine sync (CALAVERA_ASYNC_ENGINES=0)")
+    parser.add_argument('--latency', default='lognormal:800:0.5', help="Latency mock provider (non-stream)")
+    parser.add_argument('--ttft', default='lognormal:350:0.4', help="Waktu token pertama mock (stream)")
+    parser.add_argument('--error-429', type=float, default=0.0)
+    parser.add_argument('--error-5xx', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--provider-limits', action='store_true', help="Pakai batas rate limiter bawaan (free tier)")
+    parser.add_argument('--caches', action='store_true', help="Jangan matikan response/semantic/vision cache")
+    parser.add_argument('--url', help="Uji server yang sudah jalan (mock & gunicorn tidak dijalankan)")
+    parser.add_argument('--mock-port', type=int, default=0)
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results'))
+    parser.add_argument('--compare', help="File JSON hasil commit lain")
+    parser.add_argument('--keep-workdir', action='store_true', help="Simpan database & log server sementara")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"Mode tidak dikenal: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.levels.split(',')]
+    files = {"image": make_image(), "file": make_document()}
+
+    server = Server(args)
+    if not args.url:
+        server.start()
+    meta = dict(git_commit(), date=datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                machine=platform.machine(), cpus=os.cpu_count(), config={
+                    key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep_workdir')})
+    print(f"🚀 Load test {meta['commit']}{' (dirty)' if meta['dirty'] else ''} | {args.workers} worker x "
+          f"{args.threads} thread | engine {'async' if args.async_engines else 'sync'} | mock {args.latency}")
+    if not args.url:
+        # Satu request chat = satu thread gunicorn selama menunggu provider
+        print(f"   Batas request bersamaan: {args.workers * args.threads} "
+              f"({args.workers} worker x {args.threads} thread); di atasnya request antre")
+    print(f"{'mode':<7} {'conc':>5} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'ttfb ms':>8} {'error':>7} {'util':>6} {'cpu':>6}")
+
+    results = []
+    try:
+        for mode in modes:
+            # Pemanasan: koneksi pool, engine lazy, template
+            run_level(server, mode, 2, 2, args.model, files)
+            for concurrency in levels:
+                row = run_level(server, mode, concurrency, args.duration, args.model, files)
+                results.append(row)
+                print_row(row)
+    finally:
+        if not args.url:
+            mock = server.mock_stats()
+            server.stop()
+
+    report = {"meta": meta, "results": results, "mock": mock if not args.url else None}
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"load-{meta['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📊 Hasil disimpan: {path}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark payload vision: cara lama (b64encode -> dict -> json= requests)
+vs body JSON yang di-stream (Base64Part + orjson), plus parse response.
+
+    python benchmarks/bench_payload.py [ukuran_gambar_MB] [jumlah_request]
+
+Mengukur peak memori (tracemalloc) dan waktu CPU per request untuk
+menyiapkan body yang dikirim ke socket, tanpa jaringan.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.fastjson import Base64Part, encode_body, loads, orjson  # noqa: E402
+
+
+def old_body(image: bytes) -> int:
+    """Alur sebelumnya: string base64 utuh, dict, lalu json.dumps + encode oleh requests"""
+    image_b64 = base64.b64encode(image).decode('utf-8')
+    payload = build_payload(f"data:image/jpeg;base64,{image_b64}")
+    body = json.dumps(payload, allow_nan=False).encode('utf-8')
+    return len(body)
+
+
+def new_body(image: bytes) -> int:
+    """Alur baru: kerangka di-serialize orjson, base64 di-encode per chunk saat dikirim"""
+    payload = build_payload(Base64Part(image, prefix="data:image/jpeg;base64,"))
+    sent = 0
+    for chunk in encode_body(payload):
+        sent += len(chunk)  # socket.sendall(chunk)
+    return sent
+
+
+def build_payload(url) -> dict:
+    return {
+        "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+        "messages": [
+            {"role": "system", "content": "Kamu adalah asisten pintar untuk website kelas Calavera. " * 20},
+            {"role": "user", "content": [
+                {"type": "text", "text": "Jelaskan apa yang ada di gambar ini"},
+                {"type": "image_url", "image_url": {"url": url}}
+            ]}
+        ],
+        "temperature": 0.4,
+        "max_tokens": 2048
+    }
+
+
+def measure(name: str, func, arg, runs: int):
+    func(arg)  # warm-up
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.process_time()
+    for _ in range(runs):
+        func(arg)
+    cpu = (time.process_time() - start) / runs
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} peak {peak / 1024 / 1024:8.2f} MB   CPU {cpu * 1000:8.2f} ms/request")
+    return peak, cpu
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    image = os.urandom(int(size_mb * 1024 * 1024))
+    sample = os.urandom(30000)
+    old = json.loads(json.dumps(build_payload(f"data:image/jpeg;base64,{base64.b64encode(sample).decode()}")))
+    new = json.loads(b"".join(encode_body(build_payload(Base64Part(sample, prefix="data:image/jpeg;base64,")))))
+    assert old == new, "body stream harus identik dengan body lama"
+
+    print(f"Gambar {size_mb} MB, {runs} request, codec: {'orjson' if orjson else 'json (orjson tidak terpasang)'}")
+    old_peak, old_cpu = measure("request body lama", old_body, image, runs)
+    new_peak, new_cpu = measure("request body stream", new_body, image, runs)
+    print(f"{'':<28} peak x{old_peak / max(new_peak, 1):.1f} lebih kecil, CPU x{old_cpu / max(new_cpu, 1e-9):.1f} lebih cepat")
+
+    response = json.dumps({
+        "id": "chatcmpl-bench",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "Jawaban panjang ✓ " * 400}}],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": 2048, "total_tokens": 3248}
+    }).encode('utf-8')
+    measure("response json.loads", json.loads, response, runs * 50)
+    measure("response fastjson.loads", loads, response, runs * 50)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Tes performa offline dengan exchange provider yang direkam: skenario yang sama
+(jawaban panjang 2048 token, streaming, foto soal besar, lalu cache hit) diputar
+ulang lewat engine dan cache yang sebenarnya, tanpa jaringan.
+
+    # Rekam sekali (API key asli, atau CALAVERA_*_URL ke benchmarks/mock_provider.py)
+    python benchmarks/bench_replay.py --record benchmarks/cassettes/skenario.jsonl
+
+    # Putar ulang dengan timing asli / 10x lebih cepat / tanpa jeda
+    python benchmarks/bench_replay.py benchmarks/cassettes/skenario.jsonl --runs 5 --time-scale 0.1
+
+Setiap run berjalan di interpreter baru dengan database sementara (cache kosong),
+hasilnya median per langkah. Jawaban harus identik di semua run; request yang
+tidak ada di rekaman (payload berubah) dilaporkan sebagai miss.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dijalankan di proses anak: skenario lewat helper cache di routes (seperti request chat)
+CHILD = r'''
+import io, json, time, random, hashlib
+from PIL import Image
+from chatbot import routes
+from chatbot.image_prep import prepare_image
+from chatbot.replay import cassette
+
+LONG_PROMPT = ("Jelaskan secara lengkap dan runtut sejarah Revolusi Industri: penyebab, tokoh, "
+               "penemuan penting, dampak sosial-ekonomi, dan hubungannya dengan Indonesia.")
+STREAM_PROMPT = "Buat ringkasan materi sistem pencernaan manusia untuk persiapan ulangan besok."
+IMAGE_PROMPT = "Tolong bantu kerjakan soal di foto ini langkah demi langkah."
+
+
+def photo() -> bytes:
+    # Foto kamera HP 4000x3000 (detail acak, seed tetap) -> body base64 besar
+    rng = random.Random(7)
+    small = Image.frombytes('RGB', (400, 300), bytes(rng.randrange(256) for _ in range(400 * 300 * 3)))
+    output = io.BytesIO()
+    small.resize((4000, 3000)).save(output, format='JPEG', quality=92)
+    return output.getvalue()
+
+
+def digest(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+def timed(step, func):
+    start = time.perf_counter()
+    text = func()
+    results[step] = {"ms": (time.perf_counter() - start) * 1000, "sha": digest(text), "chars": len(text)}
+
+
+def stream(model, prompt, attempt):
+    start = time.perf_counter()
+    parts = []
+    for chunk in routes.cached_stream_text(model, prompt, "", []):
+        if not parts:
+            results[f"ttfb/{attempt}"] = (time.perf_counter() - start) * 1000
+        parts.append(chunk)
+    return "".join(parts)
+
+
+results = {}
+image_data, mime_type = prepare_image(photo())
+for attempt in ("miss", "hit"):
+    timed(f"text/{attempt}", lambda: routes.cached_generate_text("gemini", LONG_PROMPT, "", []))
+    timed(f"stream/{attempt}", lambda: stream("groq", STREAM_PROMPT, attempt))
+    timed(f"image/{attempt}", lambda: routes.cached_analyze_image("gemini", image_data, mime_type, IMAGE_PROMPT, ""))
+results["image_bytes"] = len(image_data)
+results["cassette"] = cassette.stats()
+print(json.dumps(results))
+'''
+
+STEPS = ('text/miss', 'text/hit', 'stream/miss', 'stream/hit', 'image/miss', 'image/hit')
+TTFB_STEPS = ('ttfb/miss', 'ttfb/hit')
+
+
+def child_env(workdir: str, cassette: str, mode: str, args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'CALAVERA_HTTP_WARMUP': '0',
+        'CALAVERA_HTTP_CASSETTE': cassette,
+        'CALAVERA_HTTP_CASSETTE_MODE': mode,
+        'CALAVERA_REPLAY_TIME_SCALE': str(args.time_scale),
+        'CALAVERA_REPLAY_MATCH': args.match,
+        'CALAVERA_ASYNC_ENGINES': '1' if args.engines == 'async' else '0',
+        'CALAVERA_CACHE_ENABLED': '1',
+        'CALAVERA_VISION_CACHE_ENABLED': '1',
+        'CALAVERA_SEMANTIC_CACHE_ENABLED': '0',
+        # Failover/hedging memanggil provider lain yang tidak ada di skenario
+        'CALAVERA_FAILOVER': '0',
+        'CALAVERA_HEDGE': '0',
+        'CALAVERA_HISTORY_DB': os.path.join(workdir, 'history.db'),
+        'CALAVERA_JOB_DB': os.path.join(workdir, 'jobs.db'),
+        'CALAVERA_USAGE_DB': os.path.join(workdir, 'usage.db'),
+        'CALAVERA_METRICS_DB': os.path.join(workdir, 'metrics.db'),
+        'CALAVERA_RATE_LIMIT_DB': os.path.join(workdir, 'ratelimit.db'),
+        'CALAVERA_CACHE_DB': os.path.join(workdir, 'cache.db'),
+        'CALAVERA_VISION_CACHE_DB': os.path.join(workdir, 'vision_cache.db'),
+        'CALAVERA_TRACE_FILE': os.path.join(workdir, 'traces.jsonl'),
+    })
+    if mode == 'replay':
+        # API key tidak dipakai (tidak ada jaringan), batas rate free tier juga tidak
+        for name in ('GEMINI_API_KEY', 'GROQ_API_KEY', 'LANGSEARCH_API_KEY', 'MISTRAL_API_KEY', 'DEEPSEEK_API_KEY'):
+            env.setdefault(name, 'replay')
+        env['CALAVERA_RATE_LIMITS'] = 'groq=0:0:0,openrouter=0:0:0,gemini=0:0:0'
+    return env
+
+
+def run_child(env: dict) -> dict:
+    workdir = env['CALAVERA_CACHE_DB'].rsplit(os.sep, 1)[0]
+    # Database sementara baru per run: semua cache mulai kosong
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Putar ulang exchange provider yang direkam lewat engine Calavera")
+    parser.add_argument('cassette', nargs='?', help="File cassette (JSONL) untuk diputar ulang")
+    parser.add_argument('--record', metavar='CASSETTE', help="Jalankan skenario ke provider asli dan rekam")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--time-scale', type=float, default=1.0, help="1 = timing asli, 0 = tanpa jeda")
+    parser.add_argument('--match', choices=('body', 'url'), default='body')
+    parser.add_argument('--engines', choices=('sync', 'async'), default='async')
+    args = parser.parse_args()
+    if not args.cassette and not args.record:
+        parser.error("Isi path cassette atau --record")
+
+    workdir = tempfile.mkdtemp(prefix='calavera_replay_')
+    try:
+        if args.record:
+            path = os.path.abspath(args.record)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(path)
+            result = run_child(child_env(workdir, path, 'record', args))
+            exchanges = 0
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    exchanges = sum(1 for line in f if line.strip())
+            print(f"📼 {exchanges} exchange direkam ke {path}")
+            for step in STEPS:
+                print(f"   {step:<12} {result[step]['ms']:8.0f} ms  {result[step]['chars']:6} karakter")
+            return
+
+        path = os.path.abspath(args.cassette)
+        env = child_env(workdir, path, 'replay', args)
+        runs = [run_child(env) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"📼 Replay {os.path.basename(path)} | engine {args.engines} | time scale {args.time_scale} | "
+          f"{args.runs} run | gambar {runs[0]['image_bytes'] / 1024:.0f} KB")
+    print(f"{'langkah':<12} {'median ms':>10} {'min':>8} {'max':>8}  jawaban")
+    for step in STEPS:
+        values = [run[step]["ms"] for run in runs]
+        shas = {run[step]["sha"] for run in runs}
+        verdict = "identik" if len(shas) == 1 else f"BERBEDA ({len(shas)} versi)"
+        print(f"{step:<12} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}  {verdict}")
+    for step in TTFB_STEPS:
+        values = [run[step] for run in runs if step in run]
+        if values:
+            print(f"{step:<12} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}")
+    stats = runs[-1]["cassette"]
+    print(f"\nExchange diputar ulang per run: {stats['replayed']}, miss: {stats['misses']}")
+    if stats["misses"]:
+        print("⚠️ Ada request yang tidak ada di rekaman: rekam ulang atau pakai --match url")
+
+
+if __name__ == '__main__':
+    main()
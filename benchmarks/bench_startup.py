@@ -0,0 +1,103 @@
+"""
+Benchmark cold start worker: waktu import app (seperti worker gunicorn baru),
+render template pertama tanpa/dengan Jinja bytecode cache, dan profil import
+terberat (python -X importtime).
+
+    python benchmarks/bench_startup.py [jumlah_proses]
+
+Setiap pengukuran berjalan di interpreter baru agar tidak ada modul/cache
+yang terbawa; hasilnya median dari beberapa proses.
+"""
+import os
+import sys
+import json
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dijalankan di proses anak: import app, lalu render template pertama
+CHILD = r'''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+with app.app.test_request_context('/calavera-ai/'):
+    from flask import render_template
+    render_template('chatbot.html')
+rendered = time.perf_counter()
+from chatbot import routes
+routes.get_engine('gemini')
+engine = time.perf_counter()
+print(json.dumps({"import": imported - start, "render": rendered - imported, "engine": engine - rendered,
+                  "modules": len(__import__('sys').modules)}))
+'''
+
+
+def child_env(workdir: str, jinja_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'CALAVERA_HTTP_WARMUP': '0',
+        'CALAVERA_JINJA_CACHE_DIR': jinja_dir,
+        'CALAVERA_HISTORY_DB': os.path.join(workdir, 'history.db'),
+        'CALAVERA_JOB_DB': os.path.join(workdir, 'jobs.db'),
+    })
+    return env
+
+
+def run_child(env: dict) -> dict:
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(env: dict, top: int = 15):
+    """Modul dengan waktu import kumulatif terbesar (dalam ms)"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 3:
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    workdir = tempfile.mkdtemp(prefix='calavera_bench_')
+    jinja_dir = os.path.join(workdir, 'jinja')
+    env = child_env(workdir, jinja_dir)
+    try:
+        run_child(env)  # .pyc modul dan database dibuat dulu
+
+        cold, warm = [], []
+        for _ in range(runs):
+            shutil.rmtree(jinja_dir, ignore_errors=True)
+            cold.append(run_child(env))
+            warm.append(run_child(env))
+
+        def median(samples, key):
+            return statistics.median(sample[key] for sample in samples) * 1000
+
+        print(f"{runs} proses baru per skenario, median")
+        print(f"{'import app':<40} {median(warm, 'import'):8.1f} ms   ({warm[0]['modules']} modul)")
+        print(f"{'render chatbot.html (tanpa cache)':<40} {median(cold, 'render'):8.1f} ms")
+        print(f"{'render chatbot.html (bytecode cache)':<40} {median(warm, 'render'):8.1f} ms")
+        print(f"{'engine pertama (lazy)':<40} {median(warm, 'engine'):8.1f} ms")
+
+        print("\nImport terberat (kumulatif):")
+        for ms, name in import_profile(env):
+            print(f"  {name:<38} {ms:8.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+Mock provider AI lokal untuk load test: Gemini, Groq/OpenRouter (format
+OpenAI chat/completions, termasuk streaming) dan LangSearch, dengan latency
+acak yang bisa diatur serta injeksi 429/5xx.
+
+    python benchmarks/mock_provider.py --port 8900 --latency lognormal:800:0.5 --error-429 0.02
+
+Setiap provider punya port sendiri (gemini=port, groq=port+1,
+openrouter=port+2, langsearch=port+3) agar rate limiter / circuit breaker
+aplikasi tetap memperlakukannya sebagai provider berbeda. Variabel
+CALAVERA_*_URL yang perlu di-set dicetak saat start; GET /stats di port
+mana pun mengembalikan jumlah request per provider.
+
+Format latency: fixed:MS, uniform:MIN:MAX, normal:MEAN:SD, lognormal:MEDIAN:SIGMA
+"""
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+PROVIDERS = ('gemini', 'groq', 'openrouter', 'langsearch')
+
+WORDS = ("halo aku calavera ai teman belajar kelas kita hari ini materi matematika fisika "
+         "kimia biologi sejarah jawaban contoh langkah pertama kedua ketiga jadi hasilnya").split()
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """'lognormal:800:0.5' -> fungsi rng -> detik"""
+    kind, *args = spec.split(':')
+    values = [float(arg) for arg in args]
+    if kind == 'fixed':
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Format latency tidak dikenal: {spec}")
+
+
+class MockState:
+    """Konfigurasi + RNG bersama (seeded, jadi urutan latency bisa diulang)"""
+
+    def __init__(self, args):
+        self.latency = {provider: parse_latency(args.latency) for provider in PROVIDERS}
+        for item in args.provider_latency or []:
+            provider, spec = item.split('=', 1)
+            self.latency[provider] = parse_latency(spec)
+        self.ttft = parse_latency(args.ttft)
+        self.chunk_delay = parse_latency(args.chunk_delay)
+        self.chunks = args.chunks
+        self.completion_tokens = args.completion_tokens
+        self.error_429 = args.error_429
+        self.error_5xx = args.error_5xx
+        self.retry_after = args.retry_after
+        self._rng = random.Random(args.seed)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {provider: {"requests": 0, "429": 0, "5xx": 0, "streams": 0,
+                                                            "in_flight": 0, "max_in_flight": 0}
+                                                 for provider in PROVIDERS}
+
+    def draw(self, func: Callable[[random.Random], float]) -> float:
+        with self._lock:
+            return func(self._rng)
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def count(self, provider: str, key: str, delta: int = 1):
+        with self._lock:
+            stats = self.stats[provider]
+            stats[key] += delta
+            if key == 'in_flight':
+                stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+
+
+def make_text(tokens: int) -> str:
+    return ' '.join(WORDS[i % len(WORDS)] for i in range(tokens))
+
+
+def make_handler(provider: str, state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def read_body(self) -> bytes:
+            """Body biasa atau chunked (body JSON aplikasi di-stream per chunk)"""
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                parts = []
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    parts.append(self.rfile.read(size))
+                    self.rfile.readline()
+                return b''.join(parts)
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def send_json(self, status: int, payload: Dict, headers: Dict = None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def start_sse(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+        def send_chunk(self, data: bytes):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.startswith('/stats'):
+                self.send_json(200, state.stats)
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self.read_body()
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                payload = {}
+            state.count(provider, 'requests')
+            state.count(provider, 'in_flight')
+            try:
+                self.handle_call(payload, len(body))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                state.count(provider, 'in_flight', -1)
+
+        def handle_call(self, payload: Dict, body_size: int):
+            roll = state.roll()
+            if roll < state.error_429:
+                state.count(provider, '429')
+                time.sleep(state.draw(state.ttft) / 4)
+                self.send_json(429, {"error": {"message": "Rate limit exceeded (mock)", "code": 429}},
+                               {"Retry-After": str(state.retry_after)})
+                return
+            if roll < state.error_429 + state.error_5xx:
+                state.count(provider, '5xx')
+                time.sleep(state.draw(state.ttft) / 4)
+                self.send_json(503, {"error": {"message": "Service unavailable (mock)", "code": 503}})
+                return
+
+            prompt_tokens = max(1, body_size // 4)
+            if provider == 'langsearch':
+                time.sleep(state.draw(state.latency[provider]))
+                self.send_json(200, {"data": {"webPages": {"value": [
+                    {"name": f"Hasil {i}", "url": f"https://example.com/{i}", "snippet": make_text(30)}
+                    for i in range(1, 6)
+                ]}}})
+            elif provider == 'gemini' and self.path.split('?')[0].endswith('/cachedContents'):
+                time.sleep(state.draw(state.ttft))
+                self.send_json(200, {"name": f"cachedContents/mock-{uuid.uuid4().hex[:12]}",
+                                     "usageMetadata": {"totalTokenCount": prompt_tokens}})
+            elif provider == 'gemini':
+                self.gemini(':streamGenerateContent' in self.path, prompt_tokens)
+            else:
+                self.openai(bool(payload.get('stream')), prompt_tokens,
+                            bool((payload.get('stream_options') or {}).get('include_usage')))
+
+        def gemini(self, stream: bool, prompt_tokens: int):
+            usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": state.completion_tokens,
+                     "totalTokenCount": prompt_tokens + state.completion_tokens}
+            if not stream:
+                time.sleep(state.draw(state.latency[provider]))
+                self.send_json(200, {"candidates": [{"content": {"role": "model", "parts": [
+                    {"text": make_text(state.completion_tokens)}]}, "finishReason": "STOP"}],
+                    "usageMetadata": usage})
+                return
+            state.count(provider, 'streams')
+            time.sleep(state.draw(state.ttft))
+            self.start_sse()
+            per_chunk = max(1, state.completion_tokens // state.chunks)
+            for i in range(state.chunks):
+                if i:
+                    time.sleep(state.draw(state.chunk_delay))
+                chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": make_text(per_chunk) + ' '}]}}],
+                         "usageMetadata": usage}
+                self.send_chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+            self.send_chunk(b'')
+
+        def openai(self, stream: bool, prompt_tokens: int, include_usage: bool):
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": state.completion_tokens,
+                     "total_tokens": prompt_tokens + state.completion_tokens}
+            if not stream:
+                time.sleep(state.draw(state.latency[provider]))
+                self.send_json(200, {"id": f"mock-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+                                     "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                                         "role": "assistant", "content": make_text(state.completion_tokens)}}],
+                                     "usage": usage})
+                return
+            state.count(provider, 'streams')
+            time.sleep(state.draw(state.ttft))
+            self.start_sse()
+            per_chunk = max(1, state.completion_tokens // state.chunks)
+            for i in range(state.chunks):
+                if i:
+                    time.sleep(state.draw(state.chunk_delay))
+                chunk = {"choices": [{"index": 0, "delta": {"content": make_text(per_chunk) + ' '}}]}
+                self.send_chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+            if include_usage:
+                self.send_chunk(b'data: ' + json.dumps({"choices": [], "usage": usage}).encode('utf-8') + b'\n\n')
+            self.send_chunk(b'data: [DONE]\n\n')
+            self.send_chunk(b'')
+
+    return Handler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Backlog listen besar: ratusan koneksi baru saat concurrency dinaikkan
+    request_queue_size = 1024
+
+
+def provider_urls(host: str, port: int) -> Dict[str, str]:
+    """Nilai CALAVERA_*_URL untuk mengarahkan aplikasi ke mock ini"""
+    return {
+        'CALAVERA_GEMINI_URL': f"http://{host}:{port}/v1beta/models",
+        'CALAVERA_GROQ_URL': f"http://{host}:{port + 1}/openai/v1/chat/completions",
+        'CALAVERA_OPENROUTER_URL': f"http://{host}:{port + 2}/api/v1/chat/completions",
+        'CALAVERA_LANGSEARCH_URL': f"http://{host}:{port + 3}/v1/web-search",
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Mock provider AI untuk load test Calavera")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900, help="Port gemini; provider lain port+1..+3")
+    parser.add_argument('--latency', default='lognormal:800:0.5', help="Latency respons non-stream")
+    parser.add_argument('--provider-latency', action='append', metavar='PROVIDER=SPEC',
+                        help="Latency khusus satu provider, misalnya groq=lognormal:300:0.4")
+    parser.add_argument('--ttft', default='lognormal:350:0.4', help="Waktu sampai token pertama (stream)")
+    parser.add_argument('--chunk-delay', default='fixed:40', help="Jeda antar potongan stream")
+    parser.add_argument('--chunks', type=int, default=20, help="Jumlah potongan per stream")
+    parser.add_argument('--completion-tokens', type=int, default=200)
+    parser.add_argument('--error-429', type=float, default=0.0, help="Peluang respons 429 (0-1)")
+    parser.add_argument('--error-5xx', type=float, default=0.0, help="Peluang respons 503 (0-1)")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    return parser
+
+
+def serve(args) -> list:
+    """Jalankan satu server per provider di background thread"""
+    state = MockState(args)
+    servers = []
+    for offset, provider in enumerate(PROVIDERS):
+        server = MockServer((args.host, args.port + offset), make_handler(provider, state))
+        threading.Thread(target=server.serve_forever, name=f'mock-{provider}', daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def main():
+    args = build_parser().parse_args()
+    servers = serve(args)
+    print(f"🚀 [MOCK] {', '.join(PROVIDERS)} di {args.host}:{args.port}-{args.port + len(PROVIDERS) - 1}", flush=True)
+    for key, value in provider_urls(args.host, args.port).items():
+        print(f"{key}={value}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,4 +6,5 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 chatbot_bp = Blueprint('chatbot', __name__, 
                        template_folder=os.path.join(current_dir, 'templates'))
 
+
 from . import routes
\ No newline at end of file
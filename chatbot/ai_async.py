@@ -0,0 +1,294 @@
+import asyncio
+import httpx
+from typing import AsyncIterator, Dict, Iterator, List
+
+from .ai_utils import GeminiAI, LangSearchAPI, sanitize_ai_error
+from .ai_groq import GroqAI
+from .ai_mistral import MistralAI
+from .ai_deepseek import DeepSeekAI
+from . import fastjson
+from .async_runtime import runner, transport, aiter_sse_data
+from .context_cache import gemini_context_cache, prompt_cache_stats
+from .usage_ledger import record_gemini_usage, record_openai_usage
+
+
+def handle_async_request_error(error) -> str:
+    """Handle error dari httpx dengan pesan ramah yang sama seperti versi sync"""
+    if isinstance(error, httpx.TimeoutException):
+        return sanitize_ai_error("timeout")
+    return sanitize_ai_error(str(error))
+
+
+async def aiter_chat_deltas(response: httpx.Response) -> AsyncIterator[str]:
+    """Versi async dari http_pool.iter_chat_deltas (format OpenAI)"""
+    async for data in aiter_sse_data(response):
+        if data.strip() == '[DONE]':
+            break
+        chunk = fastjson.loads(data)
+        if 'error' in chunk:
+            raise httpx.HTTPError(str(chunk['error']))
+        if chunk.get('usage'):
+            record_openai_usage(chunk)
+        for choice in chunk.get('choices', [])[:1]:
+            text = (choice.get('delta') or {}).get('content')
+            if text:
+                yield text
+
+
+class AsyncGeminiAI(GeminiAI):
+    """GeminiAI dengan I/O async (httpx). Payload dan prompt sama dengan versi sync."""
+
+    def _handle_request_error(self, error) -> str:
+        return handle_async_request_error(error)
+
+    async def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                            document: str = None) -> str:
+        """Generate text response from Gemini (async)"""
+        try:
+            url = f"{self.base_url}/{self.text_model}:generateContent?key={self.api_key}"
+            cached_content = None
+            if document:
+                # Pembuatan cachedContents memakai transport sync, jalankan di executor
+                cached_content = await asyncio.get_running_loop().run_in_executor(
+                    None, gemini_context_cache.resolve,
+                    self, self._build_system_instruction(personality), document
+                )
+            payload = self._build_text_payload(prompt, personality, history, document, cached_content)
+
+            headers = {"Content-Type": "application/json"}
+            response = await transport.post(url, json=payload, headers=headers, timeout=30)
+            if cached_content and response.status_code in (400, 403, 404):
+                gemini_context_cache.forget(cached_content)
+                payload = self._build_text_payload(prompt, personality, history, document)
+                response = await transport.post(url, json=payload, headers=headers, timeout=30)
+            response.raise_for_status()
+
+            result = fastjson.loads(response.content)
+            record_gemini_usage(result)
+            prompt_cache_stats.record_gemini_usage(result)
+
+            if 'candidates' in result and len(result['candidates']) > 0:
+                return result['candidates'][0]['content']['parts'][0]['text']
+            else:
+                return "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            return self._handle_request_error(e)
+
+    async def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> AsyncIterator[str]:
+        """Stream text response from Gemini (async SSE)"""
+        emitted = False
+        try:
+            url = f"{self.base_url}/{self.text_model}:streamGenerateContent?alt=sse&key={self.api_key}"
+            payload = self._build_text_payload(prompt, personality, history)
+
+            headers = {"Content-Type": "application/json"}
+            async with transport.stream('POST', url, json=payload, headers=headers, timeout=30) as response:
+                response.raise_for_status()
+
+                usage = None
+                async for data in aiter_sse_data(response):
+                    chunk = fastjson.loads(data)
+                    # usageMetadata kumulatif: yang terakhir berisi total
+                    usage = chunk if chunk.get('usageMetadata') else usage
+                    for candidate in chunk.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            text = part.get('text', '')
+                            if text:
+                                emitted = True
+                                yield text
+                record_gemini_usage(usage)
+
+            if not emitted:
+                yield "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            error_message = self._handle_request_error(e)
+            yield f"\n\n{error_message}" if emitted else error_message
+
+    async def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                            mime_type: str = "image/jpeg") -> str:
+        """Analyze image with Gemini Vision (async)"""
+        try:
+            url = f"{self.base_url}/{self.vision_model}:generateContent?key={self.api_key}"
+            payload = self._build_vision_payload(image_data, prompt, personality, mime_type)
+
+            headers = {"Content-Type": "application/json"}
+            response = await transport.post(url, json=payload, headers=headers, timeout=45)
+            response.raise_for_status()
+
+            result = fastjson.loads(response.content)
+            record_gemini_usage(result)
+
+            if 'candidates' in result and len(result['candidates']) > 0:
+                return result['candidates'][0]['content']['parts'][0]['text']
+            else:
+                return "⚠️ Maaf, saya tidak bisa menganalisis gambar ini. Coba gambar lain ya!"
+
+        except Exception as e:
+            return self._handle_request_error(e)
+
+
+class AsyncOpenAICompatibleMixin:
+    """
+    Method async bersama untuk engine format chat/completions
+    (Groq, dan Mistral/DeepSeek lewat OpenRouter).
+    """
+
+    text_timeout = 30
+    vision_timeout = 45
+    provider_name = ''
+
+    def _handle_request_error(self, error) -> str:
+        return handle_async_request_error(error)
+
+    async def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                            document: str = None) -> str:
+        """Generate text response (async)"""
+        try:
+            payload = self._build_text_payload(prompt, personality, history, document=document)
+
+            response = await transport.post(
+                self.base_url,
+                json=payload,
+                headers=self._get_headers(),
+                timeout=self.text_timeout
+            )
+            response.raise_for_status()
+
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
+            prompt_cache_stats.record_openai_usage(self.provider_name, result)
+
+            if 'choices' in result and len(result['choices']) > 0:
+                return result['choices'][0]['message']['content']
+            else:
+                return "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            return self._handle_request_error(e)
+
+    async def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> AsyncIterator[str]:
+        """Stream text response (async, stream: true)"""
+        emitted = False
+        try:
+            payload = self._build_text_payload(prompt, personality, history, stream=True)
+
+            async with transport.stream(
+                'POST',
+                self.base_url,
+                json=payload,
+                headers=self._get_headers(),
+                timeout=self.text_timeout
+            ) as response:
+                response.raise_for_status()
+
+                async for text in aiter_chat_deltas(response):
+                    emitted = True
+                    yield text
+
+            if not emitted:
+                yield "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            error_message = self._handle_request_error(e)
+            yield f"\n\n{error_message}" if emitted else error_message
+
+    async def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                            mime_type: str = "image/jpeg") -> str:
+        """Analyze image (async)"""
+        try:
+            payload = self._build_vision_payload(image_data, prompt, personality, mime_type)
+
+            response = await transport.post(
+                self.base_url,
+                json=payload,
+                headers=self._get_headers(),
+                timeout=self.vision_timeout
+            )
+            response.raise_for_status()
+
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
+
+            if 'choices' in result and len(result['choices']) > 0:
+                return result['choices'][0]['message']['content']
+            else:
+                return "⚠️ Maaf, saya tidak bisa menganalisis gambar ini. Coba gambar lain ya!"
+
+        except Exception as e:
+            return self._handle_request_error(e)
+
+
+class AsyncGroqAI(AsyncOpenAICompatibleMixin, GroqAI):
+    """GroqAI dengan I/O async"""
+
+    vision_timeout = 60
+    provider_name = 'groq'
+
+
+class AsyncMistralAI(AsyncOpenAICompatibleMixin, MistralAI):
+    """MistralAI (OpenRouter) dengan I/O async"""
+
+    provider_name = 'mistral'
+
+
+class AsyncDeepSeekAI(AsyncOpenAICompatibleMixin, DeepSeekAI):
+    """DeepSeekAI (OpenRouter) dengan I/O async. Tidak mendukung gambar."""
+
+    provider_name = 'deepseek'
+
+    async def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                            mime_type: str = "image/jpeg") -> str:
+        return DeepSeekAI.analyze_image(self, image_data, prompt, personality, mime_type)
+
+
+class AsyncLangSearchAPI(LangSearchAPI):
+    """LangSearchAPI dengan I/O async"""
+
+    def _handle_request_error(self, error) -> Dict:
+        return {"error": handle_async_request_error(error)}
+
+    async def search(self, query: str, num_results: int = 5) -> Dict:
+        """Search internet using LangSearch API (async)"""
+        try:
+            payload = {
+                "query": query,
+                "num_results": num_results
+            }
+
+            response = await transport.post(self.base_url, json=payload, headers=self._get_headers(), timeout=15)
+            response.raise_for_status()
+
+            return fastjson.loads(response.content)
+
+        except Exception as e:
+            return self._handle_request_error(e)
+
+
+class SyncEngineBridge:
+    """
+    Facade sync untuk engine async, supaya routes tetap memanggil
+    generate_text/analyze_image/stream_text seperti biasa. Thread request
+    hanya menunggu Future; I/O-nya berjalan di event loop bersama.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
+        return runner.run(self.engine.generate_text(prompt, personality, history, document))
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
+        return runner.run(self.engine.analyze_image(image_data, prompt, personality, mime_type))
+
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        return runner.iterate(self.engine.stream_text(prompt, personality, history))
+
+    def search(self, query: str, num_results: int = 5) -> Dict:
+        return runner.run(self.engine.search(query, num_results))
@@ -1,6 +1,15 @@
+import os
 import requests
-import json
-from typing import List, Dict
+import functools
+from . import http_pool
+from . import fastjson
+from .context_cache import prompt_cache_stats
+from .usage_ledger import record_openai_usage
+from .history_window import build_history_turns, format_summary, history_budget
+from typing import Iterator, List, Dict
+
+# Endpoint provider bisa dialihkan (mock server benchmarks/mock_provider.py)
+OPENROUTER_URL = os.getenv('CALAVERA_OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
 
 
 def sanitize_ai_error(error_message: str) -> str:
@@ -27,17 +36,12 @@ def sanitize_ai_error(error_message: str) -> str:
     return "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
 
 
-class DeepSeekAI:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.model = "deepseek/deepseek-r1-0528-qwen3-8b:free"
-        self.base_url = "https://openrouter.ai/api/v1/chat/completions"
-
-    def _build_system_instruction(self, personality: str) -> str:
-        """Build system instruction untuk text generation"""
-        default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
-        
-        return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
+@functools.lru_cache(maxsize=32)
+def _system_instruction(personality: str) -> str:
+    """Build system instruction untuk text generation"""
+    default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
+    
+    return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
 
 Kepribadian: {personality if personality else default_personality}
 
@@ -74,31 +78,40 @@ Aturan Respons:
 - Gunakan bahasa Indonesia yang santai tapi tetap sopan.
 """
 
-    def _build_chat_messages(self, prompt: str, personality: str, history: List[Dict] = None) -> List[Dict]:
+
+class DeepSeekAI:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.model = "deepseek/deepseek-r1-0528-qwen3-8b:free"
+        self.base_url = OPENROUTER_URL
+        self.history_budget = history_budget('deepseek')
+
+    def _build_system_instruction(self, personality: str) -> str:
+        """Build system instruction untuk text generation (dirakit sekali per kepribadian)"""
+        return _system_instruction(personality)
+
+    def _build_chat_messages(self, prompt: str, personality: str, history: List[Dict] = None,
+                             document: str = None) -> List[Dict]:
         """Build messages array untuk chat history"""
         messages = []
 
         # System instruction sebagai message pertama
         system_instruction = self._build_system_instruction(personality)
+        if document:
+            # Dokumen ditaruh di prefix system (sebelum history) agar bisa di-cache provider
+            system_instruction = f"{system_instruction}\n\n{document}"
         messages.append({
             "role": "system",
             "content": system_instruction
         })
 
-        # Add history (5 terakhir)
+        # Add history (ringkasan + giliran terbaru sesuai budget token)
         if history:
-            for msg in history[-5:]:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                # Skip messages dengan tag khusus
-                if "[PENCARIAN]" in content or "[GAMBAR]" in content:
+            for msg in build_history_turns(history, self.history_budget):
+                if msg["role"] == "summary":
+                    messages.append({"role": "system", "content": format_summary(msg["content"])})
                     continue
-                    
-                messages.append({
-                    "role": role,
-                    "content": content
-                })
+                messages.append(msg)
 
         # Add current prompt
         messages.append({
@@ -119,34 +132,49 @@ Aturan Respons:
         else:
             return sanitize_ai_error(str(error))
 
-    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> str:
+    def _get_headers(self) -> Dict:
+        """Get request headers dengan authorization (OpenRouter)"""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://calavera-class.com",  # Ganti dengan domain kamu
+            "X-Title": "Calavera AI"
+        }
+
+    def _build_text_payload(self, prompt: str, personality: str, history: List[Dict] = None,
+                            stream: bool = False, document: str = None) -> Dict:
+        """Build payload chat/completions untuk text generation"""
+        messages = self._build_chat_messages(prompt, personality, history, document)
+        
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 2048
+        }
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        
+        return payload
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
         """Generate text response from DeepSeek"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://calavera-class.com",  # Ganti dengan domain kamu
-                "X-Title": "Calavera AI"
-            }
-            
-            messages = self._build_chat_messages(prompt, personality, history)
-            
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2048
-            }
-
-            response = requests.post(
+            payload = self._build_text_payload(prompt, personality, history, document=document)
+
+            response = http_pool.post(
                 self.base_url, 
-                headers=headers, 
+                headers=self._get_headers(), 
                 json=payload, 
                 timeout=30
             )
             response.raise_for_status()
             
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
+            prompt_cache_stats.record_openai_usage('deepseek', result)
 
             if 'choices' in result and len(result['choices']) > 0:
                 return result['choices'][0]['message']['content']
@@ -156,7 +184,34 @@ Aturan Respons:
         except Exception as e:
             return self._handle_request_error(e)
 
-    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "") -> str:
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        """Stream text response from DeepSeek via OpenRouter (stream: true)"""
+        emitted = False
+        try:
+            payload = self._build_text_payload(prompt, personality, history, stream=True)
+
+            with http_pool.post(
+                self.base_url,
+                headers=self._get_headers(),
+                json=payload,
+                timeout=30,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                
+                for text in http_pool.iter_chat_deltas(response):
+                    emitted = True
+                    yield text
+
+            if not emitted:
+                yield "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            error_message = self._handle_request_error(e)
+            yield f"\n\n{error_message}" if emitted else error_message
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
         """
         DeepSeek R1 tidak mendukung image analysis.
         Method ini hanya untuk konsistensi interface.
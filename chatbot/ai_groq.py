@@ -1,6 +1,16 @@
+import os
 import requests
-import base64
-from typing import Optional, Dict, List
+import functools
+from . import http_pool
+from . import fastjson
+from .fastjson import Base64Part
+from .context_cache import prompt_cache_stats
+from .usage_ledger import record_openai_usage
+from .history_window import build_history_turns, format_summary, history_budget
+from typing import Optional, Dict, Iterator, List
+
+# Endpoint provider bisa dialihkan (mock server benchmarks/mock_provider.py)
+GROQ_URL = os.getenv('CALAVERA_GROQ_URL', 'https://api.groq.com/openai/v1/chat/completions')
 
 
 def sanitize_ai_error(error_message: str) -> str:
@@ -27,18 +37,12 @@ def sanitize_ai_error(error_message: str) -> str:
     return "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
 
 
-class GroqAI:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.text_model = "llama-3.3-70b-versatile"
-        self.vision_model = "meta-llama/llama-4-scout-17b-16e-instruct"
-        self.base_url = "https://api.groq.com/openai/v1/chat/completions"
-
-    def _build_system_instruction(self, personality: str) -> str:
-        """Build system instruction untuk text generation"""
-        default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
-        
-        return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
+@functools.lru_cache(maxsize=32)
+def _system_instruction(personality: str) -> str:
+    """Build system instruction untuk text generation"""
+    default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
+    
+    return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
 
 Kepribadian: {personality if personality else default_personality}
 
@@ -75,11 +79,13 @@ Aturan Respons:
 - Gunakan bahasa Indonesia yang santai tapi tetap sopan.
 """
 
-    def _build_vision_system_instruction(self, personality: str) -> str:
-        """Build system instruction untuk vision analysis"""
-        default_personality = 'Ramah, sopan, dan membantu.'
-        
-        return f"""Kamu adalah asisten pintar untuk website kelas Calavera.
+
+@functools.lru_cache(maxsize=32)
+def _vision_system_instruction(personality: str) -> str:
+    """Build system instruction untuk vision analysis"""
+    default_personality = 'Ramah, sopan, dan membantu.'
+    
+    return f"""Kamu adalah asisten pintar untuk website kelas Calavera.
 
 Kepribadian: {personality if personality else default_personality}
 
@@ -100,23 +106,38 @@ Aturan respons:
 - Tetap pertahankan kepribadian {personality if personality else default_personality} dalam semua interaksi.
 """
 
-    def _build_chat_messages(self, prompt: str, personality: str, history: List[Dict] = None) -> List[Dict]:
+
+class GroqAI:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.text_model = "llama-3.3-70b-versatile"
+        self.vision_model = "meta-llama/llama-4-scout-17b-16e-instruct"
+        self.base_url = GROQ_URL
+        self.history_budget = history_budget('groq')
+
+    def _build_system_instruction(self, personality: str) -> str:
+        """Build system instruction untuk text generation (dirakit sekali per kepribadian)"""
+        return _system_instruction(personality)
+
+    def _build_vision_system_instruction(self, personality: str) -> str:
+        """Build system instruction untuk vision analysis (dirakit sekali per kepribadian)"""
+        return _vision_system_instruction(personality)
+
+    def _build_chat_messages(self, prompt: str, personality: str, history: List[Dict] = None,
+                             document: str = None) -> List[Dict]:
         """Build messages array untuk chat history"""
         system_instruction = self._build_system_instruction(personality)
+        if document:
+            # Dokumen ditaruh di prefix system (sebelum history) agar bisa di-cache provider
+            system_instruction = f"{system_instruction}\n\n{document}"
         messages = [{"role": "system", "content": system_instruction}]
 
         if history:
-            for msg in history[-5:]:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                if "[PENCARIAN]" in content or "[GAMBAR]" in content:
+            for msg in build_history_turns(history, self.history_budget):
+                if msg["role"] == "summary":
+                    messages.append({"role": "system", "content": format_summary(msg["content"])})
                     continue
-                    
-                messages.append({
-                    "role": role,
-                    "content": content
-                })
+                messages.append(msg)
 
         messages.append({
             "role": "user",
@@ -143,21 +164,28 @@ Aturan respons:
         else:
             return sanitize_ai_error(str(error))
 
-    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> str:
+    def _build_text_payload(self, prompt: str, personality: str, history: List[Dict] = None,
+                            stream: bool = False, document: str = None) -> Dict:
+        """Build payload chat/completions untuk text generation"""
+        messages = self._build_chat_messages(prompt, personality, history, document)
+        
+        return {
+            "model": self.text_model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 2048,
+            "top_p": 1,
+            "stream": stream,
+            **({"stream_options": {"include_usage": True}} if stream else {})
+        }
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
         """Generate text response from Groq"""
         try:
-            messages = self._build_chat_messages(prompt, personality, history)
-            
-            payload = {
-                "model": self.text_model,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2048,
-                "top_p": 1,
-                "stream": False
-            }
-
-            response = requests.post(
+            payload = self._build_text_payload(prompt, personality, history, document=document)
+
+            response = http_pool.post(
                 self.base_url,
                 json=payload,
                 headers=self._get_headers(),
@@ -165,7 +193,9 @@ Aturan respons:
             )
             response.raise_for_status()
             
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
+            prompt_cache_stats.record_openai_usage('groq', result)
 
             if 'choices' in result and len(result['choices']) > 0:
                 return result['choices'][0]['message']['content']
@@ -175,42 +205,73 @@ Aturan respons:
         except Exception as e:
             return self._handle_request_error(e)
 
-    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "") -> str:
-        """Analyze image with Groq Vision (Llama 4 Scout)"""
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        """Stream text response from Groq (stream: true)"""
+        emitted = False
         try:
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
-            system_instruction = self._build_vision_system_instruction(personality)
-            
-            payload = {
-                "model": self.vision_model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": system_instruction
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_b64}"
-                                }
+            payload = self._build_text_payload(prompt, personality, history, stream=True)
+
+            with http_pool.post(
+                self.base_url,
+                json=payload,
+                headers=self._get_headers(),
+                timeout=30,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                
+                for text in http_pool.iter_chat_deltas(response):
+                    emitted = True
+                    yield text
+
+            if not emitted:
+                yield "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            error_message = self._handle_request_error(e)
+            yield f"\n\n{error_message}" if emitted else error_message
+
+    def _build_vision_payload(self, image_data: bytes, prompt: str, personality: str,
+                              mime_type: str = "image/jpeg") -> Dict:
+        """Build payload chat/completions untuk vision analysis"""
+        system_instruction = self._build_vision_system_instruction(personality)
+        
+        return {
+            "model": self.vision_model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_instruction
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": prompt
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": Base64Part(image_data, prefix=f"data:{mime_type};base64,")
                             }
-                        ]
-                    }
-                ],
-                "temperature": 0.4,
-                "max_tokens": 2048,
-                "top_p": 1,
-                "stream": False
-            }
-
-            response = requests.post(
+                        }
+                    ]
+                }
+            ],
+            "temperature": 0.4,
+            "max_tokens": 2048,
+            "top_p": 1,
+            "stream": False
+        }
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
+        """Analyze image with Groq Vision (Llama 4 Scout)"""
+        try:
+            payload = self._build_vision_payload(image_data, prompt, personality, mime_type)
+
+            response = http_pool.post(
                 self.base_url,
                 json=payload,
                 headers=self._get_headers(),
@@ -218,7 +279,8 @@ Aturan respons:
             )
             response.raise_for_status()
 
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
 
             if 'choices' in result and len(result['choices']) > 0:
                 return result['choices'][0]['message']['content']
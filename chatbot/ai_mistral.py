@@ -1,7 +1,16 @@
+import os
 import requests
-import json
-import base64
-from typing import List, Dict
+import functools
+from . import http_pool
+from . import fastjson
+from .fastjson import Base64Part
+from .context_cache import prompt_cache_stats
+from .usage_ledger import record_openai_usage
+from .history_window import build_history_turns, format_summary, history_budget
+from typing import Iterator, List, Dict
+
+# Endpoint provider bisa dialihkan (mock server benchmarks/mock_provider.py)
+OPENROUTER_URL = os.getenv('CALAVERA_OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
 
 
 def sanitize_ai_error(error_message: str) -> str:
@@ -28,17 +37,12 @@ def sanitize_ai_error(error_message: str) -> str:
     return "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
 
 
-class MistralAI:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.model = "mistralai/mistral-small-3.2-24b-instruct:free"
-        self.base_url = "https://openrouter.ai/api/v1/chat/completions"
-
-    def _build_system_instruction(self, personality: str) -> str:
-        """Build system instruction untuk text generation"""
-        default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
-        
-        return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
+@functools.lru_cache(maxsize=32)
+def _system_instruction(personality: str) -> str:
+    """Build system instruction untuk text generation"""
+    default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
+    
+    return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
 
 Kepribadian: {personality if personality else default_personality}
 
@@ -75,31 +79,40 @@ Aturan Respons:
 - Gunakan bahasa Indonesia yang santai tapi tetap sopan.
 """
 
-    def _build_chat_messages(self, prompt: str, personality: str, history: List[Dict] = None) -> List[Dict]:
+
+class MistralAI:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.model = "mistralai/mistral-small-3.2-24b-instruct:free"
+        self.base_url = OPENROUTER_URL
+        self.history_budget = history_budget('mistral')
+
+    def _build_system_instruction(self, personality: str) -> str:
+        """Build system instruction untuk text generation (dirakit sekali per kepribadian)"""
+        return _system_instruction(personality)
+
+    def _build_chat_messages(self, prompt: str, personality: str, history: List[Dict] = None,
+                             document: str = None) -> List[Dict]:
         """Build messages array untuk chat history"""
         messages = []
 
         # System instruction sebagai message pertama
         system_instruction = self._build_system_instruction(personality)
+        if document:
+            # Dokumen ditaruh di prefix system (sebelum history) agar bisa di-cache provider
+            system_instruction = f"{system_instruction}\n\n{document}"
         messages.append({
             "role": "system",
             "content": system_instruction
         })
 
-        # Add history (5 terakhir)
+        # Add history (ringkasan + giliran terbaru sesuai budget token)
         if history:
-            for msg in history[-5:]:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                # Skip messages dengan tag khusus
-                if "[PENCARIAN]" in content or "[GAMBAR]" in content:
+            for msg in build_history_turns(history, self.history_budget):
+                if msg["role"] == "summary":
+                    messages.append({"role": "system", "content": format_summary(msg["content"])})
                     continue
-                    
-                messages.append({
-                    "role": role,
-                    "content": content
-                })
+                messages.append(msg)
 
         # Add current prompt
         messages.append({
@@ -120,34 +133,49 @@ Aturan Respons:
         else:
             return sanitize_ai_error(str(error))
 
-    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> str:
+    def _get_headers(self) -> Dict:
+        """Get request headers dengan authorization (OpenRouter)"""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://calavera-class.com",
+            "X-Title": "Calavera AI"
+        }
+
+    def _build_text_payload(self, prompt: str, personality: str, history: List[Dict] = None,
+                            stream: bool = False, document: str = None) -> Dict:
+        """Build payload chat/completions untuk text generation"""
+        messages = self._build_chat_messages(prompt, personality, history, document)
+        
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 2048
+        }
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        
+        return payload
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
         """Generate text response from Mistral"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://calavera-class.com",
-                "X-Title": "Calavera AI"
-            }
-            
-            messages = self._build_chat_messages(prompt, personality, history)
-            
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2048
-            }
+            payload = self._build_text_payload(prompt, personality, history, document=document)
 
-            response = requests.post(
+            response = http_pool.post(
                 self.base_url, 
-                headers=headers, 
+                headers=self._get_headers(), 
                 json=payload, 
                 timeout=30
             )
             response.raise_for_status()
             
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
+            prompt_cache_stats.record_openai_usage('mistral', result)
 
             if 'choices' in result and len(result['choices']) > 0:
                 return result['choices'][0]['message']['content']
@@ -157,64 +185,87 @@ Aturan Respons:
         except Exception as e:
             return self._handle_request_error(e)
 
-    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "") -> str:
-        """Analyze image with Mistral Vision"""
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        """Stream text response from Mistral via OpenRouter (stream: true)"""
+        emitted = False
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://calavera-class.com",
-                "X-Title": "Calavera AI"
-            }
+            payload = self._build_text_payload(prompt, personality, history, stream=True)
 
-            # ✅ Encode image ke base64
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
-            
-            # ✅ Build data URL (format yang Mistral butuhkan)
-            image_data_url = f"data:image/jpeg;base64,{image_b64}"
-            
-            # System instruction
-            system_instruction = self._build_system_instruction(personality)
-            
-            # ✅ Build messages dengan format Mistral Vision
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_instruction
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt if prompt else "Jelaskan apa yang ada di gambar ini"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_data_url
-                            }
+            with http_pool.post(
+                self.base_url,
+                headers=self._get_headers(),
+                json=payload,
+                timeout=30,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                
+                for text in http_pool.iter_chat_deltas(response):
+                    emitted = True
+                    yield text
+
+            if not emitted:
+                yield "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            error_message = self._handle_request_error(e)
+            yield f"\n\n{error_message}" if emitted else error_message
+
+    def _build_vision_payload(self, image_data: bytes, prompt: str, personality: str,
+                              mime_type: str = "image/jpeg") -> Dict:
+        """Build payload chat/completions untuk vision analysis"""
+        # ✅ Build data URL (format yang Mistral butuhkan), base64 di-encode per chunk saat body dikirim
+        image_data_url = Base64Part(image_data, prefix=f"data:{mime_type};base64,")
+        
+        # System instruction
+        system_instruction = self._build_system_instruction(personality)
+        
+        # ✅ Build messages dengan format Mistral Vision
+        messages = [
+            {
+                "role": "system",
+                "content": system_instruction
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt if prompt else "Jelaskan apa yang ada di gambar ini"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_data_url
                         }
-                    ]
-                }
-            ]
-            
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": 0.4,
-                "max_tokens": 2048
+                    }
+                ]
             }
+        ]
+        
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.4,
+            "max_tokens": 2048
+        }
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
+        """Analyze image with Mistral Vision"""
+        try:
+            payload = self._build_vision_payload(image_data, prompt, personality, mime_type)
 
-            response = requests.post(
+            response = http_pool.post(
                 self.base_url, 
-                headers=headers, 
+                headers=self._get_headers(), 
                 json=payload, 
                 timeout=45
             )
             response.raise_for_status()
 
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_openai_usage(result)
 
             if 'choices' in result and len(result['choices']) > 0:
                 return result['choices'][0]['message']['content']
@@ -1,7 +1,17 @@
+import os
 import requests
-import json
-import base64
-from typing import Optional, Dict, List
+import functools
+from . import http_pool
+from . import fastjson
+from .fastjson import Base64Part
+from .context_cache import gemini_context_cache, prompt_cache_stats
+from .usage_ledger import record_gemini_usage
+from .history_window import build_history_turns, format_summary, history_budget
+from typing import Optional, Dict, Iterator, List
+
+# Endpoint provider bisa dialihkan (mock server benchmarks/mock_provider.py)
+GEMINI_URL = os.getenv('CALAVERA_GEMINI_URL', 'https://generativelanguage.googleapis.com/v1beta/models')
+LANGSEARCH_URL = os.getenv('CALAVERA_LANGSEARCH_URL', 'https://api.langsearch.com/v1/web-search')
 
 
 def sanitize_ai_error(error_message: str) -> str:
@@ -28,18 +38,35 @@ def sanitize_ai_error(error_message: str) -> str:
     return "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
 
 
-class GeminiAI:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.text_model = "gemini-2.5-flash"
-        self.vision_model = "gemini-2.5-flash"
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models"
-
-    def _build_system_instruction(self, personality: str) -> str:
-        """Build system instruction untuk text generation"""
-        default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
-        
-        return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
+# Semua pesan ramah yang dikembalikan engine saat gagal (bukan jawaban AI).
+# Dipakai untuk membedakan error dari jawaban sukses, misalnya agar error
+# tidak ikut tersimpan di cache.
+AI_ERROR_MESSAGES = (
+    "🌐 Tidak bisa terhubung ke server AI. Pastikan koneksi internet kamu stabil, lalu coba lagi ya!",
+    "⏱️ Koneksi terputus atau timeout. Coba lagi dalam beberapa saat ya!",
+    "🔑 Ada masalah dengan sistem AI. Silakan hubungi admin kelas.",
+    "⚠️ Terlalu banyak permintaan ke AI. Tunggu sebentar lalu coba lagi ya!",
+    "🔧 Server AI sedang bermasalah. Coba lagi dalam beberapa menit ya!",
+    "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!",
+    "⚠️ Maaf, saya tidak bisa menganalisis gambar ini. Coba gambar lain ya!",
+    "⚠️ DeepSeek tidak mendukung analisis gambar. Silakan gunakan model Gemini atau Llama untuk fitur ini.",
+)
+
+
+def is_ai_error_response(text: str) -> bool:
+    """Cek apakah teks dari engine adalah pesan error (termasuk error di akhir stream)"""
+    if not text or not text.strip():
+        return True
+    stripped = text.strip()
+    return any(stripped.endswith(message) for message in AI_ERROR_MESSAGES)
+
+
+@functools.lru_cache(maxsize=32)
+def _system_instruction(personality: str) -> str:
+    """Build system instruction untuk text generation"""
+    default_personality = 'Ramah, sopan, dan membantu seperti teman sekelas yang cerdas.'
+    
+    return f"""Kamu adalah asisten pintar untuk website kelas Calavera SMAN 1 Selong.
 
 Kepribadian: {personality if personality else default_personality}
 
@@ -76,11 +103,13 @@ Aturan Respons:
 - Gunakan bahasa Indonesia yang santai tapi tetap sopan.
 """
 
-    def _build_vision_system_instruction(self, personality: str) -> str:
-        """Build system instruction untuk vision analysis"""
-        default_personality = 'Ramah, sopan, dan membantu.'
-        
-        return f"""Kamu adalah asisten pintar untuk website kelas Calavera.
+
+@functools.lru_cache(maxsize=32)
+def _vision_system_instruction(personality: str) -> str:
+    """Build system instruction untuk vision analysis"""
+    default_personality = 'Ramah, sopan, dan membantu.'
+    
+    return f"""Kamu adalah asisten pintar untuk website kelas Calavera.
 
 Kepribadian: {personality if personality else default_personality}
 
@@ -101,24 +130,40 @@ Aturan respons:
 - Tetap pertahankan kepribadian {personality if personality else default_personality} dalam semua interaksi.
 """
 
+
+class GeminiAI:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.text_model = "gemini-2.5-flash"
+        self.vision_model = "gemini-2.5-flash"
+        self.base_url = GEMINI_URL
+        self.history_budget = history_budget('gemini')
+
+    def _build_system_instruction(self, personality: str) -> str:
+        """Build system instruction untuk text generation (dirakit sekali per kepribadian)"""
+        return _system_instruction(personality)
+
+    def _build_vision_system_instruction(self, personality: str) -> str:
+        """Build system instruction untuk vision analysis (dirakit sekali per kepribadian)"""
+        return _vision_system_instruction(personality)
+
     def _build_chat_contents(self, prompt: str, history: List[Dict] = None) -> List[Dict]:
         """Build contents array untuk chat history"""
         contents = []
 
         if history:
-            for msg in history[-5:]:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                if role == "assistant":
+            for msg in build_history_turns(history, self.history_budget):
+                role = msg["role"]
+                text = msg["content"]
+
+                if role == "summary":
+                    role, text = "user", format_summary(msg["content"])
+                elif role == "assistant":
                     role = "model"
-                
-                if "[PENCARIAN]" in content or "[GAMBAR]" in content:
-                    continue
-                    
+
                 contents.append({
                     "role": role,
-                    "parts": [{"text": content}]
+                    "parts": [{"text": text}]
                 })
 
         contents.append({
@@ -139,32 +184,62 @@ Aturan respons:
         else:
             return sanitize_ai_error(str(error))
 
-    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> str:
+    def _build_text_payload(self, prompt: str, personality: str, history: List[Dict] = None,
+                            document: str = None, cached_content: str = None) -> Dict:
+        """Build payload generateContent untuk text generation"""
+        contents = self._build_chat_contents(prompt, history)
+        generation_config = {
+            "temperature": 0.7,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": 2048
+        }
+        
+        if cached_content:
+            # System instruction dan dokumen sudah tersimpan di cachedContents
+            return {
+                "cachedContent": cached_content,
+                "contents": contents,
+                "generationConfig": generation_config
+            }
+        
+        parts = [{"text": self._build_system_instruction(personality)}]
+        if document:
+            # Dokumen di prefix yang stabil agar kena implicit caching Gemini
+            parts.append({"text": document})
+        
+        return {
+            "system_instruction": {
+                "parts": parts
+            },
+            "contents": contents,
+            "generationConfig": generation_config
+        }
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
         """Generate text response from Gemini"""
         try:
             url = f"{self.base_url}/{self.text_model}:generateContent?key={self.api_key}"
-            
-            system_instruction = self._build_system_instruction(personality)
-            contents = self._build_chat_contents(prompt, history)
-            
-            payload = {
-                "system_instruction": {
-                    "parts": [{"text": system_instruction}]
-                },
-                "contents": contents,
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 2048
-                }
-            }
+            cached_content = None
+            if document:
+                cached_content = gemini_context_cache.resolve(
+                    self, self._build_system_instruction(personality), document
+                )
+            payload = self._build_text_payload(prompt, personality, history, document, cached_content)
 
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = http_pool.post(url, json=payload, headers=headers, timeout=30)
+            if cached_content and response.status_code in (400, 403, 404):
+                # Cache sudah dihapus/kedaluwarsa di sisi Gemini: kirim ulang inline
+                gemini_context_cache.forget(cached_content)
+                payload = self._build_text_payload(prompt, personality, history, document)
+                response = http_pool.post(url, json=payload, headers=headers, timeout=30)
             response.raise_for_status()
             
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_gemini_usage(result)
+            prompt_cache_stats.record_gemini_usage(result)
 
             if 'candidates' in result and len(result['candidates']) > 0:
                 return result['candidates'][0]['content']['parts'][0]['text']
@@ -174,43 +249,80 @@ Aturan respons:
         except Exception as e:
             return self._handle_request_error(e)
 
-    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "") -> str:
-        """Analyze image with Gemini Vision"""
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        """Stream text response from Gemini (streamGenerateContent + SSE)"""
+        emitted = False
         try:
-            url = f"{self.base_url}/{self.vision_model}:generateContent?key={self.api_key}"
+            url = f"{self.base_url}/{self.text_model}:streamGenerateContent?alt=sse&key={self.api_key}"
+            payload = self._build_text_payload(prompt, personality, history)
 
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
-            system_instruction = self._build_vision_system_instruction(personality)
-            
-            payload = {
-                "system_instruction": {
-                    "parts": [{"text": system_instruction}]
-                },
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [
-                            {"text": prompt},
-                            {"inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_b64
-                            }}
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.4,
-                    "topK": 32,
-                    "topP": 0.95,
-                    "maxOutputTokens": 2048
+            headers = {"Content-Type": "application/json"}
+            with http_pool.post(url, json=payload, headers=headers, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                
+                usage = None
+                for data in http_pool.iter_sse_data(response):
+                    chunk = fastjson.loads(data)
+                    # usageMetadata kumulatif: yang terakhir berisi total
+                    usage = chunk if chunk.get('usageMetadata') else usage
+                    for candidate in chunk.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            text = part.get('text', '')
+                            if text:
+                                emitted = True
+                                yield text
+                record_gemini_usage(usage)
+
+            if not emitted:
+                yield "⚠️ Maaf, saya tidak bisa memproses permintaan kamu saat ini. Coba lagi ya!"
+
+        except Exception as e:
+            error_message = self._handle_request_error(e)
+            yield f"\n\n{error_message}" if emitted else error_message
+
+    def _build_vision_payload(self, image_data: bytes, prompt: str, personality: str,
+                              mime_type: str = "image/jpeg") -> Dict:
+        """Build payload generateContent untuk vision analysis"""
+        system_instruction = self._build_vision_system_instruction(personality)
+        
+        return {
+            "system_instruction": {
+                "parts": [{"text": system_instruction}]
+            },
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": [
+                        {"text": prompt},
+                        {"inline_data": {
+                            "mime_type": mime_type,
+                            # Base64 di-encode per chunk saat body dikirim
+                            "data": Base64Part(image_data)
+                        }}
+                    ]
                 }
+            ],
+            "generationConfig": {
+                "temperature": 0.4,
+                "topK": 32,
+                "topP": 0.95,
+                "maxOutputTokens": 2048
             }
+        }
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
+        """Analyze image with Gemini Vision"""
+        try:
+            url = f"{self.base_url}/{self.vision_model}:generateContent?key={self.api_key}"
+            payload = self._build_vision_payload(image_data, prompt, personality, mime_type)
 
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=payload, headers=headers, timeout=45)
+            response = http_pool.post(url, json=payload, headers=headers, timeout=45)
             response.raise_for_status()
 
-            result = response.json()
+            result = fastjson.loads(response.content)
+            record_gemini_usage(result)
 
             if 'candidates' in result and len(result['candidates']) > 0:
                 return result['candidates'][0]['content']['parts'][0]['text']
@@ -224,7 +336,7 @@ Aturan respons:
 class LangSearchAPI:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.base_url = "https://api.langsearch.com/v1/web-search"
+        self.base_url = LANGSEARCH_URL
     
     def _handle_request_error(self, error) -> Dict:
         """Handle berbagai jenis error dari requests"""
@@ -237,23 +349,25 @@ class LangSearchAPI:
         else:
             return {"error": sanitize_ai_error(str(error))}
     
+    def _get_headers(self) -> Dict:
+        """Get request headers dengan authorization"""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
     def search(self, query: str, num_results: int = 5) -> Dict:
         """Search internet using LangSearch API"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
             payload = {
                 "query": query,
                 "num_results": num_results
             }
             
-            response = requests.post(self.base_url, json=payload, headers=headers, timeout=15)
+            response = http_pool.post(self.base_url, json=payload, headers=self._get_headers(), timeout=15)
             response.raise_for_status()
             
-            return response.json()
+            return fastjson.loads(response.content)
             
         except Exception as e:
             return self._handle_request_error(e)
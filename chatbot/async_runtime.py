@@ -0,0 +1,254 @@
+import os
+import asyncio
+import queue
+import threading
+import contextvars
+import concurrent.futures
+import httpx
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+from .fastjson import JSONBody, json_request_kwargs
+from .http_pool import get_origin, POOL_MAXSIZE
+from .resilience import async_send_with_retry
+from .rate_limiter import rate_limiter, provider_for_url
+from .metrics import metrics
+from .tracing import tracer
+from .replay import cassette, AsyncCassetteTransport
+
+
+ASYNC_MAX_CONNECTIONS = int(os.getenv('CALAVERA_ASYNC_MAX_CONNECTIONS', '256'))
+ASYNC_MAX_KEEPALIVE = int(os.getenv('CALAVERA_ASYNC_MAX_KEEPALIVE', str(POOL_MAXSIZE)))
+
+_STREAM_END = object()
+# Sama seperti transport sync: gagal connect di-retry, timeout lain dihitung gagal
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+FAILURE_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+
+
+class AsyncRunner:
+    """
+    Satu event loop per proses yang berjalan di background thread.
+
+    Thread request Flask (sync) menunggu Future, sementara semua I/O ke
+    provider AI dimultipleks di loop ini (satu pool koneksi, pembatalan
+    request yang kalah hedging). Setiap request yang menunggu tetap memegang
+    satu thread gunicorn: kapasitas per worker = GUNICORN_THREADS.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        """Thread dan loop tidak ikut ter-copy saat gunicorn fork"""
+        if self._pid != os.getpid():
+            self._loop = None
+            self._thread = None
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Ambil event loop, jalankan thread-nya saat pertama dipakai"""
+        self._check_fork()
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever,
+                                              name='calavera-async-loop', daemon=True)
+                    thread.start()
+                    self._thread = thread
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """Jadwalkan coroutine di loop bersama, kembalikan Future thread-safe"""
+        return asyncio.run_coroutine_threadsafe(with_caller_context(coro), self.loop)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None):
+        """Jalankan coroutine dan tunggu hasilnya dari thread sync"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def iterate(self, agen: AsyncIterator) -> Iterator:
+        """
+        Ubah async generator menjadi iterator sync (untuk SSE di Flask).
+        Jika consumer berhenti (browser menutup koneksi), task di loop dibatalkan.
+        """
+        items: queue.Queue = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            except BaseException as e:
+                items.put(e)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+            finally:
+                items.put(_STREAM_END)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = items.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+
+def with_caller_context(coro: Awaitable) -> Awaitable:
+    """
+    Bawa contextvars thread pemanggil (span tracing, pencatat usage) ke
+    coroutine yang jalan di event loop, seperti asyncio.to_thread ke arah sebaliknya.
+    """
+    context = contextvars.copy_context()
+
+    async def run():
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+    return run()
+
+
+def attempt_kwargs(kwargs: Dict) -> Dict:
+    """AsyncClient butuh async iterable baru untuk body stream di setiap percobaan"""
+    content = kwargs.get('content')
+    if isinstance(content, JSONBody):
+        return dict(kwargs, content=content.__aiter__())
+    return kwargs
+
+
+class AsyncPooledTransport:
+    """
+    Versi async dari PooledTransport: satu httpx.AsyncClient per host provider
+    dengan koneksi keep-alive. Client terikat ke event loop AsyncRunner.
+    """
+
+    def __init__(self, max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 max_keepalive: int = ASYNC_MAX_KEEPALIVE):
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._pid = os.getpid()
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """Ambil (atau buat) client untuk host dari URL. Dipanggil dari dalam loop."""
+        if self._pid != os.getpid():
+            self._clients = {}
+            self._pid = os.getpid()
+        origin = get_origin(url)
+        client = self._clients.get(origin)
+        if client is None:
+            if cassette.enabled:
+                client = httpx.AsyncClient(transport=AsyncCassetteTransport(
+                    cassette, httpx.AsyncHTTPTransport(limits=self.limits)))
+            else:
+                client = httpx.AsyncClient(limits=self.limits)
+            self._clients[origin] = client
+        return client
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """POST async lewat client milik host tujuan (dengan circuit breaker + retry)"""
+        client = self.get_client(url)
+        provider = provider_for_url(url) or urlsplit(url).hostname
+        payload = kwargs.get('json')
+        kwargs = json_request_kwargs(kwargs, content_key='content')
+
+        async def send():
+            lease = await rate_limiter.acquire_async(url, payload)
+            with metrics.timer('calavera_provider_request_seconds', provider=provider, status='error') as labels, \
+                    tracer.span('http.request', provider=provider, method='POST'):
+                try:
+                    response = await client.post(url, **attempt_kwargs(kwargs))
+                except BaseException:
+                    await rate_limiter.release_async(lease)
+                    raise
+                labels['status'] = response.status_code
+                tracer.annotate(status=response.status_code)
+            await rate_limiter.release_async(lease, response.status_code)
+            return response
+
+        async def close(response):
+            await response.aclose()
+
+        return await async_send_with_retry(
+            get_origin(url), send,
+            RETRYABLE_ERRORS, FAILURE_ERRORS, close
+        )
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        """Async context manager untuk response streaming (retry hanya sebelum body dibaca)"""
+        client = self.get_client(url)
+        provider = provider_for_url(url) or urlsplit(url).hostname
+        stack = AsyncExitStack()
+        payload = kwargs.get('json')
+        kwargs = json_request_kwargs(kwargs, content_key='content')
+
+        async def send():
+            lease = await rate_limiter.acquire_async(url, payload)
+            with metrics.timer('calavera_provider_request_seconds', provider=provider, status='error') as labels, \
+                    tracer.span('http.request', provider=provider, method=method, stream=True):
+                try:
+                    response = await stack.enter_async_context(client.stream(method, url, **attempt_kwargs(kwargs)))
+                except BaseException:
+                    await rate_limiter.release_async(lease)
+                    raise
+                labels['status'] = response.status_code
+                tracer.annotate(status=response.status_code)
+            # Slot concurrency dilepas saat stream selesai dibaca / ditutup
+            stack.push_async_callback(rate_limiter.release_async, lease, response.status_code)
+            return response
+
+        async def close(response):
+            await stack.aclose()
+
+        try:
+            response = await async_send_with_retry(
+                get_origin(url), send, RETRYABLE_ERRORS, FAILURE_ERRORS, close
+            )
+            yield response
+        finally:
+            await stack.aclose()
+
+    async def aclose(self):
+        """Tutup semua client (dipakai saat shutdown)"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+async def aiter_sse_data(response: httpx.Response) -> AsyncIterator[str]:
+    """Versi async dari http_pool.iter_sse_data untuk response httpx"""
+    data_lines = []
+    async for line in response.aiter_lines():
+        if line == '':
+            if data_lines:
+                yield '\n'.join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith(':'):
+            continue
+        if line.startswith('data:'):
+            data_lines.append(line[5:].lstrip(' '))
+    if data_lines:
+        yield '\n'.join(data_lines)
+
+
+runner = AsyncRunner()
+transport = AsyncPooledTransport()
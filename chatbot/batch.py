@@ -0,0 +1,60 @@
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List
+
+
+# Batas jumlah prompt per batch dan panggilan provider yang jalan bersamaan per batch.
+# Batas per provider (RPM/TPM/concurrency AIMD) tetap diatur rate_limiter di http_pool.
+BATCH_MAX_PROMPTS = int(os.getenv('CALAVERA_BATCH_MAX_PROMPTS', '50'))
+BATCH_CONCURRENCY = int(os.getenv('CALAVERA_BATCH_CONCURRENCY', '6'))
+BATCH_PROMPT_MAX_CHARS = 5000
+
+
+def parse_batch_prompts(prompts) -> List[str]:
+    """Validasi daftar prompt dari body request /api/batch"""
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError("⚠️ Daftar prompt tidak boleh kosong")
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        raise ValueError(f"⚠️ Terlalu banyak prompt! Maksimal {BATCH_MAX_PROMPTS} per batch.")
+
+    cleaned = []
+    for index, prompt in enumerate(prompts, 1):
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError(f"⚠️ Prompt ke-{index} kosong")
+        if len(prompt) > BATCH_PROMPT_MAX_CHARS:
+            raise ValueError(f"⚠️ Prompt ke-{index} terlalu panjang! Maksimal {BATCH_PROMPT_MAX_CHARS} karakter.")
+        cleaned.append(prompt.strip())
+    return cleaned
+
+
+def run_batch(items: List, generate: Callable[[object], str],
+              concurrency: int = BATCH_CONCURRENCY) -> Iterator[Dict]:
+    """
+    Jalankan generate(item) untuk semua item (prompt /api/batch, atau nama
+    model /api/compare) secara paralel dan yield hasilnya sesuai urutan
+    selesai (bukan urutan input), masing-masing dengan index aslinya.
+    Jika client berhenti membaca, item yang belum dimulai dibatalkan.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))),
+                                  thread_name_prefix='calavera-batch')
+
+    def timed(item):
+        start = time.perf_counter()
+        return generate(item), time.perf_counter() - start
+
+    # Setiap item membawa salinan context pemanggil (span tracing ikut ke thread pool)
+    futures = {executor.submit(contextvars.copy_context().run, timed, item): index
+               for index, item in enumerate(items)}
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                response, seconds = future.result()
+            except Exception as e:
+                yield {"index": index, "error": str(e)}
+            else:
+                yield {"index": index, "response": response, "seconds": round(seconds, 2)}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,198 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import requests
+
+from . import fastjson, http_pool
+
+
+CONTEXT_CACHE_ENABLED = os.getenv('CALAVERA_CONTEXT_CACHE', '1') == '1'
+# Gemini menolak cachedContents di bawah batas token minimum model
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv('CALAVERA_GEMINI_CACHE_MIN_TOKENS', '1024'))
+CONTEXT_CACHE_TTL = int(os.getenv('CALAVERA_CONTEXT_CACHE_TTL', '600'))
+# Jika pembuatan cache ditolak permanen (model tidak didukung, konten terlalu kecil), coba lagi setelah ini
+CONTEXT_CACHE_RETRY_AFTER = int(os.getenv('CALAVERA_CONTEXT_CACHE_RETRY_AFTER', '1800'))
+# Gagal sementara (429/5xx, jaringan, antrean rate limiter penuh): jeda singkat, berlipat jika berulang
+CONTEXT_CACHE_BACKOFF = int(os.getenv('CALAVERA_CONTEXT_CACHE_BACKOFF', '30'))
+# Cache dianggap habis sedikit lebih awal agar tidak kedaluwarsa di tengah request
+EXPIRY_MARGIN = 30
+REGISTRY_SIZE = 64
+
+
+def format_document(filename: str, text: str) -> str:
+    """Blok dokumen yang ditaruh sebagai prefix stabil setelah system instruction"""
+    return f"""File: {filename}
+
+Isi File:
+{text}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Perkiraan kasar ~4 karakter per token"""
+    return len(text or '') // 4
+
+
+class PromptCacheStats:
+    """Token prompt vs token yang dilayani dari cache provider, per provider"""
+
+    def __init__(self):
+        self._providers: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, prompt_tokens: int, cached_tokens: int):
+        with self._lock:
+            stats = self._providers.setdefault(provider, {
+                "requests": 0, "cache_hits": 0, "prompt_tokens": 0, "cached_tokens": 0
+            })
+            stats["requests"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+            if cached_tokens:
+                stats["cache_hits"] += 1
+        if cached_tokens:
+            print(f"📊 [CONTEXT CACHE] {provider} HIT {cached_tokens}/{prompt_tokens} token prompt dari cache")
+
+    def record_openai_usage(self, provider: str, result: Dict):
+        """usage format OpenAI: prompt_tokens_details.cached_tokens (DeepSeek: prompt_cache_hit_tokens)"""
+        usage = (result or {}).get('usage') or {}
+        if not usage:
+            return
+        details = usage.get('prompt_tokens_details') or {}
+        cached = details.get('cached_tokens') or usage.get('prompt_cache_hit_tokens') or 0
+        self.record(provider, usage.get('prompt_tokens') or 0, cached)
+
+    def record_gemini_usage(self, result: Dict):
+        """usageMetadata Gemini: cachedContentTokenCount (eksplisit maupun implisit)"""
+        usage = (result or {}).get('usageMetadata') or {}
+        if not usage:
+            return
+        self.record('gemini', usage.get('promptTokenCount') or 0, usage.get('cachedContentTokenCount') or 0)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            result = {}
+            for provider, stats in self._providers.items():
+                result[provider] = dict(stats)
+                result[provider]["cached_token_ratio"] = (
+                    round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+                )
+            return {"pid": os.getpid(), "providers": result}
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """4xx selain 408/429 (model tidak mendukung caching, konten di bawah minimum) tidak akan sembuh sendiri"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return 400 <= status < 500 and status not in (408, 429)
+    return False
+
+
+class GeminiContextCache:
+    """
+    Registry cachedContents Gemini untuk system instruction + dokumen.
+
+    Dokumen yang sama (hash SHA-256 dari model + instruction + isi) memakai
+    cache yang sama selama TTL, jadi pertanyaan lanjutan tentang file yang
+    sama tidak mengirim ulang ribuan token dokumen. Dokumen yang terlalu
+    kecil tetap dikirim inline dan mengandalkan implicit caching Gemini.
+    """
+
+    def __init__(self, ttl: int = CONTEXT_CACHE_TTL, min_tokens: int = GEMINI_CACHE_MIN_TOKENS):
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disabled_until = 0.0
+        self._transient_failures = 0
+        self.created = 0
+        self.reused = 0
+        self.failures = 0
+
+    def _cache_url(self, engine) -> str:
+        root = engine.base_url.rsplit('/models', 1)[0]
+        return f"{root}/cachedContents?key={engine.api_key}"
+
+    def resolve(self, engine, system_instruction: str, document: str) -> Optional[str]:
+        """Nama cachedContents untuk dokumen ini, dibuat jika belum ada. None = kirim inline."""
+        if not CONTEXT_CACHE_ENABLED or not document:
+            return None
+        if estimate_tokens(system_instruction) + estimate_tokens(document) < self.min_tokens:
+            return None
+
+        now = time.time()
+        if now < self._disabled_until:
+            return None
+
+        key = hashlib.sha256('\x1f'.join([engine.text_model, system_instruction, document])
+                             .encode('utf-8')).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] - EXPIRY_MARGIN > now:
+                self._entries.move_to_end(key)
+                self.reused += 1
+                print(f"📊 [CONTEXT CACHE] gemini pakai {entry[0]} (sisa {int(entry[1] - now)}s)")
+                return entry[0]
+
+        payload = {
+            "model": f"models/{engine.text_model}",
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "contents": [{"role": "user", "parts": [{"text": document}]}],
+            "ttl": f"{self.ttl}s"
+        }
+        try:
+            response = http_pool.post(self._cache_url(engine), json=payload,
+                                      headers={"Content-Type": "application/json"}, timeout=30)
+            response.raise_for_status()
+            result = fastjson.loads(response.content)
+        except Exception as e:
+            self.failures += 1
+            if is_permanent_failure(e):
+                pause = CONTEXT_CACHE_RETRY_AFTER
+            else:
+                self._transient_failures += 1
+                pause = min(CONTEXT_CACHE_RETRY_AFTER, CONTEXT_CACHE_BACKOFF * 2 ** (self._transient_failures - 1))
+            self._disabled_until = time.time() + pause
+            print(f"⚠️ [CONTEXT CACHE] cachedContents gagal dibuat ({e.__class__.__name__}), "
+                  f"dokumen dikirim inline selama {pause}s")
+            return None
+        self._transient_failures = 0
+
+        name = result.get('name')
+        if not name:
+            return None
+        tokens = (result.get('usageMetadata') or {}).get('totalTokenCount', 0)
+        with self._lock:
+            self._entries[key] = (name, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > REGISTRY_SIZE:
+                self._entries.popitem(last=False)
+            self.created += 1
+        print(f"📊 [CONTEXT CACHE] gemini cachedContents dibuat: {name} | {tokens} token | TTL {self.ttl}s")
+        return name
+
+    def forget(self, name: str):
+        """Buang cache yang ditolak Gemini (sudah dihapus atau kedaluwarsa lebih awal)"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry[0] == name:
+                    del self._entries[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            return {
+                "active": sum(1 for _, expires_at in self._entries.values() if expires_at > now),
+                "created": self.created,
+                "reused": self.reused,
+                "failures": self.failures,
+                "ttl": self.ttl,
+                "disabled_for": max(0, int(self._disabled_until - now))
+            }
+
+
+prompt_cache_stats = PromptCacheStats()
+gemini_context_cache = GeminiContextCache()
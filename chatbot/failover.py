@@ -0,0 +1,129 @@
+import os
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+from .ai_utils import is_ai_error_response
+from .http_pool import get_origin
+from .resilience import get_breaker
+
+
+FAILOVER_ENABLED = os.getenv('CALAVERA_FAILOVER', '1') == '1'
+# Urutan cadangan saat provider utama gagal / circuit-nya terbuka
+FAILOVER_ORDER = os.getenv('CALAVERA_FAILOVER_ORDER', 'gemini,groq,mistral')
+# Engine yang bisa membaca gambar (DeepSeek hanya teks)
+VISION_MODELS = {'gemini', 'groq', 'mistral'}
+
+
+def parse_failover_order(value: str) -> List[str]:
+    """Parse 'gemini,groq,mistral' menjadi list nama model"""
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class FailoverStats:
+    """Hitung berapa kali jawaban datang dari provider cadangan"""
+
+    def __init__(self):
+        self._models: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, requested: str, served_by: str = None):
+        with self._lock:
+            stats = self._models.setdefault(requested, {
+                "requests": 0, "failovers": 0, "failures": 0, "served_by": {}
+            })
+            stats["requests"] += 1
+            if served_by is None:
+                stats["failures"] += 1
+                return
+            if served_by != requested:
+                stats["failovers"] += 1
+            stats["served_by"][served_by] = stats["served_by"].get(served_by, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"pid": os.getpid(),
+                    "models": {name: dict(stats, served_by=dict(stats["served_by"]))
+                               for name, stats in self._models.items()}}
+
+
+failover_stats = FailoverStats()
+
+
+def circuit_open(engine) -> bool:
+    """True jika circuit breaker host engine ini sedang menolak request"""
+    base_url = getattr(engine, 'base_url', None)
+    return bool(base_url) and get_breaker(get_origin(base_url)).is_open()
+
+
+class FailoverEngine:
+    """
+    Engine pembungkus dengan failover otomatis.
+
+    Engine dicoba berurutan (model pilihan user dulu, lalu urutan
+    CALAVERA_FAILOVER_ORDER). Engine yang circuit breaker-nya terbuka atau
+    API key-nya kosong dilewati; jawaban error dari satu engine membuat
+    engine berikutnya dicoba. Jika semua gagal, pesan error terakhir dikembalikan.
+    """
+
+    def __init__(self, requested: str, chain: List[Tuple[str, object]]):
+        self.requested = requested
+        self.chain = chain
+        self.primary = chain[0][1]
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def _candidates(self, vision: bool = False) -> List[Tuple[str, object]]:
+        candidates = []
+        for index, (name, engine) in enumerate(self.chain):
+            if index > 0:
+                if vision and name not in VISION_MODELS:
+                    continue
+                if not getattr(engine, 'api_key', None):
+                    continue
+            if circuit_open(engine) and index < len(self.chain) - 1:
+                print(f"⚠️ [FAILOVER] {name} dilewati (circuit breaker terbuka)")
+                continue
+            candidates.append((name, engine))
+        return candidates or self.chain[:1]
+
+    def _call(self, method: str, args, vision: bool = False) -> str:
+        result = None
+        for name, engine in self._candidates(vision):
+            result = getattr(engine, method)(*args)
+            if not is_ai_error_response(result):
+                if name != self.requested:
+                    print(f"📊 [FAILOVER] {self.requested} -> {name}")
+                failover_stats.record(self.requested, name)
+                return result
+        failover_stats.record(self.requested)
+        return result
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
+        return self._call('generate_text', (prompt, personality, history, document))
+
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        """
+        Failover hanya sebelum token pertama: engine yang langsung gagal
+        (satu-satunya chunk adalah pesan error) diganti engine berikutnya.
+        """
+        last_error = None
+        for name, engine in self._candidates():
+            chunks = iter(engine.stream_text(prompt, personality, history))
+            first = next(chunks, '')
+            if is_ai_error_response(first) and next(chunks, None) is None:
+                last_error = first
+                continue
+            if name != self.requested:
+                print(f"📊 [FAILOVER] {self.requested} -> {name} (stream)")
+            failover_stats.record(self.requested, name)
+            yield first
+            yield from chunks
+            return
+        failover_stats.record(self.requested)
+        yield last_error
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
+        return self._call('analyze_image', (image_data, prompt, personality, mime_type), vision=True)
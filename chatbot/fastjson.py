@@ -0,0 +1,159 @@
+import json
+import uuid
+import base64
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # fallback ke json bawaan (lebih lambat, hasil sama)
+    orjson = None
+
+
+# Potongan gambar mentah per chunk base64 (kelipatan 3 agar tidak ada padding di tengah)
+BASE64_CHUNK_BYTES = 3 * 16 * 1024
+
+
+def dumps(obj, default: Optional[Callable] = None, sort_keys: bool = False,
+          passthrough_datetime: bool = False) -> bytes:
+    """
+    Serialize ke JSON UTF-8 (bytes) dengan orjson jika tersedia.
+    passthrough_datetime: datetime/date diserahkan ke default (orjson sendiri menulis ISO 8601).
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if passthrough_datetime:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default,
+                      sort_keys=sort_keys).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]):
+    """Parse JSON dari response provider (bytes atau str)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Base64Part:
+    """
+    Penanda data biner di dalam payload yang baru di-encode base64 saat body
+    dikirim, potongan demi potongan. Dipakai builder vision sebagai ganti
+    base64.b64encode(...).decode() sehingga string base64 utuh tidak pernah dibuat.
+    """
+
+    __slots__ = ('buffer', 'prefix')
+
+    def __init__(self, buffer, prefix: str = ''):
+        self.buffer = memoryview(buffer)
+        self.prefix = prefix.encode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self.prefix) + (len(self.buffer) + 2) // 3 * 4
+
+    def chunks(self) -> Iterator[bytes]:
+        if self.prefix:
+            yield self.prefix
+        for start in range(0, len(self.buffer), BASE64_CHUNK_BYTES):
+            yield base64.b64encode(self.buffer[start:start + BASE64_CHUNK_BYTES])
+
+
+class JSONBody:
+    """
+    Body request JSON yang di-stream: kerangka payload di-serialize sekali,
+    bagian Base64Part di-encode per chunk saat dikirim. Punya __len__ sehingga
+    requests/httpx mengirim Content-Length (bukan chunked), dan bisa diulang
+    untuk retry.
+    """
+
+    def __init__(self, segments: List[Union[bytes, Base64Part]]):
+        self.segments = segments
+        self.length = sum(len(segment) for segment in segments)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        for segment in self.segments:
+            if isinstance(segment, Base64Part):
+                yield from segment.chunks()
+            elif segment:
+                yield segment
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for chunk in self:
+            yield chunk
+
+
+def encode_body(payload) -> Union[bytes, JSONBody]:
+    """Payload dict -> bytes JSON, atau JSONBody jika berisi Base64Part"""
+    parts: List[Base64Part] = []
+    marker = uuid.uuid4().hex
+
+    def default(obj):
+        if isinstance(obj, Base64Part):
+            parts.append(obj)
+            return f"{marker}:{len(parts) - 1}"
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    encoded = dumps(payload, default=default)
+    if not parts:
+        return encoded
+
+    segments: List[Union[bytes, Base64Part]] = []
+    for index, part in enumerate(parts):
+        head, encoded = encoded.split(f"{marker}:{index}".encode('ascii'), 1)
+        segments.extend([head, part])
+    segments.append(encoded)
+    return JSONBody(segments)
+
+
+def json_request_kwargs(kwargs: dict, content_key: str = 'data') -> dict:
+    """
+    Ganti json= menjadi body hasil encode_body (data= untuk requests,
+    content= untuk httpx) plus header Content-Type/Content-Length.
+    """
+    if kwargs.get('json') is None:
+        return kwargs
+    kwargs = dict(kwargs)
+    body = encode_body(kwargs.pop('json'))
+    headers = dict(kwargs.get('headers') or {})
+    headers['Content-Type'] = 'application/json'
+    headers['Content-Length'] = str(len(body))
+    kwargs['headers'] = headers
+    kwargs[content_key] = body
+    return kwargs
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() Flask dengan orjson: langsung ke bytes, tanpa encode ulang.
+
+    Perilaku DefaultJSONProvider dipertahankan: datetime/date lewat default
+    Flask (HTTP date), sort_keys dipakai, dan jika output tidak compact
+    (compact=False, atau debug dengan compact=None) response dibuat Flask
+    dengan indentasi seperti biasa.
+    """
+
+    def _dumps(self, obj) -> bytes:
+        return dumps(obj, default=self.default, sort_keys=self.sort_keys, passthrough_datetime=True)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps(obj) + b"\n", mimetype=self.mimetype)
@@ -1,7 +1,8 @@
-import PyPDF2
-import docx
 from typing import Optional
 
+from .uploads import open_buffer
+from .tracing import tracer
+
 
 class FileParser:
     """Parser untuk ekstraksi teks dari berbagai format file"""
@@ -18,18 +19,31 @@ class FileParser:
                 return f.read()
     
     @staticmethod
-    def parse_pdf(file_path: str) -> str:
-        """Parse PDF file"""
+    @tracer.traced()
+    def parse_txt_buffer(buffer) -> str:
+        """Parse TXT langsung dari buffer upload"""
+        try:
+            return str(buffer, 'utf-8')
+        except UnicodeDecodeError:
+            # Fallback ke latin-1 jika UTF-8 gagal
+            return str(buffer, 'latin-1')
+    
+    @staticmethod
+    @tracer.traced()
+    def parse_pdf(file_path) -> str:
+        """Parse PDF file (path atau file-like object)"""
+        # Diimpor saat pertama dipakai: PyPDF2/python-docx memperlambat start worker
+        import PyPDF2
+        
         try:
             text = ""
-            with open(file_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                
-                # Ekstrak teks dari semua halaman
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
+            pdf_reader = PyPDF2.PdfReader(file_path)
+            
+            # Ekstrak teks dari semua halaman
+            for page in pdf_reader.pages:
+                page_text = page.extract_text()
+                if page_text:
+                    text += page_text + "\n"
             
             if not text.strip():
                 return "⚠️ File PDF ini tidak mengandung teks yang bisa dibaca (mungkin gambar scan)."
@@ -40,8 +54,11 @@ class FileParser:
             return f"⚠️ Gagal membaca PDF: {str(e)}"
     
     @staticmethod
-    def parse_docx(file_path: str) -> str:
-        """Parse DOCX file"""
+    @tracer.traced()
+    def parse_docx(file_path) -> str:
+        """Parse DOCX file (path atau file-like object)"""
+        import docx
+        
         try:
             doc = docx.Document(file_path)
             text = ""
@@ -68,6 +85,7 @@ class FileParser:
             return f"⚠️ Gagal membaca DOCX: {str(e)}"
     
     @staticmethod
+    @tracer.traced()
     def parse_file(file_path: str, file_extension: str) -> Optional[str]:
         """
         Main parser function - deteksi format dan parse sesuai tipe
@@ -91,4 +109,27 @@ class FileParser:
             return FileParser.parse_docx(file_path)
         
         else:
-            return f"⚠️ Format file .{extension} belum didukung."
\ No newline at end of file
+            return f"⚠️ Format file .{extension} belum didukung."
+    
+    @staticmethod
+    @tracer.traced()
+    def parse_buffer(buffer, file_extension: str) -> Optional[str]:
+        """
+        Sama seperti parse_file, tapi membaca upload langsung dari memori
+        (bytes/memoryview) tanpa menulis file sementara ke disk.
+        """
+        extension = file_extension.lower()
+        
+        if extension == 'txt':
+            return FileParser.parse_txt_buffer(buffer)
+        
+        elif extension == 'pdf':
+            with open_buffer(buffer) as stream:
+                return FileParser.parse_pdf(stream)
+        
+        elif extension in ['docx', 'doc']:
+            with open_buffer(buffer) as stream:
+                return FileParser.parse_docx(stream)
+        
+        else:
+            return f"⚠️ Format file .{extension} belum didukung."
@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import functools
+import contextvars
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+from .ai_utils import is_ai_error_response
+from .async_runtime import runner
+
+
+HEDGE_ENABLED = os.getenv('CALAVERA_HEDGE', '0') == '1'
+HEDGE_PERCENTILE = float(os.getenv('CALAVERA_HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.getenv('CALAVERA_HEDGE_MIN_DELAY', '1.5'))
+HEDGE_MAX_DELAY = float(os.getenv('CALAVERA_HEDGE_MAX_DELAY', '20'))
+# Delay awal sebelum cukup sampel latency terkumpul
+HEDGE_DEFAULT_DELAY = float(os.getenv('CALAVERA_HEDGE_DEFAULT_DELAY', '8'))
+HEDGE_MIN_SAMPLES = int(os.getenv('CALAVERA_HEDGE_MIN_SAMPLES', '20'))
+# Format "primary:cadangan,..." - model free-tier OpenRouter dicadangkan ke Groq
+HEDGE_PAIRS = os.getenv('CALAVERA_HEDGE_PAIRS', 'mistral:groq,deepseek:groq,groq:gemini,gemini:groq')
+
+
+def parse_hedge_pairs(value: str) -> Dict[str, str]:
+    """Parse 'mistral:groq,deepseek:groq' menjadi {'mistral': 'groq', ...}"""
+    pairs = {}
+    for item in value.split(','):
+        if ':' in item:
+            primary, secondary = item.split(':', 1)
+            if primary.strip() and secondary.strip():
+                pairs[primary.strip()] = secondary.strip()
+    return pairs
+
+
+class LatencyTracker:
+    """Sliding window latency per engine untuk menghitung delay hedging"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, name: str, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self, name: str) -> float:
+        """Delay sebelum request cadangan dikirim: persentil latency, dibatasi min/max"""
+        value = self.percentile(name, HEDGE_PERCENTILE)
+        if value is None:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, min(HEDGE_MAX_DELAY, value))
+
+
+class HedgeStats:
+    """Statistik hedging per pasangan provider (primary->cadangan)"""
+
+    def __init__(self):
+        self._pairs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, pair: str, hedged: bool, winner: Optional[str]):
+        with self._lock:
+            stats = self._pairs.setdefault(pair, {
+                "requests": 0, "hedged": 0,
+                "primary_wins": 0, "secondary_wins": 0, "failures": 0
+            })
+            stats["requests"] += 1
+            if hedged:
+                stats["hedged"] += 1
+            if winner == "primary":
+                stats["primary_wins"] += 1
+            elif winner == "secondary":
+                stats["secondary_wins"] += 1
+            else:
+                stats["failures"] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            result = {}
+            for pair, stats in self._pairs.items():
+                result[pair] = dict(stats)
+                result[pair]["hedge_rate"] = round(stats["hedged"] / stats["requests"], 4) if stats["requests"] else 0.0
+            return {"pid": os.getpid(), "pairs": result}
+
+
+latency_tracker = LatencyTracker()
+hedge_stats = HedgeStats()
+
+
+async def _call_engine(engine, method: str, *args):
+    """Panggil engine async langsung; engine sync dijalankan di thread executor"""
+    target = getattr(engine, 'engine', engine)
+    func = getattr(target, method)
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args)
+    loop = asyncio.get_running_loop()
+    # Context ikut ke thread executor (token usage tetap tercatat ke panggilan ini)
+    return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+
+class HedgedEngine:
+    """
+    Engine pembungkus untuk hedged request.
+
+    Request dikirim ke engine utama. Jika belum ada jawaban setelah delay
+    (persentil latency engine itu), prompt yang sama dikirim ke engine
+    cadangan. Jawaban bagus pertama yang menang, yang kalah dibatalkan
+    (dengan engine async, koneksinya benar-benar ditutup).
+    """
+
+    def __init__(self, primary_name: str, primary, secondary_name: str, secondary):
+        self.primary_name = primary_name
+        self.primary = primary
+        self.secondary_name = secondary_name
+        self.secondary = secondary
+        self.pair = f"{primary_name}->{secondary_name}"
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    async def _timed(self, name: str, engine, method: str, args, censor_floor: Optional[float] = None):
+        """
+        Sampel latency dari jawaban yang selesai dan bukan error; pesan error
+        cepat tidak dihitung karena akan menurunkan persentil.
+
+        Primary yang kalah (dibatalkan) dicatat sebagai sampel tersensor:
+        latency-nya minimal selama ia sudah berjalan, dan minimal censor_floor
+        (delay hedge). Tanpa ini window hanya berisi jawaban cepat, p95 turun
+        ke HEDGE_MIN_DELAY dan hedging makin sering. Cadangan yang dibatalkan
+        (censor_floor None) tidak dicatat: ia berhenti karena primary menang,
+        bukan karena lambat.
+        """
+        start = time.monotonic()
+        try:
+            result = await _call_engine(engine, method, *args)
+        except asyncio.CancelledError:
+            if censor_floor is not None:
+                latency_tracker.record(name, max(time.monotonic() - start, censor_floor))
+            raise
+        if not is_ai_error_response(result):
+            latency_tracker.record(name, time.monotonic() - start)
+        return result
+
+    async def _hedged_call(self, method: str, args) -> str:
+        delay = latency_tracker.hedge_delay(self.primary_name)
+        primary_task = asyncio.ensure_future(self._timed(self.primary_name, self.primary, method, args,
+                                                         censor_floor=delay))
+        tasks = {primary_task: "primary"}
+        hedged = False
+        last_result = None
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+            if done:
+                last_result = primary_task.result()
+                if not is_ai_error_response(last_result):
+                    hedge_stats.record(self.pair, False, "primary")
+                    return last_result
+                del tasks[primary_task]
+
+            hedged = True
+            print(f"📊 [HEDGE] {self.pair} setelah {delay:.1f}s")
+            secondary_task = asyncio.ensure_future(self._timed(self.secondary_name, self.secondary, method, args))
+            tasks[secondary_task] = "secondary"
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if not is_ai_error_response(result):
+                        hedge_stats.record(self.pair, True, tasks[task])
+                        return result
+                    last_result = result
+
+            hedge_stats.record(self.pair, hedged, None)
+            return last_result
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def generate_text(self, prompt: str, personality: str = "", history: List[Dict] = None,
+                      document: str = None) -> str:
+        return runner.run(self._hedged_call('generate_text', (prompt, personality, history, document)))
+
+    def stream_text(self, prompt: str, personality: str = "", history: List[Dict] = None) -> Iterator[str]:
+        # Streaming tidak di-hedge: token pertama sudah mengurangi latency yang dirasakan
+        return self.primary.stream_text(prompt, personality, history)
+
+    def analyze_image(self, image_data: bytes, prompt: str, personality: str = "",
+                      mime_type: str = "image/jpeg") -> str:
+        # Tidak semua engine cadangan mendukung gambar
+        return self.primary.analyze_image(image_data, prompt, personality, mime_type)
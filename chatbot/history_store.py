@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List
+
+from .history_window import HISTORY_DB, HISTORY_TTL
+
+
+# 'sqlite' (default, dibagi semua worker di satu mesin) atau 'memory' (satu proses saja)
+HISTORY_STORE = os.getenv('CALAVERA_HISTORY_STORE', 'sqlite')
+MEMORY_MAX_CHATS = 5000
+
+
+class HistoryStore(ABC):
+    """
+    Interface penyimpanan history percakapan di server.
+
+    Cookie session hanya membawa chat_id; pesan disimpan di sini dan
+    ditambahkan per giliran (append) alih-alih menulis ulang seluruh list.
+    """
+
+    @abstractmethod
+    def load(self, chat_id: str, limit: int) -> List[Dict]:
+        """limit pesan terakhir, urut kronologis"""
+
+    @abstractmethod
+    def append(self, chat_id: str, messages: List[Dict], keep: int):
+        """Tambah pesan baru lalu buang pesan di luar keep terakhir"""
+
+    @abstractmethod
+    def pop_last(self, chat_id: str):
+        """Hapus pesan terakhir (jawaban yang di-regenerate)"""
+
+    @abstractmethod
+    def replace(self, chat_id: str, messages: List[Dict]):
+        """Tulis ulang seluruh history (hapus pesan di tengah, migrasi)"""
+
+    @abstractmethod
+    def clear(self, chat_id: str):
+        """Hapus seluruh history satu percakapan"""
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class MemoryHistoryStore(HistoryStore):
+    """Key-value di memori proses; cocok untuk development atau satu worker"""
+
+    def __init__(self, max_chats: int = MEMORY_MAX_CHATS, ttl: int = HISTORY_TTL):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._chats: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, chat_id: str) -> List[Dict]:
+        entry = self._chats.get(chat_id)
+        if entry is None or entry[1] + self.ttl < time.time():
+            return []
+        self._chats.move_to_end(chat_id)
+        return entry[0]
+
+    def _put(self, chat_id: str, messages: List[Dict]):
+        self._chats[chat_id] = (messages, time.time())
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def load(self, chat_id: str, limit: int) -> List[Dict]:
+        with self._lock:
+            return [dict(msg) for msg in self._get(chat_id)[-limit:]]
+
+    def append(self, chat_id: str, messages: List[Dict], keep: int):
+        with self._lock:
+            self._put(chat_id, (self._get(chat_id) + [dict(msg) for msg in messages])[-keep:])
+
+    def pop_last(self, chat_id: str):
+        with self._lock:
+            self._put(chat_id, self._get(chat_id)[:-1])
+
+    def replace(self, chat_id: str, messages: List[Dict]):
+        with self._lock:
+            self._put(chat_id, [dict(msg) for msg in messages])
+
+    def clear(self, chat_id: str):
+        with self._lock:
+            self._chats.pop(chat_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": "memory", "pid": os.getpid(), "chats": len(self._chats)}
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """Satu baris per pesan di SQLite (WAL), bisa dibaca semua worker gunicorn"""
+
+    def __init__(self, db_path: str = HISTORY_DB, ttl: int = HISTORY_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._init_db()
+
+    def _get_db(self) -> sqlite3.Connection:
+        """Satu koneksi SQLite per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._get_db()
+        conn.execute('''CREATE TABLE IF NOT EXISTS chat_messages
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         chat_id TEXT NOT NULL,
+                         message TEXT NOT NULL,
+                         created_at REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_chat ON chat_messages (chat_id, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_created ON chat_messages (created_at)')
+        conn.commit()
+
+    def load(self, chat_id: str, limit: int) -> List[Dict]:
+        try:
+            rows = self._get_db().execute('''SELECT message FROM chat_messages WHERE chat_id = ?
+                                             ORDER BY id DESC LIMIT ?''', (chat_id, limit)).fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ [HISTORY] Gagal membaca history: {e}")
+            return []
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def append(self, chat_id: str, messages: List[Dict], keep: int):
+        now = time.time()
+        conn = self._get_db()
+        with conn:
+            conn.executemany('INSERT INTO chat_messages (chat_id, message, created_at) VALUES (?, ?, ?)',
+                             [(chat_id, json.dumps(msg, ensure_ascii=False), now) for msg in messages])
+            conn.execute('''DELETE FROM chat_messages WHERE chat_id = ? AND id NOT IN (
+                                SELECT id FROM chat_messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?)''',
+                         (chat_id, chat_id, keep))
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        """Hapus percakapan yang tidak aktif lebih lama dari TTL"""
+        try:
+            conn = self._get_db()
+            with conn:
+                conn.execute('''DELETE FROM chat_messages WHERE chat_id IN (
+                                    SELECT chat_id FROM chat_messages GROUP BY chat_id
+                                    HAVING MAX(created_at) < ?)''', (now - self.ttl,))
+        except sqlite3.Error as e:
+            print(f"⚠️ [HISTORY] Gagal membersihkan history lama: {e}")
+
+    def pop_last(self, chat_id: str):
+        conn = self._get_db()
+        with conn:
+            conn.execute('''DELETE FROM chat_messages WHERE id = (
+                                SELECT MAX(id) FROM chat_messages WHERE chat_id = ?)''', (chat_id,))
+
+    def replace(self, chat_id: str, messages: List[Dict]):
+        now = time.time()
+        conn = self._get_db()
+        with conn:
+            conn.execute('DELETE FROM chat_messages WHERE chat_id = ?', (chat_id,))
+            conn.executemany('INSERT INTO chat_messages (chat_id, message, created_at) VALUES (?, ?, ?)',
+                             [(chat_id, json.dumps(msg, ensure_ascii=False), now) for msg in messages])
+
+    def clear(self, chat_id: str):
+        conn = self._get_db()
+        with conn:
+            conn.execute('DELETE FROM chat_messages WHERE chat_id = ?', (chat_id,))
+
+    def stats(self) -> Dict:
+        try:
+            row = self._get_db().execute('SELECT COUNT(DISTINCT chat_id), COUNT(*) FROM chat_messages').fetchone()
+        except sqlite3.Error:
+            row = (0, 0)
+        return {"backend": "sqlite", "db": self.db_path, "chats": row[0], "messages": row[1]}
+
+
+def create_history_store(backend: str = HISTORY_STORE) -> HistoryStore:
+    if backend == 'memory':
+        return MemoryHistoryStore()
+    if backend != 'sqlite':
+        print(f"⚠️ [HISTORY] Backend '{backend}' tidak dikenal, pakai sqlite")
+    return SQLiteHistoryStore()
+
+
+history_store = create_history_store()
@@ -0,0 +1,295 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Budget token history per model (di luar system instruction dan prompt baru)
+HISTORY_BUDGETS = os.getenv('CALAVERA_HISTORY_BUDGETS', 'gemini=4000,groq=2000,mistral=2000,deepseek=1500')
+DEFAULT_HISTORY_BUDGET = int(os.getenv('CALAVERA_HISTORY_BUDGET', '2000'))
+SUMMARY_ENABLED = os.getenv('CALAVERA_HISTORY_SUMMARY', '1') == '1'
+SUMMARY_MODEL = os.getenv('CALAVERA_SUMMARY_MODEL', 'groq')
+# Giliran lama baru diringkas jika jumlahnya cukup berarti
+SUMMARY_MIN_TOKENS = int(os.getenv('CALAVERA_SUMMARY_MIN_TOKENS', '300'))
+SUMMARY_MAX_CHARS = 2000
+# History chat adalah data siswa (bukan cache): disimpan permanen di folder instance/
+# aplikasi (di-gitignore), bukan di /tmp yang dibersihkan saat reboot. Deployment
+# lebih dari satu node wajib mengarahkan CALAVERA_HISTORY_DB ke storage bersama.
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance')
+HISTORY_DB = os.getenv('CALAVERA_HISTORY_DB', os.path.join(INSTANCE_DIR, 'calavera_history.db'))
+# Percakapan yang tidak aktif selama ini dihapus dari server (default 7 hari)
+HISTORY_TTL = int(os.getenv('CALAVERA_HISTORY_TTL', str(7 * 24 * 3600)))
+
+# Pesan mode pencarian/gambar tidak dikirim ulang sebagai konteks
+SKIPPED_TAGS = ("[PENCARIAN]", "[GAMBAR]")
+# Overhead per pesan (role, pemisah) dalam token
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Perkiraan kasar ~4 karakter per token"""
+    return len(text or '') // 4 + 1
+
+
+def parse_budgets(value: str) -> Dict[str, int]:
+    budgets = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, budget = item.split('=', 1)
+            if budget.strip().isdigit():
+                budgets[name.strip()] = int(budget)
+    return budgets
+
+
+_budgets = parse_budgets(HISTORY_BUDGETS)
+
+
+def history_budget(model: str) -> int:
+    return _budgets.get(model, DEFAULT_HISTORY_BUDGET)
+
+
+def message_hash(msg: Dict) -> str:
+    """Identitas pesan untuk menandai sampai mana history sudah diringkas"""
+    raw = f"{msg.get('role', '')}\x1f{msg.get('content', '')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _split_summary(history: List[Dict]) -> Tuple[Optional[Dict], List[Dict]]:
+    """Pisahkan entri ringkasan (role 'summary') dari giliran percakapan yang relevan"""
+    summary = None
+    turns = []
+    for msg in history or []:
+        role = msg.get("role", "user")
+        if role == "summary":
+            summary = msg
+            continue
+        content = msg.get("content", "")
+        if any(tag in content for tag in SKIPPED_TAGS):
+            continue
+        turns.append(msg)
+
+    if summary and summary.get("covered"):
+        # Giliran sampai penanda sudah terwakili ringkasan
+        for index in range(len(turns) - 1, -1, -1):
+            if message_hash(turns[index]) == summary["covered"]:
+                turns = turns[index + 1:]
+                break
+    return summary, turns
+
+
+def _fit_budget(turns: List[Dict], budget: int) -> List[Dict]:
+    """Ambil giliran terbaru sebanyak yang muat di budget (urutan kronologis)"""
+    selected = []
+    used = 0
+    for msg in reversed(turns):
+        content = msg.get("content", "")
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD
+        if used + cost > budget:
+            if not selected and budget > MESSAGE_OVERHEAD:
+                # Pesan terakhir sendirian sudah melebihi budget: potong, jangan dibuang
+                limit = (budget - MESSAGE_OVERHEAD) * 4
+                selected.append({"role": msg.get("role", "user"), "content": content[:limit]})
+            break
+        selected.append({"role": msg.get("role", "user"), "content": content})
+        used += cost
+    selected.reverse()
+
+    # Window sebaiknya diawali giliran user
+    while selected and selected[0]["role"] == "assistant":
+        selected.pop(0)
+    return selected
+
+
+def build_history_turns(history: List[Dict], budget: int) -> List[Dict]:
+    """
+    History yang dikirim ke provider: ringkasan percakapan lama (jika ada)
+    lalu giliran terbaru yang muat di budget token. Dipakai bersama oleh
+    _build_chat_messages (format OpenAI) dan _build_chat_contents (Gemini).
+    """
+    summary, turns = _split_summary(history)
+    result = []
+    if summary and summary.get("content"):
+        budget -= estimate_tokens(summary["content"]) + MESSAGE_OVERHEAD
+        result.append({"role": "summary", "content": summary["content"]})
+    return result + _fit_budget(turns, max(budget, 0))
+
+
+def format_summary(summary: str) -> str:
+    return f"Ringkasan percakapan sebelumnya dengan user:\n{summary}"
+
+
+class SummaryStore:
+    """Ringkasan berjalan per chat_id di SQLite (WAL)"""
+
+    def __init__(self, db_path: str = HISTORY_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._ready = False
+        self._writes = 0
+
+    def _get_db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._ready:
+                conn.execute('''CREATE TABLE IF NOT EXISTS chat_summaries
+                                (chat_id TEXT PRIMARY KEY,
+                                 summary TEXT NOT NULL,
+                                 covered TEXT NOT NULL,
+                                 updated_at REAL NOT NULL)''')
+                conn.commit()
+                self._ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, chat_id: str) -> Optional[Dict]:
+        try:
+            row = self._get_db().execute('SELECT summary, covered FROM chat_summaries WHERE chat_id = ?',
+                                         (chat_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ [HISTORY] Gagal membaca ringkasan: {e}")
+            return None
+        if row is None:
+            return None
+        return {"role": "summary", "content": row[0], "covered": row[1]}
+
+    def set(self, chat_id: str, summary: str, covered: str):
+        conn = self._get_db()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO chat_summaries (chat_id, summary, covered, updated_at) '
+                     'VALUES (?, ?, ?, ?)', (chat_id, summary, covered, now))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            conn.execute('DELETE FROM chat_summaries WHERE updated_at < ?', (now - HISTORY_TTL,))
+        conn.commit()
+
+    def delete(self, chat_id: str):
+        try:
+            conn = self._get_db()
+            conn.execute('DELETE FROM chat_summaries WHERE chat_id = ?', (chat_id,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ [HISTORY] Gagal menghapus ringkasan: {e}")
+
+
+class RollingSummarizer:
+    """
+    Meringkas giliran lama di background setelah jawaban terkirim.
+
+    Giliran yang sudah keluar dari window budget terkecil (atau akan
+    terbuang dari penyimpanan history) dilipat ke ringkasan sebelumnya
+    oleh model murah, lalu penandanya disimpan supaya giliran yang sama
+    tidak dikirim dua kali (sekali mentah, sekali dalam ringkasan).
+    """
+
+    def __init__(self, store: SummaryStore, max_workers: int = 2):
+        self.store = store
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_workers = max_workers
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.runs = 0
+        self.failures = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix='history-summary')
+            self._pid = os.getpid()
+        return self._executor
+
+    def _chat_lock(self, chat_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(chat_id, threading.Lock())
+
+    def attach(self, chat_id: Optional[str], history: List[Dict]) -> List[Dict]:
+        """Sisipkan ringkasan tersimpan di depan history (untuk dikirim ke engine)"""
+        if not SUMMARY_ENABLED or not chat_id or not history:
+            return history
+        summary = self.store.get(chat_id)
+        return [summary] + list(history) if summary else history
+
+    def schedule(self, chat_id: Optional[str], history: List[Dict], keep_last: int,
+                 summarize: Callable[[str], str]):
+        """Jadwalkan peringkasan tanpa menahan response"""
+        if not SUMMARY_ENABLED or not chat_id or not history:
+            return
+        self._get_executor().submit(self._run, chat_id, list(history), keep_last, summarize)
+
+    def _turns_to_fold(self, chat_id: str, history: List[Dict], keep_last: int):
+        summary = self.store.get(chat_id)
+        _, turns = _split_summary(([summary] if summary else []) + history)
+
+        # Giliran yang akan terbuang dari penyimpanan (history[-keep_last:]) wajib diringkas
+        kept = {id(msg) for msg in history[-keep_last:]}
+        cut = sum(1 for msg in turns if id(msg) not in kept)
+
+        budget = min(_budgets.values()) if _budgets else DEFAULT_HISTORY_BUDGET
+        if summary:
+            budget -= estimate_tokens(summary["content"]) + MESSAGE_OVERHEAD
+        window = _fit_budget(turns, max(budget, 0))
+        cut = max(cut, len(turns) - len(window))
+        return summary, turns[:cut]
+
+    def _run(self, chat_id: str, history: List[Dict], keep_last: int, summarize: Callable[[str], str]):
+        from .ai_utils import is_ai_error_response
+
+        with self._chat_lock(chat_id):
+            try:
+                summary, fold = self._turns_to_fold(chat_id, history, keep_last)
+                if not fold:
+                    return
+                dropping = any(id(msg) not in {id(m) for m in history[-keep_last:]} for msg in fold)
+                if not dropping and sum(estimate_tokens(m.get("content", "")) for m in fold) < SUMMARY_MIN_TOKENS:
+                    return
+
+                transcript = "\n".join(
+                    f"{'User' if m.get('role') == 'user' else 'Asisten'}: {m.get('content', '')}" for m in fold
+                )
+                previous = summary["content"] if summary else "(belum ada)"
+                prompt = f"""Perbarui ringkasan percakapan antara user dan asisten kelas.
+
+Ringkasan sebelumnya:
+{previous}
+
+Percakapan baru yang perlu dimasukkan:
+{transcript}
+
+Tulis ringkasan baru maksimal 120 kata dalam bahasa Indonesia. Pertahankan fakta penting, nama, angka, materi yang dibahas, dan pertanyaan yang belum terjawab. Tulis ringkasannya saja tanpa pembuka."""
+
+                start = time.monotonic()
+                result = summarize(prompt)
+                if is_ai_error_response(result):
+                    self.failures += 1
+                    return
+                self.store.set(chat_id, result.strip()[:SUMMARY_MAX_CHARS], message_hash(fold[-1]))
+                self.runs += 1
+                print(f"📊 [HISTORY] Ringkasan diperbarui: {len(fold)} pesan dilipat "
+                      f"({time.monotonic() - start:.1f}s)")
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ [HISTORY] Gagal meringkas history: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "enabled": SUMMARY_ENABLED,
+            "model": SUMMARY_MODEL,
+            "budgets": dict(_budgets),
+            "runs": self.runs,
+            "failures": self.failures
+        }
+
+
+summary_store = SummaryStore()
+summarizer = RollingSummarizer(summary_store)
@@ -0,0 +1,254 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from typing import Dict, Iterator, List
+
+from . import fastjson
+from .fastjson import json_request_kwargs
+from .resilience import send_with_retry
+from .rate_limiter import rate_limiter, provider_for_url
+from .metrics import metrics
+from .tracing import tracer
+from .usage_ledger import record_openai_usage
+from .replay import cassette, CassetteAdapter
+
+
+POOL_CONNECTIONS = int(os.getenv('CALAVERA_HTTP_POOL_CONNECTIONS', '2'))
+POOL_MAXSIZE = int(os.getenv('CALAVERA_HTTP_POOL_MAXSIZE', '32'))
+POOL_BLOCK = os.getenv('CALAVERA_HTTP_POOL_BLOCK', '0') == '1'
+WARMUP_TIMEOUT = float(os.getenv('CALAVERA_HTTP_WARMUP_TIMEOUT', '5'))
+
+
+def get_origin(url: str) -> str:
+    """Ambil scheme://host:port dari URL sebagai kunci pool"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+class PooledTransport:
+    """
+    Transport HTTP bersama untuk semua engine AI.
+
+    Setiap host provider (googleapis, groq, openrouter, langsearch) punya
+    satu requests.Session sendiri dengan koneksi keep-alive, jadi DNS lookup
+    dan handshake TCP+TLS hanya dibayar sekali per koneksi, bukan per chat.
+    """
+
+    def __init__(self, pool_connections: int = POOL_CONNECTIONS,
+                 pool_maxsize: int = POOL_MAXSIZE, pool_block: bool = POOL_BLOCK):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _build_session(self) -> requests.Session:
+        """Buat session baru dengan adapter ber-pool"""
+        session = requests.Session()
+        pool_kwargs = dict(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block
+        )
+        # CALAVERA_HTTP_CASSETTE: rekam/putar ulang exchange provider (tes performa offline)
+        adapter = CassetteAdapter(cassette, **pool_kwargs) if cassette.enabled else HTTPAdapter(**pool_kwargs)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _check_fork(self):
+        """Socket tidak boleh dipakai bersama parent setelah gunicorn fork"""
+        if self._pid != os.getpid():
+            self._sessions = {}
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    def get_session(self, url: str) -> requests.Session:
+        """Ambil (atau buat) session untuk host dari URL"""
+        self._check_fork()
+        origin = get_origin(url)
+        session = self._sessions.get(origin)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(origin)
+                if session is None:
+                    session = self._build_session()
+                    self._sessions[origin] = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Kirim request lewat session milik host tujuan, dengan circuit breaker
+        per host dan retry (backoff + jitter, Retry-After) untuk 429/5xx dan
+        gagal connect. Read timeout tidak di-retry agar user tidak menunggu dua kali.
+        """
+        session = self.get_session(url)
+        provider = provider_for_url(url) or urlsplit(url).hostname
+        payload = kwargs.get('json')
+        # Body JSON di-encode sekali (orjson, gambar base64 di-stream per chunk) dan dipakai ulang saat retry
+        kwargs = json_request_kwargs(kwargs)
+
+        def send():
+            # Setiap percobaan (termasuk retry) memakai budget rate limiter
+            lease = rate_limiter.acquire(url, payload)
+            with metrics.timer('calavera_provider_request_seconds', provider=provider, status='error') as labels, \
+                    tracer.span('http.request', provider=provider, method=method):
+                try:
+                    response = session.request(method, url, **kwargs)
+                except BaseException:
+                    rate_limiter.release(lease)
+                    raise
+                labels['status'] = response.status_code
+                tracer.annotate(status=response.status_code)
+            if kwargs.get('stream'):
+                release_on_close(response, lease)
+            else:
+                rate_limiter.release(lease, response.status_code)
+            return response
+
+        return send_with_retry(
+            get_origin(url),
+            send,
+            retryable_errors=(requests.exceptions.ConnectionError,),
+            non_retryable_errors=(requests.exceptions.Timeout,)
+        )
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Pengganti requests.post yang memakai koneksi dari pool"""
+        return self.request('POST', url, **kwargs)
+
+    def warm_up(self, urls: List[str], timeout: float = WARMUP_TIMEOUT):
+        """
+        Buka koneksi ke setiap host lebih awal (HEAD ke origin) supaya
+        chat pertama tidak menunggu handshake. Error diabaikan.
+        """
+        if cassette.replaying:
+            return
+        for origin in {get_origin(url) for url in urls if url}:
+            try:
+                # Langsung lewat session: warm-up tidak ikut dihitung circuit breaker
+                response = self.get_session(origin).request('HEAD', origin, timeout=timeout,
+                                                            allow_redirects=False)
+                response.close()
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️ [HTTP POOL] Warm-up {origin} gagal: {e.__class__.__name__}")
+
+    def warm_up_async(self, urls: List[str], timeout: float = WARMUP_TIMEOUT) -> threading.Thread:
+        """Jalankan warm_up di background thread agar startup worker tidak tertahan"""
+        thread = threading.Thread(target=self.warm_up, args=(urls, timeout),
+                                  name='http-pool-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict:
+        """
+        Statistik pool per host.
+
+        hits   = request yang memakai ulang koneksi keep-alive
+        misses = koneksi baru yang dibuka (DNS + TCP + TLS)
+        """
+        self._check_fork()
+        hosts = {}
+        for origin, session in list(self._sessions.items()):
+            requests_count = 0
+            connections = 0
+            idle = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    requests_count += pool.num_requests
+                    connections += pool.num_connections
+                    if pool.pool is not None:
+                        idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            hosts[origin] = {
+                "requests": requests_count,
+                "hits": max(requests_count - connections, 0),
+                "misses": connections,
+                "idle_connections": idle,
+                "pool_maxsize": self.pool_maxsize
+            }
+
+        total_requests = sum(h["requests"] for h in hosts.values())
+        total_hits = sum(h["hits"] for h in hosts.values())
+        return {
+            "pid": os.getpid(),
+            "hosts": hosts,
+            "requests": total_requests,
+            "hits": total_hits,
+            "misses": sum(h["misses"] for h in hosts.values()),
+            "hit_rate": round(total_hits / total_requests, 4) if total_requests else 0.0
+        }
+
+
+def release_on_close(response: requests.Response, lease):
+    """Response streaming memegang slot concurrency sampai ditutup"""
+    if lease is None:
+        return
+    original_close = response.close
+    released = []
+
+    def close():
+        try:
+            original_close()
+        finally:
+            if not released:
+                released.append(True)
+                rate_limiter.release(lease, response.status_code)
+
+    response.close = close
+
+
+transport = PooledTransport()
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Shortcut ke transport bersama"""
+    return transport.post(url, **kwargs)
+
+
+def iter_sse_data(response: requests.Response) -> Iterator[str]:
+    """
+    Baca response Server-Sent Events dari provider dan yield isi field data.
+    Baris komentar (": OPENROUTER PROCESSING") dan event kosong dilewati.
+    """
+    # SSE selalu UTF-8, requests menebak ISO-8859-1 untuk text/* tanpa charset
+    response.encoding = 'utf-8'
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == '':
+            if data_lines:
+                yield '\n'.join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith(':'):
+            continue
+        if line.startswith('data:'):
+            data_lines.append(line[5:].lstrip(' '))
+    if data_lines:
+        yield '\n'.join(data_lines)
+
+
+def iter_chat_deltas(response: requests.Response) -> Iterator[str]:
+    """Yield potongan teks dari stream chat/completions format OpenAI (Groq, OpenRouter)"""
+    for data in iter_sse_data(response):
+        if data.strip() == '[DONE]':
+            break
+        chunk = fastjson.loads(data)
+        if 'error' in chunk:
+            raise requests.exceptions.HTTPError(str(chunk['error']), response=response)
+        if chunk.get('usage'):
+            # Chunk terakhir (stream_options.include_usage)
+            record_openai_usage(chunk)
+        for choice in chunk.get('choices', [])[:1]:
+            text = (choice.get('delta') or {}).get('content')
+            if text:
+                yield text
@@ -0,0 +1,171 @@
+import io
+import os
+import time
+import threading
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .uploads import IMAGE_MAX_BYTES, open_buffer
+from .metrics import metrics
+from .tracing import tracer
+
+
+IMAGE_PREP_ENABLED = os.getenv('CALAVERA_IMAGE_PREP', '1') == '1'
+# Sisi terpanjang yang masih berguna untuk tiap provider vision; lebih besar
+# dari ini hanya menambah waktu upload (provider akan mengecilkannya sendiri)
+IMAGE_MAX_SIDES = os.getenv('CALAVERA_IMAGE_MAX_SIDES', 'gemini=1536,groq=1120,mistral=1024')
+DEFAULT_IMAGE_MAX_SIDE = int(os.getenv('CALAVERA_IMAGE_MAX_SIDE', '1536'))
+IMAGE_QUALITY = int(os.getenv('CALAVERA_IMAGE_QUALITY', '85'))
+# Gambar di bawah batas ini yang sudah cukup kecil dikirim apa adanya
+IMAGE_PASSTHROUGH_BYTES = int(os.getenv('CALAVERA_IMAGE_PASSTHROUGH_BYTES', str(300 * 1024)))
+# Tolak "decompression bomb": header kecil tapi resolusi raksasa
+IMAGE_MAX_PIXELS = int(os.getenv('CALAVERA_IMAGE_MAX_PIXELS', str(40_000_000)))
+
+# Format yang diterima semua provider vision tanpa konversi
+PASSTHROUGH_FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+SUPPORTED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF', 'MPO'}
+# Tag EXIF orientation
+EXIF_ORIENTATION = 0x0112
+
+
+def parse_max_sides(value: str) -> Dict[str, int]:
+    sides = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, side = item.split('=', 1)
+            if side.strip().isdigit():
+                sides[name.strip()] = int(side)
+    return sides
+
+
+_max_sides = parse_max_sides(IMAGE_MAX_SIDES)
+
+
+def image_max_side(model: str) -> int:
+    return _max_sides.get(model, DEFAULT_IMAGE_MAX_SIDE)
+
+
+class ImagePrepStats:
+    """Ukuran gambar sebelum/sesudah diproses, untuk melihat penghematan upload"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.passthrough = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def record(self, bytes_in: int, bytes_out: int, seconds: float, passthrough: bool):
+        with self._lock:
+            self.images += 1
+            self.passthrough += int(passthrough)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds += seconds
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "enabled": IMAGE_PREP_ENABLED,
+                "max_sides": dict(_max_sides),
+                "images": self.images,
+                "passthrough": self.passthrough,
+                "rejected": self.rejected,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "saved_ratio": round(1 - self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+                "avg_ms": round(self.seconds / self.images * 1000, 1) if self.images else 0.0
+            }
+
+
+image_prep_stats = ImagePrepStats()
+
+
+def _reject(message: str):
+    image_prep_stats.record_rejected()
+    raise ValueError(message)
+
+
+def probe_image(image_data) -> Image.Image:
+    """
+    Buka gambar hanya sampai header (format + ukuran) tanpa decode piksel,
+    tolak file rusak/bukan gambar dan resolusi yang tidak masuk akal.
+    """
+    if len(image_data) > IMAGE_MAX_BYTES:
+        _reject(f"🖼️ Gambar terlalu besar! Maksimal {IMAGE_MAX_BYTES // (1024 * 1024)}MB.")
+    try:
+        image = Image.open(open_buffer(image_data))
+    except Image.DecompressionBombError:
+        _reject("🖼️ Resolusi gambar terlalu besar untuk dianalisis.")
+    except (UnidentifiedImageError, OSError):
+        _reject("🖼️ File bukan gambar yang valid. Gunakan JPG, PNG, atau GIF")
+    if image.format not in SUPPORTED_FORMATS:
+        _reject("🖼️ Format gambar tidak didukung. Gunakan JPG, PNG, atau GIF")
+    width, height = image.size
+    if width < 1 or height < 1 or width * height > IMAGE_MAX_PIXELS:
+        _reject("🖼️ Resolusi gambar terlalu besar untuk dianalisis.")
+    return image
+
+
+@tracer.traced()
+def prepare_image(image_data, max_side: int = DEFAULT_IMAGE_MAX_SIDE) -> Tuple[bytes, str]:
+    """
+    Siapkan gambar untuk provider vision: koreksi orientasi EXIF, kecilkan
+    ke max_side, lalu encode ulang sebagai JPEG. Mengembalikan (bytes, mime_type).
+    image_data boleh bytes atau memoryview upload; gambar kecil yang sudah dalam
+    format yang diterima provider dikirim apa adanya (tanpa disalin).
+    """
+    start = time.perf_counter()
+    image = probe_image(image_data)
+
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) not in (1, None)
+    if (not IMAGE_PREP_ENABLED
+            or (image.format in PASSTHROUGH_FORMATS and not rotated
+                and max(image.size) <= max_side and len(image_data) <= IMAGE_PASSTHROUGH_BYTES)):
+        elapsed = time.perf_counter() - start
+        image_prep_stats.record(len(image_data), len(image_data), elapsed, True)
+        metrics.observe('calavera_image_prep_seconds', elapsed, result='passthrough')
+        return image_data, PASSTHROUGH_FORMATS.get(image.format, 'image/jpeg')
+
+    original_size = image.size
+    if image.format in ('JPEG', 'MPO'):
+        # Decode JPEG langsung di skala DCT yang lebih kecil (jauh lebih murah dari resize penuh)
+        image.draft('RGB', (max_side, max_side))
+    try:
+        image = ImageOps.exif_transpose(image)
+    except Exception:
+        pass
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Transparansi tidak berguna untuk vision: tempel di atas latar putih
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=IMAGE_QUALITY, optimize=True)
+    prepared = output.getvalue()
+
+    if len(prepared) >= len(image_data) and image.size == original_size and not rotated \
+            and bytes(image_data[:3]) == b'\xff\xd8\xff':
+        # Encode ulang tidak menghemat apa pun
+        prepared = image_data
+
+    elapsed = time.perf_counter() - start
+    image_prep_stats.record(len(image_data), len(prepared), elapsed, False)
+    metrics.observe('calavera_image_prep_seconds', elapsed, result='resized')
+    print(f"📊 [IMAGE] {original_size[0]}x{original_size[1]} {len(image_data) // 1024}KB -> "
+          f"{image.size[0]}x{image.size[1]} {len(prepared) // 1024}KB ({elapsed * 1000:.0f}ms)")
+    return prepared, 'image/jpeg'
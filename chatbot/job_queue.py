@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Optional
+
+
+JOB_QUEUE_ENABLED = os.getenv('CALAVERA_JOB_QUEUE', '0') == '1'
+# Berisi blob upload mentah: jangan di working tree (pola *.db juga di-gitignore)
+JOB_DB = os.getenv('CALAVERA_JOB_DB', os.path.join(tempfile.gettempdir(), 'calavera_jobs.db'))
+# Mode yang selalu lewat antrean saat queue aktif (mode lain hanya jika client minta async=1)
+JOB_MODES = {mode.strip() for mode in os.getenv('CALAVERA_JOB_MODES', '').split(',') if mode.strip()}
+# Job yang worker-nya mati (tidak heartbeat) diambil ulang setelah lease habis
+JOB_LEASE = int(os.getenv('CALAVERA_JOB_LEASE', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('CALAVERA_JOB_MAX_ATTEMPTS', '2'))
+# Job selesai (beserta file upload-nya) dihapus setelah ini
+JOB_RETENTION = int(os.getenv('CALAVERA_JOB_RETENTION', str(24 * 3600)))
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue:
+    """
+    Antrean job durable di SQLite (WAL) untuk mode image/file yang lama.
+
+    Web worker hanya menyimpan job (termasuk isi upload) lalu langsung
+    membalas job_id; proses `python -m chatbot.worker` mengambil job dengan
+    lease, memprosesnya, dan menulis hasil. Job yang lease-nya habis (worker
+    mati di tengah jalan) diambil ulang sampai JOB_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, db_path: str = JOB_DB, lease: int = JOB_LEASE,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._ready = False
+        self._writes = 0
+
+    def _get_db(self) -> sqlite3.Connection:
+        """Satu koneksi SQLite per thread (autocommit, transaksi eksplisit)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if not self._ready:
+                db_dir = os.path.dirname(self.db_path)
+                if db_dir:
+                    os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._ready:
+                conn.execute('''CREATE TABLE IF NOT EXISTS chat_jobs
+                                (id TEXT PRIMARY KEY,
+                                 kind TEXT NOT NULL,
+                                 chat_id TEXT NOT NULL,
+                                 status TEXT NOT NULL,
+                                 params TEXT NOT NULL,
+                                 data BLOB,
+                                 result TEXT,
+                                 error TEXT,
+                                 attempts INTEGER NOT NULL DEFAULT 0,
+                                 worker TEXT,
+                                 lease_until REAL,
+                                 created_at REAL NOT NULL,
+                                 started_at REAL,
+                                 finished_at REAL)''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_jobs_status ON chat_jobs (status, created_at)')
+                self._ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, kind: str, chat_id: str, params: Dict, data=None) -> str:
+        """Simpan job baru (data = isi upload, boleh memoryview) dan kembalikan job_id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._get_db()
+        conn.execute('''INSERT INTO chat_jobs (id, kind, chat_id, status, params, data, created_at)
+                        VALUES (?, ?, ?, 'queued', ?, ?, ?)''',
+                     (job_id, kind, chat_id, json.dumps(params, ensure_ascii=False), data, now))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune(now)
+        print(f"📊 [JOB] {kind} {job_id[:8]} masuk antrean")
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Ambil job tertua yang menunggu (atau lease-nya habis) secara atomik"""
+        now = time.time()
+        conn = self._get_db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''SELECT id, kind, chat_id, params, data, attempts FROM chat_jobs
+                                  WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                                  ORDER BY created_at LIMIT 1''', (now,)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            job_id, kind, chat_id, params, data, attempts = row
+            if attempts >= self.max_attempts:
+                conn.execute('''UPDATE chat_jobs SET status = 'failed', data = NULL, finished_at = ?,
+                                error = COALESCE(error, ?) WHERE id = ?''',
+                             (now, "⚠️ Maaf, permintaan kamu gagal diproses. Coba lagi ya!", job_id))
+                conn.execute('COMMIT')
+                return self.claim(worker)
+            conn.execute('''UPDATE chat_jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                            lease_until = ?, started_at = ? WHERE id = ?''',
+                         (worker, now + self.lease, now, job_id))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return {"id": job_id, "kind": kind, "chat_id": chat_id, "params": json.loads(params),
+                "data": data, "attempt": attempts + 1}
+
+    def heartbeat(self, job_id: str, worker: str):
+        """Perpanjang lease job yang masih dikerjakan"""
+        self._get_db().execute('''UPDATE chat_jobs SET lease_until = ? WHERE id = ? AND worker = ?
+                                  AND status = 'running' ''', (time.time() + self.lease, job_id, worker))
+
+    def complete(self, job_id: str, worker: str, result: Dict) -> bool:
+        """
+        Simpan hasil. Hanya worker pemegang lease yang bisa menulis: worker yang
+        lease-nya habis (job sudah diambil worker lain) tidak menimpa apa-apa.
+        """
+        cursor = self._get_db().execute('''UPDATE chat_jobs SET status = 'done', result = ?, data = NULL,
+                                           error = NULL, finished_at = ? WHERE id = ? AND worker = ?
+                                           AND status = 'running' ''',
+                                        (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker))
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, worker: str, error: str, retry: bool = False) -> bool:
+        """
+        Tandai gagal; retry=True mengembalikan job ke antrean selama percobaan masih ada.
+        Sama seperti complete, hanya berlaku untuk job yang masih dipegang worker ini.
+        """
+        conn = self._get_db()
+        if retry:
+            cursor = conn.execute('''UPDATE chat_jobs SET status = 'queued', error = ?, worker = NULL,
+                                     lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'
+                                     AND attempts < ?''',
+                                  (error, job_id, worker, self.max_attempts))
+            if cursor.rowcount:
+                return True
+        cursor = conn.execute('''UPDATE chat_jobs SET status = 'failed', error = ?, data = NULL,
+                                 finished_at = ? WHERE id = ? AND worker = ? AND status = 'running' ''',
+                              (error, time.time(), job_id, worker))
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str, chat_id: str = None) -> Optional[Dict]:
+        """Status job untuk client; chat_id membatasi agar user hanya melihat job-nya sendiri"""
+        row = self._get_db().execute('''SELECT id, kind, chat_id, status, result, error, attempts,
+                                        created_at, started_at, finished_at FROM chat_jobs WHERE id = ?''',
+                                     (job_id,)).fetchone()
+        if row is None or (chat_id is not None and row[2] != chat_id):
+            return None
+        job = {"job_id": row[0], "mode": row[1], "status": row[3], "attempts": row[6]}
+        if row[3] == 'queued':
+            job["position"] = self._get_db().execute(
+                "SELECT COUNT(*) FROM chat_jobs WHERE status = 'queued' AND created_at < ?", (row[7],)
+            ).fetchone()[0] + 1
+        if row[4] is not None:
+            job["result"] = json.loads(row[4])
+        if row[3] == 'failed':
+            job["error"] = row[5]
+        if row[9] is not None:
+            job["duration"] = round(row[9] - (row[8] or row[7]), 2)
+        return job
+
+    def prune(self, now: float = None):
+        """Hapus job selesai/gagal yang sudah lewat masa simpan"""
+        now = now or time.time()
+        try:
+            self._get_db().execute("DELETE FROM chat_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                   (now - JOB_RETENTION,))
+        except sqlite3.Error as e:
+            print(f"⚠️ [JOB] Gagal membersihkan job lama: {e}")
+
+    def stats(self) -> Dict:
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        for status, count in self._get_db().execute('SELECT status, COUNT(*) FROM chat_jobs GROUP BY status'):
+            counts[status] = count
+        oldest = self._get_db().execute("SELECT MIN(created_at) FROM chat_jobs WHERE status = 'queued'").fetchone()[0]
+        return {
+            "enabled": JOB_QUEUE_ENABLED,
+            "db": self.db_path,
+            "jobs": counts,
+            "oldest_queued_age": round(time.time() - oldest, 1) if oldest else 0.0
+        }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,360 @@
+import os
+import re
+import json
+import time
+import atexit
+import bisect
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from flask import Response, g, jsonify, request, session, template_rendered, before_render_template
+from flask.sessions import SecureCookieSessionInterface
+
+
+METRICS_ENABLED = os.getenv('CALAVERA_METRICS', '1') == '1'
+# Total histogram semua worker (setiap flush menambahkan selisih sejak flush sebelumnya)
+METRICS_DB = os.getenv('CALAVERA_METRICS_DB', os.path.join(tempfile.gettempdir(), 'calavera_metrics.db'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('CALAVERA_METRICS_FLUSH', '5'))
+# Token Bearer untuk scraper Prometheus (tanpa token: hanya admin yang login)
+METRICS_TOKEN = os.getenv('CALAVERA_METRICS_TOKEN', '')
+
+# Batas atas bucket (detik): dari query SQLite (ms) sampai panggilan LLM (puluhan detik)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+HELP = {
+    "calavera_http_request_seconds": "Waktu view Flask per route (sampai response dibuat, belum termasuk body stream)",
+    "calavera_provider_request_seconds": "Satu percobaan HTTP ke provider AI (sampai header response diterima)",
+    "calavera_engine_call_seconds": "Panggilan engine AI termasuk antre rate limit, retry dan failover",
+    "calavera_file_parse_seconds": "Ekstraksi teks dokumen upload",
+    "calavera_image_prep_seconds": "Validasi, resize dan encode ulang gambar sebelum ke provider vision",
+    "calavera_session_seconds": "Baca/tulis cookie session (serialisasi + tanda tangan)",
+    "calavera_sqlite_query_seconds": "Query SQLite database website (app.py)",
+    "calavera_template_render_seconds": "Render template Jinja",
+}
+
+SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+([A-Za-z_][A-Za-z0-9_]*)',
+                       re.IGNORECASE)
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """
+    Histogram latensi per proses yang digabung lintas worker gunicorn.
+
+    observe() hanya menambah angka di memori; thread background menambahkan
+    selisih sejak flush terakhir ke total per seri di SQLite setiap
+    METRICS_FLUSH_INTERVAL (WAL, upsert aditif), jadi tidak ada I/O di jalur
+    request maupun di event loop engine async. Tidak ada baris per proses:
+    pid yang dipakai ulang atau worker yang di-recycle tidak bisa menimpa
+    angka lama, dan counter tidak pernah turun.
+    """
+
+    def __init__(self, db_path: str = METRICS_DB, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.db_path = db_path
+        self.buckets = buckets
+        self._series: Dict[SeriesKey, _Histogram] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ready = False
+        self._pid = None
+
+    def _get_db(self) -> sqlite3.Connection:
+        """Satu koneksi SQLite per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=2)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._ready:
+                conn.execute('''CREATE TABLE IF NOT EXISTS metric_totals
+                                (name TEXT NOT NULL,
+                                 labels TEXT NOT NULL,
+                                 sum REAL NOT NULL,
+                                 count INTEGER NOT NULL,
+                                 updated_at REAL NOT NULL,
+                                 PRIMARY KEY (name, labels))''')
+                conn.execute('''CREATE TABLE IF NOT EXISTS metric_bucket_totals
+                                (name TEXT NOT NULL,
+                                 labels TEXT NOT NULL,
+                                 bucket INTEGER NOT NULL,
+                                 value INTEGER NOT NULL,
+                                 PRIMARY KEY (name, labels, bucket))''')
+                conn.commit()
+                self._migrate(conn)
+                self._ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Baris per pid dari format lama dijumlahkan sekali ke total, lalu tabelnya dihapus"""
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='metric_series'").fetchone():
+                return
+            rows = conn.execute('SELECT name, labels, buckets, sum, count FROM metric_series').fetchall()
+            deltas: Dict[SeriesKey, _Histogram] = {}
+            for name, labels, buckets, total, count in rows:
+                histogram = deltas.setdefault((name, labels), _Histogram(len(self.buckets) + 1))
+                for index, value in enumerate(json.loads(buckets)[:len(histogram.buckets)]):
+                    histogram.buckets[index] += value
+                histogram.sum += total
+                histogram.count += count
+            self._write(conn, [(name, labels, h) for (name, labels), h in deltas.items()])
+            conn.execute('DROP TABLE metric_series')
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            if self._pid != os.getpid():
+                # Proses baru (atau hasil fork): mulai dari nol dengan thread flush sendiri
+                self._series, self._dirty, self._pid = {}, set(), os.getpid()
+                threading.Thread(target=self._flush_loop, name='calavera-metrics', daemon=True).start()
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = _Histogram(len(self.buckets) + 1)
+            histogram.buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+            self._dirty.add(key)
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """with metrics.timer('calavera_file_parse_seconds', format='pdf'): ..."""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _write(self, conn: sqlite3.Connection, deltas: List[Tuple[str, str, _Histogram]]):
+        now = time.time()
+        conn.executemany('''INSERT INTO metric_totals (name, labels, sum, count, updated_at)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT(name, labels) DO UPDATE SET
+                                sum = sum + excluded.sum,
+                                count = count + excluded.count,
+                                updated_at = excluded.updated_at''',
+                         [(name, labels, h.sum, h.count, now) for name, labels, h in deltas])
+        conn.executemany('''INSERT INTO metric_bucket_totals (name, labels, bucket, value)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT(name, labels, bucket) DO UPDATE SET value = value + excluded.value''',
+                         [(name, labels, index, value) for name, labels, h in deltas
+                          for index, value in enumerate(h.buckets) if value])
+
+    def flush(self):
+        """Tambahkan selisih seri yang berubah sejak flush terakhir ke total di SQLite"""
+        with self._lock:
+            deltas = {key: self._series.pop(key) for key in self._dirty}
+            self._dirty = set()
+        if not deltas:
+            return
+        try:
+            conn = self._get_db()
+            with conn:
+                self._write(conn, [(name, json.dumps(dict(labels)), h) for (name, labels), h in deltas.items()])
+        except sqlite3.Error as e:
+            print(f"⚠️ [METRICS] Gagal menyimpan metrik: {e}")
+            # Selisih dikembalikan ke memori, dicoba lagi pada flush berikutnya
+            with self._lock:
+                for key, delta in deltas.items():
+                    histogram = self._series.setdefault(key, _Histogram(len(self.buckets) + 1))
+                    histogram.buckets = [a + b for a, b in zip(histogram.buckets, delta.buckets)]
+                    histogram.sum += delta.sum
+                    histogram.count += delta.count
+                    self._dirty.add(key)
+
+    def collect(self) -> Dict[SeriesKey, _Histogram]:
+        """Jumlahkan histogram semua worker"""
+        self.flush()
+        merged: Dict[SeriesKey, _Histogram] = {}
+        try:
+            conn = self._get_db()
+            totals = conn.execute('SELECT name, labels, sum, count FROM metric_totals').fetchall()
+            buckets = conn.execute('SELECT name, labels, bucket, value FROM metric_bucket_totals').fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ [METRICS] Gagal membaca metrik: {e}")
+            totals, buckets = [], []
+        for name, labels, total, count in totals:
+            histogram = merged.setdefault((name, labels), _Histogram(len(self.buckets) + 1))
+            histogram.sum += total
+            histogram.count += count
+        for name, labels, bucket, value in buckets:
+            histogram = merged.get((name, labels))
+            if histogram is not None and bucket < len(histogram.buckets):
+                histogram.buckets[bucket] += value
+        return {(name, tuple(sorted(json.loads(labels).items()))): h for (name, labels), h in merged.items()}
+
+    def render(self) -> str:
+        """Format teks Prometheus (text exposition 0.0.4)"""
+        by_name: Dict[str, List] = {}
+        for (name, labels), histogram in sorted(self.collect().items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+
+        lines = []
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, value in zip(self.buckets + (float('inf'),), histogram.buckets):
+                    cumulative += value
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def quantile(self, histogram: _Histogram, q: float) -> Optional[float]:
+        """Perkiraan kuantil dari bucket (interpolasi linear, seperti histogram_quantile)"""
+        if not histogram.count:
+            return None
+        rank = q * histogram.count
+        cumulative = 0
+        lower = 0.0
+        for index, value in enumerate(histogram.buckets):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if cumulative + value >= rank and value:
+                return lower + (upper - lower) * (rank - cumulative) / value
+            cumulative += value
+            lower = upper
+        return self.buckets[-1]
+
+    def summary(self) -> Dict:
+        """p50/p95/p99 (ms) per seri, untuk dibaca manusia di endpoint admin"""
+        result: Dict[str, List] = {}
+        for (name, labels), histogram in sorted(self.collect().items()):
+            result.setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": histogram.count,
+                "avg_ms": round(histogram.sum / histogram.count * 1000, 1) if histogram.count else 0.0,
+                **{f"p{int(q * 100)}_ms": round(self.quantile(histogram, q) * 1000, 1)
+                   for q in (0.5, 0.95, 0.99)}
+            })
+        return result
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+metrics = MetricsRegistry()
+atexit.register(metrics.flush)
+
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """Session cookie bawaan Flask, dengan waktu buka/simpan dicatat"""
+
+    def open_session(self, app, request):
+        with metrics.timer('calavera_session_seconds', operation='open'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with metrics.timer('calavera_session_seconds', operation='save'):
+            return super().save_session(app, session, response)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor sqlite3 yang mencatat waktu setiap query per operasi + tabel"""
+
+    def execute(self, sql, parameters=()):
+        with metrics.timer('calavera_sqlite_query_seconds', **query_labels(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with metrics.timer('calavera_sqlite_query_seconds', **query_labels(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Dipakai lewat sqlite3.connect(path, factory=TimedConnection)"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def query_labels(sql: str) -> Dict[str, str]:
+    """Label berkardinalitas rendah: 'SELECT' + nama tabel, bukan teks query"""
+    words = sql.split(None, 1)
+    match = SQL_TABLE.search(sql)
+    return {"operation": words[0].upper() if words else "", "table": match.group(1) if match else ""}
+
+
+def init_app(app):
+    """Pasang timing per route, render template dan session pada aplikasi Flask"""
+    if not METRICS_ENABLED:
+        return
+    app.session_interface = TimedSessionInterface()
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.observe('calavera_http_request_seconds', time.perf_counter() - start,
+                            route=rule, method=request.method, status=response.status_code)
+        return response
+
+    local = threading.local()
+
+    def template_started(sender, template, context, **extra):
+        local.__dict__.setdefault('stack', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        stack = local.__dict__.get('stack')
+        if stack:
+            metrics.observe('calavera_template_render_seconds', time.perf_counter() - stack.pop(),
+                            template=template.name or 'string')
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+
+
+def metrics_endpoint():
+    """Endpoint scrape Prometheus; gabungan semua worker di mesin ini"""
+    authorized = session.get('admin_logged_in') or (
+        METRICS_TOKEN and request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}")
+    if not authorized:
+        return jsonify({"error": "🔑 Hanya admin yang bisa mengakses fitur ini."}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
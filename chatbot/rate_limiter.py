@@ -0,0 +1,466 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import itertools
+import tempfile
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .fastjson import Base64Part
+
+
+RATE_LIMIT_ENABLED = os.getenv('CALAVERA_RATE_LIMIT', '1') == '1'
+# State limiter dibagi semua worker gunicorn lewat satu file SQLite (WAL)
+RATE_LIMIT_DB = os.getenv('CALAVERA_RATE_LIMIT_DB',
+                          os.path.join(tempfile.gettempdir(), 'calavera_ratelimit.db'))
+# Format "provider=rpm:tpm:max_concurrency", 0 = tanpa batas. Default mengikuti free tier.
+RATE_LIMITS = os.getenv('CALAVERA_RATE_LIMITS',
+                        'groq=30:12000:8,openrouter=20:0:4,gemini=15:250000:8')
+# Jumlah request yang boleh antre per provider per worker, dan lama maksimal menunggu
+RATE_LIMIT_QUEUE = int(os.getenv('CALAVERA_RATE_LIMIT_QUEUE', '32'))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('CALAVERA_RATE_LIMIT_MAX_WAIT', '30'))
+# Perkiraan token jawaban yang dipotong dari budget TPM sebelum request dikirim
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv('CALAVERA_COMPLETION_TOKEN_ESTIMATE', '512'))
+# Lease yang tidak dilepas (worker mati) dianggap selesai setelah ini
+LEASE_TTL = 180
+# Concurrency hanya diturunkan sekali per jendela ini, satu burst 429 = satu penurunan
+DECREASE_COOLDOWN = 2.0
+# Backoff eksponensial (dengan jitter) saat menunggu slot concurrency dari worker lain;
+# lease yang dilepas di proses ini langsung membangunkan antrean
+CONCURRENCY_BACKOFF_MIN = 0.05
+CONCURRENCY_BACKOFF_MAX = 1.0
+
+PROVIDER_HOSTS = {
+    'api.groq.com': 'groq',
+    'openrouter.ai': 'openrouter',
+    'generativelanguage.googleapis.com': 'gemini',
+    'api.langsearch.com': 'langsearch'
+}
+# Endpoint yang dialihkan (CALAVERA_*_URL, misalnya mock server benchmark) tetap
+# dibatasi sebagai provider aslinya; dicocokkan per host:port
+PROVIDER_URL_ENVS = {
+    'CALAVERA_GROQ_URL': 'groq',
+    'CALAVERA_OPENROUTER_URL': 'openrouter',
+    'CALAVERA_GEMINI_URL': 'gemini',
+    'CALAVERA_LANGSEARCH_URL': 'langsearch'
+}
+PROVIDER_NETLOCS = {urlsplit(os.environ[env]).netloc: provider
+                    for env, provider in PROVIDER_URL_ENVS.items() if os.getenv(env)}
+
+# Gambar base64 dihitung flat, bukan per karakter
+IMAGE_TOKEN_ESTIMATE = 1000
+
+
+class RateLimitQueueFull(Exception):
+    """Antrean limiter penuh atau terlalu lama menunggu budget provider"""
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"Rate limit {provider}: {reason}")
+        self.provider = provider
+
+
+def parse_rate_limits(value: str) -> Dict[str, Tuple[int, int, int]]:
+    """Parse 'groq=30:12000:8' menjadi {'groq': (30, 12000, 8)}"""
+    limits = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        name, spec = item.split('=', 1)
+        parts = [int(p) if p.strip() else 0 for p in spec.split(':')] + [0, 0, 0]
+        limits[name.strip()] = (parts[0], parts[1], parts[2])
+    return limits
+
+
+def provider_for_url(url: str) -> Optional[str]:
+    """Nama provider untuk host URL, None jika host tidak dibatasi"""
+    parts = urlsplit(url)
+    return PROVIDER_NETLOCS.get(parts.netloc) or PROVIDER_HOSTS.get(parts.hostname or '')
+
+
+def _estimate_text_tokens(value, key: str = '') -> int:
+    if isinstance(value, Base64Part):
+        return IMAGE_TOKEN_ESTIMATE
+    if isinstance(value, str):
+        if key == 'data' or value.startswith('data:'):
+            return IMAGE_TOKEN_ESTIMATE
+        # ~4 karakter per token untuk teks campuran Indonesia/Inggris
+        return len(value) // 4 + 1
+    if isinstance(value, dict):
+        return sum(_estimate_text_tokens(v, k) for k, v in value.items())
+    if isinstance(value, list):
+        return sum(_estimate_text_tokens(v, key) for v in value)
+    return 0
+
+
+def estimate_tokens(payload) -> int:
+    """Perkiraan token prompt + jawaban dari payload JSON sebelum dikirim"""
+    if not isinstance(payload, dict):
+        return 0
+    max_tokens = payload.get('max_tokens') or (payload.get('generationConfig') or {}).get('maxOutputTokens') or 0
+    completion = min(max_tokens, COMPLETION_TOKEN_ESTIMATE) if max_tokens else COMPLETION_TOKEN_ESTIMATE
+    return _estimate_text_tokens(payload) + completion
+
+
+class _Ticket:
+    """Satu request yang antre di proses ini; dibangunkan saat gilirannya tiba atau lease dilepas"""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+    def wait(self, timeout: float):
+        self.event.wait(timeout)
+        self.event.clear()
+
+    async def wait_async(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.event.clear()
+
+
+def concurrency_backoff(attempt: int) -> float:
+    """Jeda ke-attempt saat semua slot concurrency terpakai: 50ms, 100ms, ... maks. 1s, jitter 50-100%"""
+    delay = min(CONCURRENCY_BACKOFF_MAX, CONCURRENCY_BACKOFF_MIN * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class RateLimiter:
+    """
+    Token bucket lintas worker per provider, disimpan di SQLite (WAL).
+
+    Setiap provider punya dua bucket (request per menit dan token per menit)
+    yang diisi ulang sesuai waktu, plus batas concurrency yang diatur AIMD:
+    naik +1/limit setiap request sukses, turun setengah saat provider
+    membalas 429. Request yang sedang berjalan dicatat sebagai lease, jadi
+    concurrency dihitung dari semua worker. Request di atas budget menunggu
+    di antrean terbatas, bukan langsung gagal.
+
+    Antrean per proses dilayani FIFO: hanya request terdepan yang mencoba
+    mengambil budget (tidak ada N penunggu yang berebut write lock SQLite).
+    Slot concurrency dicek dulu dengan transaksi baca; jika penuh, penunggu
+    backoff eksponensial atau dibangunkan release() di proses yang sama.
+    """
+
+    def __init__(self, db_path: str = RATE_LIMIT_DB, limits: str = RATE_LIMITS,
+                 max_queue: int = RATE_LIMIT_QUEUE, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.db_path = db_path
+        self.limits = parse_rate_limits(limits)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[_Ticket]] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._initialized = False
+
+    def _get_db(self) -> sqlite3.Connection:
+        """Satu koneksi SQLite per thread, transaksi diatur manual (BEGIN IMMEDIATE)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            if not self._initialized:
+                self._init_db(conn)
+        return conn
+
+    def _init_db(self, conn: sqlite3.Connection):
+        conn.execute('''CREATE TABLE IF NOT EXISTS rate_buckets
+                        (provider TEXT PRIMARY KEY,
+                         requests REAL NOT NULL,
+                         tokens REAL NOT NULL,
+                         concurrency REAL NOT NULL,
+                         updated_at REAL NOT NULL,
+                         last_decrease REAL NOT NULL DEFAULT 0)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS rate_leases
+                        (id TEXT PRIMARY KEY,
+                         provider TEXT NOT NULL,
+                         pid INTEGER NOT NULL,
+                         expires_at REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_leases_provider ON rate_leases (provider)')
+        self._initialized = True
+
+    def _count(self, provider: str, field: str, amount: int = 1):
+        with self._lock:
+            stats = self._stats.setdefault(provider, {
+                "acquired": 0, "waited": 0, "wait_seconds": 0.0, "rejected": 0, "throttled": 0
+            })
+            stats[field] += amount
+
+    def _concurrency_full(self, conn: sqlite3.Connection, provider: str, now: float) -> bool:
+        """Cek slot concurrency dengan transaksi baca saja (tanpa write lock)"""
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute('SELECT concurrency FROM rate_buckets WHERE provider = ?', (provider,)).fetchone()
+            if row is None:
+                return False
+            in_flight = conn.execute('SELECT COUNT(*) FROM rate_leases WHERE provider = ? AND expires_at > ?',
+                                     (provider, now)).fetchone()[0]
+            return in_flight >= max(1, int(row[0]))
+        finally:
+            conn.execute('COMMIT')
+
+    def _try_acquire(self, provider: str, tokens: int) -> Tuple[Optional[str], float, bool]:
+        """
+        Satu percobaan atomik. Mengembalikan (lease_id, 0, False) jika berhasil,
+        atau (None, detik yang perlu ditunggu, apakah karena concurrency penuh).
+        """
+        rpm, tpm, max_concurrency = self.limits[provider]
+        conn = self._get_db()
+        now = time.time()
+        if max_concurrency and self._concurrency_full(conn, provider, now):
+            return None, 0.0, True
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT requests, tokens, concurrency, updated_at FROM rate_buckets '
+                               'WHERE provider = ?', (provider,)).fetchone()
+            if row is None:
+                row = (rpm, tpm, max_concurrency or 0, now)
+                conn.execute('INSERT INTO rate_buckets (provider, requests, tokens, concurrency, updated_at) '
+                             'VALUES (?, ?, ?, ?, ?)', (provider,) + row)
+            bucket_requests, bucket_tokens, concurrency, updated_at = row
+
+            elapsed = max(0.0, now - updated_at)
+            if rpm:
+                bucket_requests = min(rpm, bucket_requests + elapsed * rpm / 60.0)
+            if tpm:
+                bucket_tokens = min(tpm, bucket_tokens + elapsed * tpm / 60.0)
+                # Request lebih besar dari seluruh bucket cukup menunggu bucket penuh
+                tokens = min(tokens, tpm)
+
+            waits = []
+            busy = False
+            if rpm and bucket_requests < 1:
+                waits.append((1 - bucket_requests) * 60.0 / rpm)
+            if tpm and bucket_tokens < tokens:
+                waits.append((tokens - bucket_tokens) * 60.0 / tpm)
+            if max_concurrency:
+                conn.execute('DELETE FROM rate_leases WHERE expires_at <= ?', (now,))
+                in_flight = conn.execute('SELECT COUNT(*) FROM rate_leases WHERE provider = ?',
+                                         (provider,)).fetchone()[0]
+                if in_flight >= max(1, int(concurrency)):
+                    busy = True
+                    waits.append(0.0)
+
+            lease_id = None
+            if not waits:
+                if rpm:
+                    bucket_requests -= 1
+                if tpm:
+                    bucket_tokens -= tokens
+                if max_concurrency:
+                    lease_id = uuid.uuid4().hex
+                    conn.execute('INSERT INTO rate_leases (id, provider, pid, expires_at) VALUES (?, ?, ?, ?)',
+                                 (lease_id, provider, os.getpid(), now + LEASE_TTL))
+                else:
+                    lease_id = ''
+
+            conn.execute('UPDATE rate_buckets SET requests = ?, tokens = ?, updated_at = ? WHERE provider = ?',
+                         (bucket_requests, bucket_tokens, now, provider))
+            conn.execute('COMMIT')
+            return (lease_id, 0.0, False) if lease_id is not None else (None, max(waits), busy)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _enter_queue(self, provider: str, ticket: _Ticket):
+        with self._lock:
+            queue = self._queues.setdefault(provider, deque())
+            if len(queue) >= self.max_queue:
+                raise RateLimitQueueFull(provider, "antrean penuh, too many requests")
+            queue.append(ticket)
+
+    def _is_head(self, provider: str, ticket: _Ticket) -> bool:
+        with self._lock:
+            return self._queues[provider][0] is ticket
+
+    def _wake_head(self, provider: str):
+        with self._lock:
+            queue = self._queues.get(provider)
+            head = queue[0] if queue else None
+        if head is not None:
+            head.wake()
+
+    def _leave_queue(self, provider: str, ticket: _Ticket, waited: float):
+        with self._lock:
+            self._queues[provider].remove(ticket)
+        # Giliran berikutnya langsung mencoba (slot/budget mungkin masih tersisa)
+        self._wake_head(provider)
+        if waited > 0:
+            self._count(provider, "waited")
+            self._count(provider, "wait_seconds", waited)
+
+    def _next_wait(self, provider: str, ticket: _Ticket, tokens: int, start: float,
+                   attempt: int) -> Tuple[Optional[Tuple[str, str]], float]:
+        """
+        Satu giliran antrean: (lease, 0) jika dapat, atau (None, lama tidur).
+        Request yang bukan terdepan tidak menyentuh SQLite, hanya menunggu dibangunkan.
+        """
+        if not self._is_head(provider, ticket):
+            wait = CONCURRENCY_BACKOFF_MAX
+        else:
+            lease_id, wait, busy = self._try_acquire(provider, tokens)
+            if lease_id is not None:
+                self._count(provider, "acquired")
+                return (provider, lease_id), 0.0
+            if busy:
+                wait = concurrency_backoff(attempt)
+        if time.monotonic() - start + min(wait, 1.0) > self.max_wait:
+            self._count(provider, "rejected")
+            raise RateLimitQueueFull(provider, "terlalu lama menunggu, too many requests")
+        return None, min(wait, 1.0)
+
+    def acquire(self, url: str, payload=None) -> Optional[Tuple[str, str]]:
+        """
+        Tunggu sampai budget provider cukup. Mengembalikan lease untuk
+        release(), atau None jika host ini tidak dibatasi.
+        """
+        provider = provider_for_url(url)
+        if not RATE_LIMIT_ENABLED or provider not in self.limits:
+            return None
+
+        tokens = estimate_tokens(payload)
+        ticket = _Ticket()
+        self._enter_queue(provider, ticket)
+        start = time.monotonic()
+        slept = False
+        try:
+            for attempt in itertools.count():
+                try:
+                    lease, wait = self._next_wait(provider, ticket, tokens, start, attempt)
+                except sqlite3.Error as e:
+                    # Limiter tidak boleh menjatuhkan chat: fail-open
+                    print(f"⚠️ [RATE LIMIT] State SQLite tidak bisa dipakai: {e}")
+                    return None
+                if lease is not None:
+                    return lease
+                ticket.wait(wait)
+                slept = True
+        finally:
+            self._leave_queue(provider, ticket, time.monotonic() - start if slept else 0.0)
+
+    async def acquire_async(self, url: str, payload=None) -> Optional[Tuple[str, str]]:
+        """Versi async: akses SQLite di executor (hanya request terdepan), menunggu tanpa memblok loop"""
+        provider = provider_for_url(url)
+        if not RATE_LIMIT_ENABLED or provider not in self.limits:
+            return None
+
+        loop = asyncio.get_running_loop()
+        tokens = estimate_tokens(payload)
+        ticket = _Ticket(loop)
+        self._enter_queue(provider, ticket)
+        start = time.monotonic()
+        slept = False
+        try:
+            for attempt in itertools.count():
+                try:
+                    if self._is_head(provider, ticket):
+                        lease, wait = await loop.run_in_executor(
+                            None, self._next_wait, provider, ticket, tokens, start, attempt)
+                    else:
+                        lease, wait = self._next_wait(provider, ticket, tokens, start, attempt)
+                except sqlite3.Error as e:
+                    print(f"⚠️ [RATE LIMIT] State SQLite tidak bisa dipakai: {e}")
+                    return None
+                if lease is not None:
+                    return lease
+                await ticket.wait_async(wait)
+                slept = True
+        finally:
+            self._leave_queue(provider, ticket, time.monotonic() - start if slept else 0.0)
+
+    def release(self, lease: Optional[Tuple[str, str]], status: Optional[int] = None):
+        """
+        Lepas lease dan sesuaikan concurrency (AIMD) dari status response:
+        429 -> concurrency dibagi dua dan bucket request dikosongkan,
+        sukses -> concurrency naik perlahan sampai batas konfigurasi.
+        """
+        if lease is None:
+            return
+        provider, lease_id = lease
+        max_concurrency = self.limits[provider][2]
+        now = time.time()
+        try:
+            conn = self._get_db()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if lease_id:
+                    conn.execute('DELETE FROM rate_leases WHERE id = ?', (lease_id,))
+                row = conn.execute('SELECT concurrency, last_decrease FROM rate_buckets WHERE provider = ?',
+                                   (provider,)).fetchone()
+                if row is not None and status is not None:
+                    concurrency, last_decrease = row
+                    if status == 429:
+                        self._count(provider, "throttled")
+                        if now - last_decrease >= DECREASE_COOLDOWN:
+                            concurrency = max(1.0, concurrency / 2.0)
+                            print(f"⚠️ [RATE LIMIT] {provider} membalas 429, concurrency turun ke {int(concurrency)}")
+                            conn.execute('UPDATE rate_buckets SET concurrency = ?, requests = 0, '
+                                         'last_decrease = ? WHERE provider = ?', (concurrency, now, provider))
+                    elif status < 500 and max_concurrency and concurrency < max_concurrency:
+                        concurrency = min(float(max_concurrency), concurrency + 1.0 / max(concurrency, 1.0))
+                        conn.execute('UPDATE rate_buckets SET concurrency = ? WHERE provider = ?',
+                                     (concurrency, provider))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"⚠️ [RATE LIMIT] Gagal melepas lease: {e}")
+        # Slot yang baru lepas langsung dipakai request terdepan di proses ini
+        self._wake_head(provider)
+
+    async def release_async(self, lease: Optional[Tuple[str, str]], status: Optional[int] = None):
+        if lease is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.release, lease, status)
+
+    def stats(self) -> Dict:
+        """Budget, concurrency dan antrean per provider"""
+        providers = {}
+        try:
+            conn = self._get_db()
+            now = time.time()
+            for provider, requests_left, tokens_left, concurrency in conn.execute(
+                    'SELECT provider, requests, tokens, concurrency FROM rate_buckets'):
+                in_flight = conn.execute('SELECT COUNT(*) FROM rate_leases WHERE provider = ? AND expires_at > ?',
+                                         (provider, now)).fetchone()[0]
+                rpm, tpm, max_concurrency = self.limits.get(provider, (0, 0, 0))
+                providers[provider] = {
+                    "rpm": rpm, "tpm": tpm,
+                    "requests_left": round(requests_left, 2),
+                    "tokens_left": round(tokens_left),
+                    "concurrency_limit": round(concurrency, 2),
+                    "max_concurrency": max_concurrency,
+                    "in_flight": in_flight
+                }
+        except sqlite3.Error as e:
+            print(f"⚠️ [RATE LIMIT] Gagal membaca statistik: {e}")
+
+        with self._lock:
+            for provider, stats in self._stats.items():
+                entry = providers.setdefault(provider, {})
+                entry.update(stats, wait_seconds=round(stats["wait_seconds"], 3),
+                             queued=len(self._queues.get(provider, ())))
+        return {"pid": os.getpid(), "enabled": RATE_LIMIT_ENABLED, "providers": providers}
+
+
+rate_limiter = RateLimiter()
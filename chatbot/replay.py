@@ -0,0 +1,344 @@
+import os
+import time
+import base64
+import asyncio
+import hashlib
+import threading
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from . import fastjson
+
+
+# File rekaman exchange provider (JSONL); kosong = transport normal
+CASSETTE_PATH = os.getenv('CALAVERA_HTTP_CASSETTE', '')
+# record = teruskan ke provider sambil merekam, replay = jawab dari rekaman tanpa jaringan
+CASSETTE_MODE = os.getenv('CALAVERA_HTTP_CASSETTE_MODE', 'replay')
+# 1 = timing asli, 0.5 = dua kali lebih cepat, 0 = tanpa jeda
+REPLAY_TIME_SCALE = float(os.getenv('CALAVERA_REPLAY_TIME_SCALE', '1'))
+# body = method + path URL + hash body harus sama, url = cukup method + path URL (payload boleh berubah)
+REPLAY_MATCH = os.getenv('CALAVERA_REPLAY_MATCH', 'body')
+
+# API key di query string (Gemini ?key=) tidak ikut tersimpan
+SECRET_PARAMS = {'key', 'api_key', 'apikey', 'token'}
+# Header hop-by-hop / encoding dihitung ulang saat replay
+DROPPED_HEADERS = {'set-cookie', 'content-encoding', 'content-length', 'transfer-encoding',
+                   'connection', 'keep-alive', 'alt-svc'}
+
+
+def redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+
+def body_digest(body) -> Tuple[str, int]:
+    """sha256 + ukuran body (bytes, str, atau JSONBody yang di-stream)"""
+    digest = hashlib.sha256()
+    size = 0
+    if body is None:
+        chunks = []
+    elif isinstance(body, (bytes, bytearray)):
+        chunks = [body]
+    elif isinstance(body, str):
+        chunks = [body.encode('utf-8')]
+    else:
+        # JSONBody bisa diiterasi ulang (gambar base64 di-encode lagi per chunk)
+        chunks = body
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class Cassette:
+    """
+    Rekam exchange asli dengan provider sekali, lalu putar ulang lewat engine
+    yang sama tanpa jaringan: status, header, body per chunk beserta timing-nya
+    (TTFB dan jeda antar chunk SSE). Satu baris JSON per exchange.
+
+    Request identik yang terekam berkali-kali (429 lalu 200 saat retry)
+    diputar sesuai urutan; setelah habis, rekaman terakhir dipakai lagi.
+    """
+
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = CASSETTE_MODE,
+                 time_scale: float = REPLAY_TIME_SCALE, match: str = REPLAY_MATCH):
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.match = match
+        self._interactions: Optional[Dict[tuple, List[Dict]]] = None
+        self._cursors: Dict[tuple, int] = {}
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.mode in ('record', 'replay')
+
+    @property
+    def replaying(self) -> bool:
+        return self.enabled and self.mode == 'replay'
+
+    def key(self, method: str, url: str, digest: str) -> tuple:
+        # Host tidak ikut: rekaman dari provider asli bisa diputar dengan CALAVERA_*_URL ke mock, dan sebaliknya
+        parts = urlsplit(url)
+        target = f"{parts.path}?{parts.query}" if parts.query else parts.path
+        if self.match == 'url':
+            return (method.upper(), target)
+        return (method.upper(), target, digest)
+
+    def _load(self) -> Dict[tuple, List[Dict]]:
+        if self._interactions is None:
+            with self._lock:
+                if self._interactions is None:
+                    interactions: Dict[tuple, List[Dict]] = {}
+                    with open(self.path, 'rb') as f:
+                        for line in f:
+                            if line.strip():
+                                item = fastjson.loads(line)
+                                key = self.key(item["method"], item["url"], item["body_sha256"])
+                                interactions.setdefault(key, []).append(item)
+                    print(f"📼 [REPLAY] {sum(map(len, interactions.values()))} exchange dari {self.path}")
+                    self._interactions = interactions
+        return self._interactions
+
+    def find(self, method: str, url: str, digest: str) -> Optional[Dict]:
+        key = self.key(method, redact_url(url), digest)
+        items = self._load().get(key)
+        if not items:
+            print(f"⚠️ [REPLAY] Tidak ada rekaman untuk {method} {redact_url(url)} ({digest[:12]})")
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+        return items[min(index, len(items) - 1)]
+
+    def stats(self) -> Dict:
+        """Jumlah exchange yang diputar ulang dan request yang tidak ada di rekaman"""
+        return {"replayed": sum(self._cursors.values()), "misses": self._misses}
+
+    def save(self, interaction: Dict):
+        """Tambahkan satu exchange (append per baris, aman untuk beberapa worker)"""
+        line = fastjson.dumps(interaction) + b'\n'
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(line)
+
+    def new_interaction(self, method: str, url: str, digest: str, size: int) -> Dict:
+        return {"method": method.upper(), "url": redact_url(url), "body_sha256": digest, "body_bytes": size,
+                "status": None, "headers": {}, "ttfb": None, "chunks": [], "complete": False,
+                "recorded_at": time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    def delay(self, started: float, offset: float) -> float:
+        """Sisa waktu tunggu sampai titik offset (detik sejak request dikirim) di timeline rekaman"""
+        return max(0.0, started + offset * self.time_scale - time.perf_counter())
+
+
+def response_headers(headers) -> Dict[str, str]:
+    return {k.lower(): v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS}
+
+
+class Recorder:
+    """Catat chunk body beserta waktunya; tulis ke cassette sekali saat body selesai/ditutup"""
+
+    def __init__(self, cassette: Cassette, interaction: Dict, started: float):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.started = started
+        self.saved = False
+
+    def chunk(self, data: bytes):
+        if data:
+            self.interaction["chunks"].append([round(time.perf_counter() - self.started, 4),
+                                               base64.b64encode(data).decode('ascii')])
+
+    def finish(self, complete: bool):
+        if not self.saved:
+            self.saved = True
+            self.interaction["complete"] = complete
+            self.cassette.save(self.interaction)
+
+
+class RecordingBody:
+    """Pembungkus urllib3 HTTPResponse: body tetap mengalir ke engine sambil direkam"""
+
+    def __init__(self, raw, recorder: Recorder):
+        self._raw = raw
+        self._recorder = recorder
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._recorder.chunk(chunk)
+            yield chunk
+        self._recorder.finish(True)
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        self._recorder.chunk(data)
+        return data
+
+    def close(self):
+        self._raw.close()
+        self._recorder.finish(False)
+
+    def release_conn(self):
+        self._raw.release_conn()
+        self._recorder.finish(False)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class ReplayBody:
+    """Body response requests dari rekaman: chunk dikeluarkan sesuai timeline asli"""
+
+    def __init__(self, cassette: Cassette, interaction: Dict, started: float):
+        self.cassette = cassette
+        self.chunks = interaction["chunks"]
+        self.started = started
+
+    def stream(self, amt=None, decode_content=None):
+        for offset, data in self.chunks:
+            wait = self.cassette.delay(self.started, offset)
+            if wait:
+                time.sleep(wait)
+            yield base64.b64decode(data)
+
+    def read(self, *args, **kwargs):
+        return b''.join(self.stream())
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class ReplayMiss(requests.exceptions.RequestException):
+    """Request tidak ada di cassette (prompt/payload berubah sejak direkam)"""
+
+
+class AsyncReplayMiss(httpx.RequestError):
+    """Versi httpx dari ReplayMiss"""
+
+
+class CassetteAdapter(HTTPAdapter):
+    """HTTPAdapter requests yang merekam atau memutar ulang exchange provider"""
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        started = time.perf_counter()
+        digest, size = body_digest(request.body)
+
+        if self.cassette.replaying:
+            interaction = self.cassette.find(request.method, request.url, digest)
+            if interaction is None:
+                raise ReplayMiss(f"Tidak ada rekaman untuk {request.method} {redact_url(request.url)}",
+                                 request=request)
+            wait = self.cassette.delay(started, interaction["ttfb"])
+            if wait:
+                time.sleep(wait)
+            response = requests.Response()
+            response.status_code = interaction["status"]
+            response.reason = HTTPStatus(interaction["status"]).phrase
+            response.headers = CaseInsensitiveDict(interaction["headers"])
+            response.encoding = get_encoding_from_headers(response.headers)
+            response.raw = ReplayBody(self.cassette, interaction, started)
+            response.url = request.url
+            response.request = request
+            response.connection = self
+            return response
+
+        # Rekam body apa adanya (tanpa gzip) supaya sama untuk transport sync dan async
+        request.headers['Accept-Encoding'] = 'identity'
+        interaction = self.cassette.new_interaction(request.method, request.url, digest, size)
+        response = super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        interaction.update(status=response.status_code, headers=response_headers(response.headers),
+                           ttfb=round(time.perf_counter() - started, 4))
+        response.raw = RecordingBody(response.raw, Recorder(self.cassette, interaction, started))
+        return response
+
+
+class RecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, recorder: Recorder):
+        self._stream = stream
+        self._recorder = recorder
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._recorder.chunk(chunk)
+            yield chunk
+        self._recorder.finish(True)
+
+    async def aclose(self):
+        await self._stream.aclose()
+        self._recorder.finish(False)
+
+
+class ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, interaction: Dict, started: float):
+        self.cassette = cassette
+        self.chunks = interaction["chunks"]
+        self.started = started
+
+    async def __aiter__(self):
+        for offset, data in self.chunks:
+            wait = self.cassette.delay(self.started, offset)
+            if wait:
+                await asyncio.sleep(wait)
+            yield base64.b64decode(data)
+
+    async def aclose(self):
+        pass
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """Versi httpx dari CassetteAdapter, membungkus transport asli AsyncClient"""
+
+    def __init__(self, cassette: Cassette, transport: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        # Body stream (JSONBody) dibaca sekali ke memori lalu dipakai ulang untuk dikirim
+        digest, size = body_digest(await request.aread())
+        method, url = request.method, str(request.url)
+
+        if self.cassette.replaying:
+            interaction = self.cassette.find(method, url, digest)
+            if interaction is None:
+                raise AsyncReplayMiss(f"Tidak ada rekaman untuk {method} {redact_url(url)}", request=request)
+            wait = self.cassette.delay(started, interaction["ttfb"])
+            if wait:
+                await asyncio.sleep(wait)
+            return httpx.Response(interaction["status"], headers=interaction["headers"],
+                                  stream=ReplayStream(self.cassette, interaction, started), request=request)
+
+        request.headers['Accept-Encoding'] = 'identity'
+        interaction = self.cassette.new_interaction(method, url, digest, size)
+        response = await self.transport.handle_async_request(request)
+        interaction.update(status=response.status_code, headers=response_headers(response.headers),
+                           ttfb=round(time.perf_counter() - started, 4))
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=RecordingStream(response.stream, Recorder(self.cassette, interaction, started)),
+                              extensions=response.extensions, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+cassette = Cassette()
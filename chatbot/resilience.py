@@ -0,0 +1,242 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple, Type
+
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('CALAVERA_BREAKER_FAILURES', '5'))
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv('CALAVERA_BREAKER_RECOVERY', '30'))
+RETRY_MAX_ATTEMPTS = int(os.getenv('CALAVERA_RETRY_MAX', '2'))
+RETRY_BASE_DELAY = float(os.getenv('CALAVERA_RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('CALAVERA_RETRY_MAX_DELAY', '8'))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Dilempar saat circuit breaker provider sedang terbuka (request tidak dikirim)"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit breaker terbuka untuk {name}: service unavailable "
+                         f"(dicoba lagi dalam {retry_in:.0f} detik)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker per provider.
+
+    closed    -> request jalan normal, kegagalan beruntun dihitung
+    open      -> request langsung ditolak selama recovery_timeout
+    half_open -> satu request percobaan; sukses menutup, gagal membuka lagi
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout: float = BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.total_rejected = 0
+        self.total_opened = 0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """True jika request ke provider ini akan ditolak sekarang"""
+        with self._lock:
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at < self.recovery_timeout
+            return self.state == 'half_open' and self.trial_in_flight
+
+    def before_request(self):
+        """Cek izin sebelum request dikirim; lempar CircuitOpenError jika ditolak"""
+        with self._lock:
+            if self.state == 'open':
+                elapsed = time.monotonic() - self.opened_at
+                if elapsed < self.recovery_timeout:
+                    self.total_rejected += 1
+                    raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+                self.state = 'half_open'
+                self.trial_in_flight = False
+
+            if self.state == 'half_open':
+                if self.trial_in_flight:
+                    self.total_rejected += 1
+                    raise CircuitOpenError(self.name, 1)
+                self.trial_in_flight = True
+
+    def release(self):
+        """Lepas slot percobaan half-open tanpa menghitung sukses/gagal (mis. request dibatalkan)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.total_opened += 1
+                    print(f"⚠️ [BREAKER] {self.name} dibuka setelah {self.failures} kegagalan")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.total_opened,
+                "rejected": self.total_rejected
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Ambil circuit breaker untuk satu provider (origin host)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breaker_stats() -> Dict:
+    return {"pid": os.getpid(),
+            "breakers": {name: breaker.snapshot() for name, breaker in list(_breakers.items())}}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After bisa berupa detik atau tanggal HTTP"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+    """
+    Delay sebelum percobaan ke-(attempt+1): exponential backoff dengan full
+    jitter. Retry-After dari provider dihormati; jika lebih lama dari
+    RETRY_MAX_DELAY, kembalikan None (lebih baik failover ke provider lain).
+    """
+    if retry_after is not None:
+        return retry_after if retry_after <= RETRY_MAX_DELAY else None
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _retry_delay(attempt: int, status: Optional[int], headers) -> Optional[float]:
+    if attempt >= RETRY_MAX_ATTEMPTS:
+        return None
+    retry_after = parse_retry_after(headers.get('Retry-After')) if headers is not None else None
+    return backoff_delay(attempt, retry_after)
+
+
+def send_with_retry(name: str, send: Callable, retryable_errors: Tuple[Type[BaseException], ...] = (),
+                    non_retryable_errors: Tuple[Type[BaseException], ...] = ()):
+    """
+    Kirim request lewat circuit breaker dengan retry untuk 429/5xx dan
+    error koneksi. send() mengembalikan response dengan .status_code dan
+    .headers; response gagal yang di-retry ditutup dulu.
+    """
+    breaker = get_breaker(name)
+    attempt = 0
+    while True:
+        if attempt == 0:
+            breaker.before_request()
+        try:
+            response = send()
+        except retryable_errors:
+            delay = _retry_delay(attempt, None, None)
+            if delay is None:
+                breaker.record_failure()
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except non_retryable_errors:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+
+        if response.status_code not in RETRYABLE_STATUS:
+            breaker.record_success()
+            return response
+
+        delay = _retry_delay(attempt, response.status_code, response.headers)
+        if delay is None:
+            breaker.record_failure()
+            return response
+
+        print(f"⚠️ [RETRY] {name} HTTP {response.status_code}, coba lagi dalam {delay:.1f}s")
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def async_send_with_retry(name: str, send: Callable, retryable_errors: Tuple[Type[BaseException], ...] = (),
+                                non_retryable_errors: Tuple[Type[BaseException], ...] = (),
+                                close: Optional[Callable] = None):
+    """Versi async dari send_with_retry; send() adalah coroutine function"""
+    breaker = get_breaker(name)
+    attempt = 0
+    while True:
+        if attempt == 0:
+            breaker.before_request()
+        try:
+            response = await send()
+        except retryable_errors:
+            delay = _retry_delay(attempt, None, None)
+            if delay is None:
+                breaker.record_failure()
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except non_retryable_errors:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+
+        if response.status_code not in RETRYABLE_STATUS:
+            breaker.record_success()
+            return response
+
+        delay = _retry_delay(attempt, response.status_code, response.headers)
+        if delay is None:
+            breaker.record_failure()
+            return response
+
+        print(f"⚠️ [RETRY] {name} HTTP {response.status_code}, coba lagi dalam {delay:.1f}s")
+        if close is not None:
+            await close(response)
+        await asyncio.sleep(delay)
+        attempt += 1
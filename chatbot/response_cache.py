@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+CACHE_ENABLED = os.getenv('CALAVERA_CACHE_ENABLED', '1') == '1'
+CACHE_MAX_ENTRIES = int(os.getenv('CALAVERA_CACHE_MAX_ENTRIES', '512'))
+CACHE_TTL = int(os.getenv('CALAVERA_CACHE_TTL', str(6 * 60 * 60)))
+# Kosongkan untuk cache in-memory saja; isi path agar cache selamat saat worker restart
+CACHE_DB = os.getenv('CALAVERA_CACHE_DB', '')
+CACHE_DB_MAX_ENTRIES = int(os.getenv('CALAVERA_CACHE_DB_MAX_ENTRIES', '5000'))
+
+# Cache analisis gambar (key = hash isi gambar yang sudah dinormalisasi + prompt)
+VISION_CACHE_ENABLED = os.getenv('CALAVERA_VISION_CACHE_ENABLED', '1') == '1'
+VISION_CACHE_MAX_ENTRIES = int(os.getenv('CALAVERA_VISION_CACHE_MAX_ENTRIES', '256'))
+VISION_CACHE_TTL = int(os.getenv('CALAVERA_VISION_CACHE_TTL', str(24 * 60 * 60)))
+VISION_CACHE_DB = os.getenv('CALAVERA_VISION_CACHE_DB', CACHE_DB)
+
+_PUNCTUATION_TAIL = re.compile(r'[\s\?\!\.\,]+$')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalisasi prompt: huruf kecil, spasi dirapikan, tanda baca di akhir dibuang"""
+    text = _WHITESPACE.sub(' ', (prompt or '').casefold()).strip()
+    return _PUNCTUATION_TAIL.sub('', text)
+
+
+def build_history_window(engine, history: List[Dict] = None) -> List[Dict]:
+    """
+    Ambil potongan history yang benar-benar dikirim engine ke provider,
+    memakai builder milik engine itu sendiri (_build_chat_messages atau
+    _build_chat_contents) supaya key cache ikut berubah kalau window berubah.
+    """
+    if not history:
+        return []
+    if hasattr(engine, '_build_chat_messages'):
+        # Buang system instruction (index 0) dan prompt kosong (terakhir)
+        return engine._build_chat_messages("", "", history)[1:-1]
+    if hasattr(engine, '_build_chat_contents'):
+        return engine._build_chat_contents("", history)[:-1]
+    return list(history)
+
+
+def history_digest(engine, history: List[Dict] = None) -> str:
+    """Digest SHA-256 dari window history yang dikirim ke provider"""
+    window = build_history_window(engine, history)
+    encoded = json.dumps(window, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(model: str, personality: str, prompt: str, engine=None,
+                   history: List[Dict] = None) -> str:
+    """Key cache = model + kepribadian + prompt ternormalisasi + digest history"""
+    parts = [
+        model or '',
+        (personality or '').strip(),
+        normalize_prompt(prompt),
+        history_digest(engine, history)
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def make_vision_cache_key(model: str, personality: str, prompt: str, image_data: bytes) -> str:
+    """
+    Key cache vision = model + kepribadian + prompt ternormalisasi + SHA-256
+    gambar hasil prepare_image (upload ulang file yang sama menghasilkan byte yang sama)
+    """
+    parts = [
+        'vision',
+        model or '',
+        (personality or '').strip(),
+        normalize_prompt(prompt),
+        hashlib.sha256(image_data).hexdigest()
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache jawaban AI dengan eviction LRU (jumlah entri) + TTL.
+
+    Lapisan pertama OrderedDict di memori proses; jika db_path diisi, entri
+    juga ditulis ke SQLite (WAL) sehingga bisa dipakai worker lain dan
+    selamat saat worker di-restart.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL,
+                 db_path: str = CACHE_DB, table: str = 'response_cache',
+                 db_max_entries: int = CACHE_DB_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.table = table
+        self.db_max_entries = db_max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self.evictions = 0
+
+        if self.db_path:
+            self._init_db()
+
+    def _get_db(self) -> sqlite3.Connection:
+        """Satu koneksi SQLite per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._get_db()
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.table}
+                         (key TEXT PRIMARY KEY,
+                          value TEXT NOT NULL,
+                          expires_at REAL NOT NULL,
+                          last_access REAL NOT NULL)''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_access ON {self.table} (last_access)')
+        conn.commit()
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        """Simpan ke layer memori dan buang entri paling lama tidak dipakai"""
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str, record: bool = True) -> Optional[str]:
+        """
+        Ambil jawaban dari cache, None jika tidak ada atau sudah kedaluwarsa.
+        record=False untuk polling (single-flight) agar statistik hit/miss tidak bias.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    if record:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.db_path:
+            try:
+                conn = self._get_db()
+                row = conn.execute(f'SELECT value, expires_at FROM {self.table} WHERE key = ?',
+                                   (key,)).fetchone()
+                if row and row[1] > now:
+                    conn.execute(f'UPDATE {self.table} SET last_access = ? WHERE key = ?', (now, key))
+                    conn.commit()
+                    self._remember(key, row[0], row[1])
+                    if record:
+                        with self._lock:
+                            self.hits += 1
+                            self.db_hits += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"⚠️ [CACHE] Gagal membaca cache SQLite: {e}")
+
+        if record:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None):
+        """Simpan jawaban ke cache"""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+        self._remember(key, value, expires_at)
+
+        if self.db_path:
+            try:
+                conn = self._get_db()
+                conn.execute(f'''INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access)
+                                 VALUES (?, ?, ?, ?)''', (key, value, expires_at, now))
+                conn.commit()
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._prune_db(now)
+            except sqlite3.Error as e:
+                print(f"⚠️ [CACHE] Gagal menulis cache SQLite: {e}")
+
+    def _prune_db(self, now: float):
+        """Hapus entri kedaluwarsa dan batasi jumlah baris SQLite (LRU)"""
+        conn = self._get_db()
+        conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+        conn.execute(f'''DELETE FROM {self.table} WHERE key IN (
+                            SELECT key FROM {self.table} ORDER BY last_access DESC
+                            LIMIT -1 OFFSET ?)''', (self.db_max_entries,))
+        conn.commit()
+
+    def clear(self):
+        """Kosongkan cache (memori dan SQLite)"""
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            conn = self._get_db()
+            conn.execute(f'DELETE FROM {self.table}')
+            conn.commit()
+
+    def stats(self) -> Dict:
+        """Statistik hit/miss cache di proses ini"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "pid": os.getpid(),
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "persistent": bool(self.db_path),
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+response_cache = ResponseCache()
+vision_cache = ResponseCache(max_entries=VISION_CACHE_MAX_ENTRIES, ttl=VISION_CACHE_TTL,
+                             db_path=VISION_CACHE_DB, table='vision_cache')
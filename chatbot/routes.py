@@ -1,22 +1,46 @@
-from flask import render_template, request, jsonify, session
+from flask import render_template, request, jsonify, session, Response, stream_with_context, has_request_context
 from . import chatbot_bp
-from .ai_utils import GeminiAI, LangSearchAPI
-from .ai_groq import GroqAI
-from .ai_mistral import MistralAI
-from .ai_deepseek import DeepSeekAI
+from .ai_utils import GeminiAI, LangSearchAPI, is_ai_error_response, GEMINI_URL, LANGSEARCH_URL
+from .ai_groq import GroqAI, GROQ_URL
+from .ai_mistral import MistralAI, OPENROUTER_URL as MISTRAL_URL
+from .ai_deepseek import DeepSeekAI, OPENROUTER_URL as DEEPSEEK_URL
 from .file_parser import FileParser
+from . import fastjson, http_pool
+from .response_cache import (response_cache, make_cache_key, history_digest, CACHE_ENABLED,
+                             vision_cache, make_vision_cache_key, VISION_CACHE_ENABLED)
+from .semantic_cache import semantic_cache, SEMANTIC_CACHE_ENABLED
+from .hedging import HedgedEngine, hedge_stats, parse_hedge_pairs, HEDGE_ENABLED, HEDGE_PAIRS
+from .failover import FailoverEngine, failover_stats, parse_failover_order, FAILOVER_ENABLED, FAILOVER_ORDER
+from .resilience import breaker_stats
+from .rate_limiter import rate_limiter
+from .single_flight import single_flight, SINGLE_FLIGHT_ENABLED
+from .context_cache import format_document, prompt_cache_stats, gemini_context_cache
+from .history_window import summarizer, summary_store, SUMMARY_MODEL
+from .history_store import history_store
+from .image_prep import prepare_image, image_max_side, image_prep_stats
+from .uploads import upload_buffer, persist_upload, PERSIST_CHAT_UPLOADS, IMAGE_MAX_BYTES
+from .job_queue import job_queue, JOB_QUEUE_ENABLED, JOB_MODES
+from .batch import run_batch, parse_batch_prompts
+from .metrics import metrics
+from .tracing import tracer
+from .usage_ledger import usage_ledger, mark_provider_call
 import os
+import time
+import uuid
 import shutil
+import threading
 from datetime import datetime
+from functools import wraps
 from werkzeug.utils import secure_filename
-from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
 
 
 BASE_DIR = os.path.dirname(__file__)
 ENV_PATH = os.path.join(BASE_DIR, '.env')
 
-if os.path.exists(ENV_PATH);
-load_dotenv(ENV_PATH)
+if os.path.exists(ENV_PATH):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_PATH)
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 LANGSEARCH_API_KEY = os.getenv('LANGSEARCH_API_KEY')
@@ -24,20 +48,74 @@ GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 
-gemini = GeminiAI(GEMINI_API_KEY)
-groq = GroqAI(GROQ_API_KEY)
-mistral = MistralAI(MISTRAL_API_KEY)
-deepseek = DeepSeekAI(DEEPSEEK_API_KEY)
-langsearch = LangSearchAPI(LANGSEARCH_API_KEY)
-
-print("=" * 50)
-print("🚀 AI ENGINES INITIALIZED:")
-print(f"✅ Gemini API Key: {'SET' if GEMINI_API_KEY else 'MISSING'}")
-print(f"✅ Groq API Key: {'SET' if GROQ_API_KEY else 'MISSING'}")
-print(f"✅ Mistral API Key: {'SET' if MISTRAL_API_KEY else 'MISSING'}")
-print(f"✅ DeepSeek API Key: {'SET' if DEEPSEEK_API_KEY else 'MISSING'}")
-print(f"✅ LangSearch API Key: {'SET' if LANGSEARCH_API_KEY else 'MISSING'}")
-print("=" * 50)
+# Engine async (default, sama di development dan gunicorn): I/O ke provider
+# dimultipleks di satu event loop per proses. 0 = engine sync (requests)
+USE_ASYNC_ENGINES = os.getenv('CALAVERA_ASYNC_ENGINES', '1') == '1'
+
+# Nama engine -> (class sync, nama class async di ai_async, API key)
+ENGINE_SPECS = {
+    "gemini": (GeminiAI, "AsyncGeminiAI", GEMINI_API_KEY),
+    "groq": (GroqAI, "AsyncGroqAI", GROQ_API_KEY),
+    "mistral": (MistralAI, "AsyncMistralAI", MISTRAL_API_KEY),
+    "deepseek": (DeepSeekAI, "AsyncDeepSeekAI", DEEPSEEK_API_KEY),
+    "langsearch": (LangSearchAPI, "AsyncLangSearchAPI", LANGSEARCH_API_KEY),
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def print_engine_banner():
+    print("=" * 50)
+    print("🚀 AI ENGINES INITIALIZED:")
+    print(f"✅ Gemini API Key: {'SET' if GEMINI_API_KEY else 'MISSING'}")
+    print(f"✅ Groq API Key: {'SET' if GROQ_API_KEY else 'MISSING'}")
+    print(f"✅ Mistral API Key: {'SET' if MISTRAL_API_KEY else 'MISSING'}")
+    print(f"✅ DeepSeek API Key: {'SET' if DEEPSEEK_API_KEY else 'MISSING'}")
+    print(f"✅ LangSearch API Key: {'SET' if LANGSEARCH_API_KEY else 'MISSING'}")
+    print(f"⚡ Engine mode: {'async (event loop)' if USE_ASYNC_ENGINES else 'sync'}")
+    print("=" * 50)
+
+
+def create_engine(name: str):
+    sync_class, async_class_name, api_key = ENGINE_SPECS[name]
+    if USE_ASYNC_ENGINES:
+        from . import ai_async
+        return ai_async.SyncEngineBridge(getattr(ai_async, async_class_name)(api_key))
+    return sync_class(api_key)
+
+
+def get_engine(name: str):
+    """
+    Engine dibuat saat pertama dipakai (bukan saat import), sehingga worker
+    yang hanya melayani halaman web siap dalam hitungan milidetik.
+    """
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                if not _engines:
+                    print_engine_banner()
+                engine = _engines[name] = create_engine(name)
+    return engine
+
+
+# Origin semua provider, diambil dari konstanta URL (engine tidak perlu dibuat)
+PROVIDER_URLS = (GEMINI_URL, GROQ_URL, MISTRAL_URL, DEEPSEEK_URL, LANGSEARCH_URL)
+
+
+def warm_up_engines():
+    """
+    Buka koneksi ke origin provider di background thread. Dipanggil dari hook
+    post_fork gunicorn (gunicorn.conf.py), bukan saat import: engine tetap
+    dibuat lazy oleh get_engine.
+    """
+    try:
+        http_pool.transport.warm_up_async(list(PROVIDER_URLS))
+    except Exception as e:
+        print(f"⚠️ [HTTP POOL] Warm-up engine gagal: {e}")
+
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'img', 'chat_uploads')
 
@@ -77,55 +155,298 @@ def sanitize_error(error_message: str) -> str:
         return "🔧 Server sedang bermasalah. Tim sudah diberitahu dan akan segera memperbaikinya!"
     
     if any(keyword in error_lower for keyword in ['image', 'file', 'upload']):
-        return "🖼️ Gagal memproses gambar. Pastikan file berupa gambar valid (JPG/PNG) dan ukurannya tidak lebih dari 5MB."
+        return ("🖼️ Gagal memproses gambar. Pastikan file berupa gambar valid (JPG/PNG) dan ukurannya "
+                f"tidak lebih dari {IMAGE_MAX_BYTES // (1024 * 1024)}MB.")
     
     return "⚠️ Terjadi kesalahan saat memproses permintaan kamu. Coba lagi ya!"
 
-def get_ai_engine(model: str):
+HEDGE_PAIR_MAP = parse_hedge_pairs(HEDGE_PAIRS)
+FAILOVER_CHAIN = parse_failover_order(FAILOVER_ORDER)
+AI_MODELS = ("gemini", "groq", "mistral", "deepseek")
+# Jumlah pesan yang disimpan di history store; pesan lebih lama masuk ringkasan
+HISTORY_LIMIT = 10
+
+
+def get_base_engine(model: str):
     """Get AI engine based on model selection"""
-    if model == "groq":
-        return groq
-    elif model == "deepseek":  # ✅ TAMBAHKAN INI
-        return deepseek
-    elif model == "mistral":  # ✅ TAMBAHKAN INI
-        return mistral
-    else:
-        return gemini
+    if model in AI_MODELS:
+        return get_engine(model)
+    return get_engine("gemini")
+
+
+def hedge_requested() -> bool:
+    """Hedging aktif global (CALAVERA_HEDGE=1) atau diminta per request (hedge=1)"""
+    if HEDGE_ENABLED:
+        return True
+    return has_request_context() and request.values.get("hedge") == "1"
+
+
+def get_ai_engine(model: str, hedge: bool = None, failover: bool = True):
+    """
+    Get AI engine, dibungkus HedgedEngine jika hedging aktif dan model punya
+    cadangan, lalu FailoverEngine agar provider lain dipakai saat yang dipilih gagal.
+    failover=False (mode bandingkan) memastikan jawaban benar-benar dari model itu.
+    """
+    engine = get_base_engine(model)
+    
+    if hedge is None:
+        hedge = hedge_requested()
+    
+    secondary = HEDGE_PAIR_MAP.get(model)
+    if hedge and secondary and secondary != model:
+        engine = HedgedEngine(model, engine, secondary, get_base_engine(secondary))
+    
+    if FAILOVER_ENABLED and failover:
+        chain = [(model, engine)] + [(name, get_base_engine(name)) for name in FAILOVER_CHAIN
+                                     if name != model and name in AI_MODELS]
+        if len(chain) > 1:
+            return FailoverEngine(model, chain)
+    
+    return engine
+
+def admin_required(f):
+    """Endpoint statistik/internal hanya untuk admin yang sudah login"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not session.get('admin_logged_in'):
+            return jsonify({"error": "🔑 Hanya admin yang bisa mengakses fitur ini."}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def cache_bypass_requested() -> bool:
+    """Request boleh melewati cache (misalnya tombol 'Ulangi')"""
+    return request.values.get("no_cache") == "1"
+
+
+def lookup_cached_response(model, prompt, personality, history, ai_engine, bypass=False, semantic=False):
+    """
+    Cari jawaban di response cache (exact), lalu di semantic cache jika diminta.
+    Mengembalikan (jawaban atau None, fungsi untuk menyimpan jawaban baru, key cache).
+    """
+    cache_key = make_cache_key(model, personality, prompt, ai_engine, history)
+    
+    if not CACHE_ENABLED:
+        return None, lambda response: None, cache_key
+    
+    use_semantic = semantic and SEMANTIC_CACHE_ENABLED
+    namespace = f"{model}|{(personality or '').strip()}|{history_digest(ai_engine, history)}"
+    
+    def store(response):
+        if is_ai_error_response(response):
+            return
+        response_cache.set(cache_key, response)
+        if use_semantic:
+            semantic_cache.set(namespace, prompt, response)
+    
+    if bypass:
+        return None, store, cache_key
+    
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        print(f"📊 [CACHE] HIT model={model}")
+        return cached, store, cache_key
+    
+    if use_semantic:
+        similar = semantic_cache.get(namespace, prompt)
+        if similar is not None:
+            print(f"📊 [CACHE] SEMANTIC HIT model={model}")
+            response_cache.set(cache_key, similar)
+            return similar, store, cache_key
+    
+    return None, store, cache_key
+
+
+def cached_generate_text(model, prompt, personality, history, bypass=False, semantic=False, document=None,
+                         chat_id=None, exact_model=False, mode="text"):
+    """
+    generate_text dengan response cache di depannya.
+    bypass=True tetap memanggil provider, lalu menyimpan jawaban baru ke cache.
+    Request identik yang datang bersamaan berbagi satu panggilan provider (single-flight).
+    document dikirim engine sebagai prefix stabil (context caching provider).
+    chat_id diisi pemanggil di luar request (worker job queue, thread fan-out)
+    untuk mengambil ringkasan history. exact_model=True mematikan hedging/failover.
+    Setiap panggilan dicatat ke usage ledger (mode = text/file/batch/compare/...).
+    """
+    with usage_ledger.track(model, mode, 'generate_text') as call:
+        ai_engine = get_ai_engine(model, hedge=False, failover=False) if exact_model else get_ai_engine(model)
+        history = with_history_summary(history, chat_id)
+        key_prompt = f"{document}\x1e{prompt}" if document else prompt
+        cached, store, cache_key = lookup_cached_response(model, key_prompt, personality, history,
+                                                          ai_engine, bypass, semantic)
+        
+        if cached is not None:
+            return cached
+        
+        def generate():
+            mark_provider_call()
+            with metrics.timer('calavera_engine_call_seconds', model=model, operation='generate_text'), \
+                    tracer.span('engine.generate_text', model=model, engine=type(ai_engine).__name__):
+                return ai_engine.generate_text(prompt, personality, history, document)
+        
+        if SINGLE_FLIGHT_ENABLED and not bypass:
+            return call.result(single_flight.run(
+                cache_key,
+                generate,
+                store,
+                lambda: response_cache.get(cache_key, record=False)
+            ))
+        
+        response = call.result(generate())
+        store(response)
+        
+        return response
+
+
+def cached_stream_text(model, prompt, personality, history, bypass=False, semantic=False, mode="text"):
+    """Versi streaming dari cached_generate_text: cache hit dikirim sebagai satu delta"""
+    ai_engine = get_ai_engine(model)
+    history = with_history_summary(history)
+    cached, store, cache_key = lookup_cached_response(model, prompt, personality, history,
+                                                      ai_engine, bypass, semantic)
+    
+    def start():
+        mark_provider_call()
+        return ai_engine.stream_text(prompt, personality, history)
+    
+    def upstream():
+        if cached is not None:
+            return iter([cached])
+        if SINGLE_FLIGHT_ENABLED and not bypass:
+            return single_flight.stream(
+                cache_key,
+                start,
+                store,
+                lambda: response_cache.get(cache_key, record=False)
+            )
+        
+        def generate_and_store():
+            parts = []
+            for chunk in start():
+                parts.append(chunk)
+                yield chunk
+            store("".join(parts))
+        return generate_and_store()
+    
+    def generate():
+        # Dicatat saat stream selesai (latency = sampai potongan terakhir); upstream
+        # dimulai di dalam blok agar token dari thread pump single-flight ikut tercatat
+        with usage_ledger.track(model, mode, 'stream_text') as call:
+            chunks = upstream()
+            parts = []
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            call.result("".join(parts))
+    
+    return generate()
+
+
+def cached_analyze_image(model, image_data, mime_type, prompt, personality):
+    """
+    analyze_image dengan vision cache di depannya: gambar + prompt yang sama
+    (misalnya foto soal yang di-upload ulang) tidak memanggil provider lagi.
+    """
+    with usage_ledger.track(model, 'image', 'analyze_image') as call:
+        ai_engine = get_ai_engine(model)
+        
+        def analyze():
+            mark_provider_call()
+            with metrics.timer('calavera_engine_call_seconds', model=model, operation='analyze_image'), \
+                    tracer.span('engine.analyze_image', model=model, engine=type(ai_engine).__name__):
+                return ai_engine.analyze_image(image_data, prompt, personality, mime_type)
+        
+        if not VISION_CACHE_ENABLED:
+            return call.result(analyze())
+        
+        cache_key = make_vision_cache_key(model, personality, prompt, image_data)
+        cached = vision_cache.get(cache_key)
+        if cached is not None:
+            print(f"📊 [VISION CACHE] HIT model={model}")
+            return cached
+        
+        def store(response):
+            if not is_ai_error_response(response):
+                vision_cache.set(cache_key, response)
+        
+        if SINGLE_FLIGHT_ENABLED:
+            return call.result(single_flight.run(
+                cache_key,
+                analyze,
+                store,
+                lambda: vision_cache.get(cache_key, record=False)
+            ))
+        
+        response = call.result(analyze())
+        store(response)
+        return response
+
+
+def get_chat_id():
+    """ID percakapan di session; history dan ringkasannya disimpan di server"""
+    if 'chat_id' not in session:
+        session['chat_id'] = uuid.uuid4().hex
+    return session['chat_id']
+
 
 def get_chat_history():
-    """Get or initialize chat history from session"""
-    if 'chat_history' not in session:
-        session['chat_history'] = []
-    return session['chat_history']
+    """Get chat history dari history store (cookie hanya berisi chat_id)"""
+    chat_id = get_chat_id()
+    legacy = session.pop('chat_history', None)
+    if legacy:
+        # Session lama masih membawa history di cookie: pindahkan ke server
+        history_store.replace(chat_id, legacy[-HISTORY_LIMIT:])
+    return history_store.load(chat_id, HISTORY_LIMIT)
+
+
+def with_history_summary(history, chat_id=None):
+    """Sisipkan ringkasan percakapan lama (jika ada) di depan history untuk engine"""
+    if chat_id is None:
+        if not has_request_context():
+            return history
+        chat_id = get_chat_id()
+    return summarizer.attach(chat_id, history)
 
 
-def update_chat_history(history):
-    """Update and limit chat history in session"""
-    session['chat_history'] = history[-10:]
-    session.modified = True
+def append_chat_history(history, *messages, chat_id=None):
+    """Tambahkan pesan baru ke history store, lalu ringkas giliran lama di background"""
+    chat_id = chat_id or get_chat_id()
+    history.extend(messages)
+    summary_engine = get_ai_engine(SUMMARY_MODEL, hedge=False)
+    
+    def summarize(prompt):
+        with usage_ledger.track(SUMMARY_MODEL, 'summary', 'generate_text') as call:
+            mark_provider_call()
+            return call.result(summary_engine.generate_text(prompt))
+    
+    summarizer.schedule(chat_id, history, HISTORY_LIMIT, summarize)
+    history_store.append(chat_id, list(messages), HISTORY_LIMIT)
 
 
-def save_uploaded_image(image_file):
-    """Save uploaded image and return filepath and URL"""
+@tracer.traced()
+def save_uploaded_image(filename, buffer):
+    """Save uploaded image (dari buffer memori) and return filepath and URL"""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    original_filename = secure_filename(image_file.filename)
+    original_filename = secure_filename(filename)
     filename = f"chat_{timestamp}_{original_filename}"
     filepath = os.path.join(UPLOAD_FOLDER, filename)
     
-    image_file.save(filepath)
+    persist_upload(buffer, filepath)
     image_url = f"/static/img/chat_uploads/{filename}"
     
     return filepath, image_url
 
 
+@tracer.traced()
 def handle_search_mode(message, history):
     """Handle internet search mode"""
+    langsearch = get_engine("langsearch")
     search_results = langsearch.search(message)
     formatted_results = langsearch.format_results(search_results)
     
-    history.append({"role": "user", "content": f"[PENCARIAN] {message}"})
-    history.append({"role": "assistant", "content": formatted_results})
-    update_chat_history(history)
+    append_chat_history(history,
+                        {"role": "user", "content": f"[PENCARIAN] {message}"},
+                        {"role": "assistant", "content": formatted_results})
     
     return {
         "response": formatted_results,
@@ -133,11 +454,8 @@ def handle_search_mode(message, history):
     }
 
 
-def handle_image_mode(message, personality, model, history):
-    """Handle image analysis mode"""
-    if model == "deepseek":
-        raise ValueError("⚠️ DeepSeek tidak mendukung analisis gambar. Silakan gunakan model Gemini atau Llama.")
-    
+def get_uploaded_image():
+    """Ambil dan validasi file gambar dari request"""
     if 'image' not in request.files:
         raise ValueError("🖼️ Tidak ada gambar yang diupload")
     
@@ -149,18 +467,57 @@ def handle_image_mode(message, personality, model, history):
     if not allowed_image_file(image_file.filename):  # ✅ UPDATE INI
         raise ValueError("🖼️ Format gambar tidak didukung. Gunakan JPG, PNG, atau GIF")
     
-    filepath, image_url = save_uploaded_image(image_file)
+    return image_file
+
+
+def get_uploaded_document():
+    """Ambil dan validasi file dokumen dari request"""
+    if 'file' not in request.files:
+        raise ValueError("📄 Tidak ada file yang diupload")
     
-    with open(filepath, 'rb') as f:
-        image_data = f.read()
+    file = request.files['file']
     
-    ai_engine = get_ai_engine(model)
+    if file.filename == '':
+        raise ValueError("📄 File kosong")
+    
+    if not allowed_document_file(file.filename):
+        raise ValueError("📄 Format file tidak didukung. Gunakan PDF, DOCX, atau TXT")
+    
+    return file
+
+
+@tracer.traced()
+def handle_image_mode(message, personality, model, history):
+    """Handle image analysis mode"""
+    if model == "deepseek":
+        raise ValueError("⚠️ DeepSeek tidak mendukung analisis gambar. Silakan gunakan model Gemini atau Llama.")
+    
+    image_file = get_uploaded_image()
+    
+    # Upload dibaca langsung dari buffer memori (tanpa tulis-lalu-baca dari disk)
+    with upload_buffer(image_file) as buffer:
+        return process_image(buffer, image_file.filename, message, personality, model, history)
+
+
+@tracer.traced()
+def process_image(buffer, filename, message, personality, model, history, chat_id=None):
+    """Analisis gambar dari buffer upload (dipakai request biasa dan worker job queue)"""
     prompt = message if message else "Jelaskan apa yang ada di gambar ini"
-    response = ai_engine.analyze_image(image_data, prompt, personality)
+    image_url = None
+    
+    # Validasi + kecilkan gambar sebelum dikirim ke provider
+    image_data, mime_type = prepare_image(buffer, image_max_side(model))
+    response = cached_analyze_image(model, image_data, mime_type, prompt, personality)
+    del image_data
     
-    history.append({"role": "user", "content": f"[GAMBAR] {prompt}", "image_url": image_url})
-    history.append({"role": "assistant", "content": response})
-    update_chat_history(history)
+    # Disimpan ke disk hanya jika image_url dipakai
+    if PERSIST_CHAT_UPLOADS:
+        _, image_url = save_uploaded_image(filename, buffer)
+    
+    append_chat_history(history,
+                        {"role": "user", "content": f"[GAMBAR] {prompt}", "image_url": image_url},
+                        {"role": "assistant", "content": response},
+                        chat_id=chat_id)
     
     return {
         "response": response,
@@ -169,38 +526,27 @@ def handle_image_mode(message, personality, model, history):
         "model": model
     }
 
+@tracer.traced()
 def handle_file_mode(message, personality, model, history):
     """Handle document file upload and analysis"""
-    if 'file' not in request.files:
-        raise ValueError("📄 Tidak ada file yang diupload")
-    
-    file = request.files['file']
-    
-    if file.filename == '':
-        raise ValueError("📄 File kosong")
-    
-    if not allowed_document_file(file.filename):
-        raise ValueError("📄 Format file tidak didukung. Gunakan PDF, DOCX, atau TXT")
-    
-    # Save file temporarily
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    original_filename = secure_filename(file.filename)
-    filename = f"doc_{timestamp}_{original_filename}"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    file = get_uploaded_document()
     
-    file.save(filepath)
+    # Parse file langsung dari buffer upload (tidak perlu file sementara di disk)
+    with upload_buffer(file) as buffer:
+        return process_file(buffer, file.filename, message, personality, model, history,
+                            bypass=cache_bypass_requested())
+
+
+@tracer.traced()
+def process_file(buffer, filename, message, personality, model, history, bypass=False, chat_id=None):
+    """Parse dokumen dari buffer upload lalu kirim ke AI (dipakai request biasa dan worker job queue)"""
+    original_filename = secure_filename(filename)
     
     # Extract file extension
     file_extension = original_filename.rsplit('.', 1)[1].lower()
     
-    # Parse file to extract text
-    extracted_text = FileParser.parse_file(filepath, file_extension)
-    
-    # Delete file after extraction (optional, untuk hemat storage)
-    try:
-        os.remove(filepath)
-    except:
-        pass
+    with metrics.timer('calavera_file_parse_seconds', format=file_extension):
+        extracted_text = FileParser.parse_buffer(buffer, file_extension)
     
     # Check if extraction failed
     if extracted_text.startswith("⚠️"):
@@ -214,39 +560,29 @@ def handle_file_mode(message, personality, model, history):
     # Get file info
     # file_info = FileParser.get_file_info(extracted_text, original_filename)
     
+    # Isi file jadi prefix stabil (setelah system instruction), pertanyaan di pesan terakhir
+    document = format_document(original_filename, extracted_text)
+    
     # Build prompt untuk AI
     if message:
-        ai_prompt = f"""File: {original_filename}
-
-Isi File:
-{extracted_text}
-
----
-
-Pertanyaan User: {message}
+        ai_prompt = f"""Pertanyaan User: {message}
 
 Jawab pertanyaan user berdasarkan isi file di atas."""
     else:
-        ai_prompt = f"""File: {original_filename}
-
-Isi File:
-{extracted_text}
-
----
-
-Buatkan ringkasan singkat dari isi file ini."""
+        ai_prompt = "Buatkan ringkasan singkat dari isi file di atas."
     
     # Send to AI
-    ai_engine = get_ai_engine(model)
-    response = ai_engine.generate_text(ai_prompt, personality, history)
+    response = cached_generate_text(model, ai_prompt, personality, history,
+                                    bypass=bypass, document=document, chat_id=chat_id, mode="file")
     
     # ✅ GANTI BAGIAN INI - Langsung response AI tanpa file info
     final_response = response  # Langsung response, tanpa statistik
     
     # Save to history
-    history.append({"role": "user", "content": f"[FILE: {original_filename}] {message if message else 'Analisis file'}"})
-    history.append({"role": "assistant", "content": final_response})
-    update_chat_history(history)
+    append_chat_history(history,
+                        {"role": "user", "content": f"[FILE: {original_filename}] {message if message else 'Analisis file'}"},
+                        {"role": "assistant", "content": final_response},
+                        chat_id=chat_id)
     
     return {
         "response": final_response,
@@ -255,16 +591,58 @@ Buatkan ringkasan singkat dari isi file ini."""
         "model": model
     }
 
+
+def enqueue_upload_job(mode, message, personality, model):
+    """
+    Simpan upload image/file sebagai job di antrean lalu langsung balas job_id;
+    analisisnya dikerjakan proses worker terpisah (python -m chatbot.worker).
+    """
+    upload = get_uploaded_image() if mode == "image" else get_uploaded_document()
+    params = {
+        "message": message,
+        "personality": personality,
+        "model": model,
+        "filename": upload.filename,
+        "bypass": cache_bypass_requested()
+    }
+    
+    with upload_buffer(upload) as buffer:
+        job_id = job_queue.enqueue(mode, get_chat_id(), params, buffer)
+    
+    return {"job_id": job_id, "status": "queued", "mode": mode, "model": model}
+
+
+def job_requested(mode) -> bool:
+    """Mode image/file lewat antrean jika queue aktif dan diminta (async=1) atau diwajibkan (CALAVERA_JOB_MODES)"""
+    if not JOB_QUEUE_ENABLED or mode not in ("image", "file"):
+        return False
+    return mode in JOB_MODES or request.form.get("async") == "1"
+
+
+def run_job(job):
+    """Kerjakan satu job dari antrean (dipanggil worker, di luar request Flask)"""
+    params = job["params"]
+    chat_id = job["chat_id"]
+    history = history_store.load(chat_id, HISTORY_LIMIT)
+    buffer = memoryview(job["data"] or b'')
+    
+    if job["kind"] == "image":
+        return process_image(buffer, params["filename"], params["message"], params["personality"],
+                             params["model"], history, chat_id=chat_id)
+    return process_file(buffer, params["filename"], params["message"], params["personality"],
+                        params["model"], history, bypass=params.get("bypass", False), chat_id=chat_id)
+
+@tracer.traced()
 def handle_text_mode(message, personality, model, history):
     """Handle normal text chat mode"""
     print(f"📊 [USAGE] Model: {model} | User message length: {len(message)} chars")
-    ai_engine = get_ai_engine(model)
-    response = ai_engine.generate_text(message, personality, history)
+    response = cached_generate_text(model, message, personality, history,
+                                    bypass=cache_bypass_requested(), semantic=True)
     print(f"📊 [USAGE] Model: {model} | Response length: {len(response)} chars")
     
-    history.append({"role": "user", "content": message})
-    history.append({"role": "assistant", "content": response})
-    update_chat_history(history)
+    append_chat_history(history,
+                        {"role": "user", "content": message},
+                        {"role": "assistant", "content": response})
     
     return {
         "response": response,
@@ -273,6 +651,77 @@ def handle_text_mode(message, personality, model, history):
     }
 
 
+def sse_event(event: str, data: dict) -> str:
+    """Format satu event Server-Sent Events (data selalu JSON satu baris)"""
+    return f"event: {event}\ndata: {fastjson.dumps(data).decode('utf-8')}\n\n"
+
+
+def stream_response(chunks, model, user_message=None, regenerate=False):
+    """
+    Relay potongan teks dari engine ke browser sebagai SSE.
+
+    History disimpan di server per chat_id, jadi giliran ini langsung
+    ditulis begitu stream selesai (sebelum event 'done'): tab yang ditutup
+    setelah jawaban lengkap tidak kehilangan giliran. Stream yang dibatalkan
+    di tengah (tombol stop) tidak disimpan.
+    """
+    chat_id = get_chat_id()
+    
+    def generate():
+        parts = []
+        yield sse_event("start", {"model": model})
+        
+        for chunk in chunks:
+            parts.append(chunk)
+            yield sse_event("delta", {"text": chunk})
+        
+        response = "".join(parts)
+        commit_stream(chat_id, response, user_message, regenerate)
+        
+        yield sse_event("done", {
+            "response": response,
+            "model": model
+        })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+def commit_stream(chat_id, response, user_message=None, regenerate=False):
+    """Simpan hasil mode streaming ke history setelah stream selesai"""
+    try:
+        history = history_store.load(chat_id, HISTORY_LIMIT)
+        
+        messages = []
+        if regenerate:
+            if history and history[-1].get("role") == "assistant":
+                history.pop()
+                history_store.pop_last(chat_id)
+        else:
+            messages.append({"role": "user", "content": user_message or ""})
+        
+        messages.append({"role": "assistant", "content": response})
+        append_chat_history(history, *messages, chat_id=chat_id)
+    except Exception as e:
+        print(f"⚠️ [STREAM] Gagal menyimpan history: {sanitize_error(str(e))}")
+
+
+@tracer.traced()
+def handle_text_mode_stream(message, personality, model, history):
+    """Handle normal text chat mode dengan token streaming (SSE)"""
+    print(f"📊 [USAGE] Model: {model} | User message length: {len(message)} chars | stream")
+    chunks = cached_stream_text(model, message, personality, list(history),
+                                bypass=cache_bypass_requested(), semantic=True)
+    
+    return stream_response(chunks, model, user_message=message)
+
+
 def clear_upload_folder():
     """Delete all uploaded images in folder"""
     if os.path.exists(UPLOAD_FOLDER):
@@ -291,6 +740,7 @@ def calavera_ai():
     return render_template("chatbot.html")
 
 @chatbot_bp.route("/api/chat", methods=["POST"])
+@tracer.traced()
 def chat_api():
     """Handle chat requests"""
     try:
@@ -321,6 +771,7 @@ def chat_api():
                 "error": "⚠️ Pesan terlalu panjang! Maksimal 5000 karakter."
             }), 400
         
+        tracer.annotate(mode=mode, model=model)
         history = get_chat_history()
         
         # ✅ SEARCH MODE
@@ -328,6 +779,10 @@ def chat_api():
             result = handle_search_mode(message, history)
             return jsonify(result)
         
+        # ✅ IMAGE / FILE MODE lewat job queue (balas 202 + job_id)
+        elif job_requested(mode):
+            return jsonify(enqueue_upload_job(mode, message, personality, model)), 202
+        
         # ✅ IMAGE MODE
         elif mode == "image":
             result = handle_image_mode(message, personality, model, history)
@@ -339,16 +794,171 @@ def chat_api():
             return jsonify(result)
         
         # ✅ TEXT MODE (default)
+        elif request.form.get("stream") == "1":
+            return handle_text_mode_stream(message, personality, model, history)
+        
         else:
             result = handle_text_mode(message, personality, model, history)
             return jsonify(result)
     
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except RequestEntityTooLarge as e:
+        # Batas ukuran per mode, dicek saat upload masih dibaca
+        return jsonify({"error": e.description}), 413
     except Exception as e:
         error_msg = sanitize_error(str(e))
         return jsonify({"error": error_msg}), 500
 
+@chatbot_bp.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """
+    Status dan hasil job image/file (hanya pemilik percakapan yang bisa melihat).
+    Client mem-polling endpoint ini dengan backoff: setiap cek request singkat,
+    tidak ada thread web yang ditahan selama job berjalan.
+    """
+    job = job_queue.get(job_id, get_chat_id())
+    if job is None:
+        return jsonify({"error": "Job tidak ditemukan"}), 404
+    return jsonify(job)
+
+
+@chatbot_bp.route("/api/batch", methods=["POST"])
+@admin_required
+def batch_api():
+    """
+    Banyak prompt sekaligus (varian soal, feedback per siswa) dijalankan paralel
+    di bawah rate limit provider. Tanpa history dan tidak mengubah history chat.
+    Default hasil di-stream sebagai SSE ('result' per prompt sesuai urutan selesai);
+    "stream": false menunggu semua lalu membalas JSON urut sesuai input.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        prompts = parse_batch_prompts(data.get("prompts"))
+        personality = data.get("personality", "")
+        model = data.get("model", "gemini")
+        bypass = bool(data.get("no_cache"))
+        
+        if model not in AI_MODELS:
+            return jsonify({"error": "⚠️ Model tidak valid."}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate(prompt):
+        return cached_generate_text(model, prompt, personality, [], bypass=bypass, semantic=True, mode="batch")
+    
+    def results():
+        for item in run_batch(prompts, generate):
+            if "error" in item:
+                item["error"] = sanitize_error(item["error"])
+            elif is_ai_error_response(item["response"]):
+                item["error"] = item.pop("response").strip() or sanitize_error("")
+            yield item
+    
+    print(f"📊 [BATCH] {len(prompts)} prompt | model={model}")
+    
+    if data.get("stream") is False:
+        ordered = sorted(results(), key=lambda item: item["index"])
+        return jsonify({
+            "model": model,
+            "results": ordered,
+            "failed": sum(1 for item in ordered if "error" in item)
+        })
+    
+    def events():
+        start = time.perf_counter()
+        failed = 0
+        yield sse_event("start", {"model": model, "total": len(prompts)})
+        for item in results():
+            failed += "error" in item
+            yield sse_event("result", item)
+        yield sse_event("done", {
+            "total": len(prompts),
+            "failed": failed,
+            "seconds": round(time.perf_counter() - start, 2)
+        })
+    
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def parse_compare_models(value):
+    """'gemini,groq' dari form -> list model valid tanpa duplikat (kosong = semua model)"""
+    models = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in AI_MODELS:
+            raise ValueError("⚠️ Model tidak valid.")
+        if name not in models:
+            models.append(name)
+    models = models or list(AI_MODELS)
+    if len(models) < 2:
+        raise ValueError("⚠️ Pilih minimal 2 model untuk dibandingkan.")
+    return models
+
+
+@chatbot_bp.route("/api/compare", methods=["POST"])
+def compare_api():
+    """
+    Mode bandingkan: satu pesan dikirim ke beberapa model sekaligus, jawaban
+    tiap model di-stream sebagai SSE 'result' begitu selesai beserta latensinya.
+    History dipakai sebagai konteks tapi tidak diubah (belum ada jawaban yang dipilih).
+    """
+    try:
+        message = request.form.get("message", "").strip()
+        personality = request.form.get("personality", "")
+        models = parse_compare_models(request.form.get("models"))
+        
+        if not message:
+            return jsonify({"error": "Pesan tidak boleh kosong"}), 400
+        
+        if len(message) > 5000:
+            return jsonify({
+                "error": "⚠️ Pesan terlalu panjang! Maksimal 5000 karakter."
+            }), 400
+        
+        history = get_chat_history()
+        chat_id = get_chat_id()
+        bypass = cache_bypass_requested()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate(model):
+        return cached_generate_text(model, message, personality, list(history), bypass=bypass,
+                                    semantic=True, chat_id=chat_id, exact_model=True, mode="compare")
+    
+    print(f"📊 [COMPARE] {', '.join(models)} | User message length: {len(message)} chars")
+    
+    def events():
+        start = time.perf_counter()
+        yield sse_event("start", {"models": models})
+        for item in run_batch(models, generate, concurrency=len(models)):
+            result = {"model": models[item["index"]], "latency": item.get("seconds")}
+            if "error" in item:
+                result["error"] = sanitize_error(item["error"])
+            elif is_ai_error_response(item["response"]):
+                result["error"] = item["response"].strip() or sanitize_error("")
+            else:
+                result["response"] = item["response"]
+            yield sse_event("result", result)
+        yield sse_event("done", {"seconds": round(time.perf_counter() - start, 2)})
+    
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @chatbot_bp.route("/api/regenerate", methods=["POST"])
 def regenerate_response():
     """Regenerate last response"""
@@ -370,15 +980,23 @@ def regenerate_response():
         if not last_user_msg:
             return jsonify({"error": "Tidak ditemukan pesan terakhir"}), 400
         
+        if request.json.get("stream"):
+            working_history = list(history)
+            if working_history[-1].get("role") == "assistant":
+                working_history.pop()
+            
+            chunks = cached_stream_text(model, last_user_msg, personality, working_history[:-1], bypass=True,
+                                        mode="regenerate")
+            return stream_response(chunks, model, regenerate=True)
+        
         if history[-1].get("role") == "assistant":
             history.pop()
+            history_store.pop_last(get_chat_id())
         
-        ai_engine = get_ai_engine(model)
-        response = ai_engine.generate_text(last_user_msg, personality, history[:-1])
+        response = cached_generate_text(model, last_user_msg, personality, history[:-1], bypass=True,
+                                        mode="regenerate")
         
-        history.append({"role": "assistant", "content": response})
-        session['chat_history'] = history
-        session.modified = True
+        append_chat_history(history, {"role": "assistant", "content": response})
         
         return jsonify({
             "response": response,
@@ -396,9 +1014,9 @@ def clear_chat():
         # ✅ Clear upload folder (images + files)
         clear_upload_folder()
         
-        # ✅ Clear session history
-        session['chat_history'] = []
-        session.modified = True
+        # ✅ Clear chat history (server-side) dan ringkasannya
+        history_store.clear(get_chat_id())
+        summary_store.delete(get_chat_id())
         
         return jsonify({
             "message": "Chat dan file berhasil dihapus",
@@ -425,11 +1043,91 @@ def delete_message():
         if index < len(history) and history[index].get("role") == "assistant":
             history.pop(index)
         
-        session['chat_history'] = history
-        session.modified = True
+        history_store.replace(get_chat_id(), history)
         
         return jsonify({"message": "Pesan berhasil dihapus"})
     
     except Exception as e:
         error_msg = sanitize_error(str(e))
         return jsonify({"error": error_msg}), 500
+
+
+@chatbot_bp.route("/api/pool-stats", methods=["GET"])
+@admin_required
+def pool_stats():
+    """Statistik connection pool HTTP ke provider AI (khusus admin)"""
+    return jsonify(http_pool.transport.stats())
+
+
+@chatbot_bp.route("/api/hedge-stats", methods=["GET"])
+@admin_required
+def hedge_statistics():
+    """Statistik hedged request per pasangan provider (khusus admin)"""
+    return jsonify(hedge_stats.snapshot())
+
+
+@chatbot_bp.route("/api/resilience-stats", methods=["GET"])
+@admin_required
+def resilience_statistics():
+    """Status circuit breaker per host dan statistik failover (khusus admin)"""
+    return jsonify({
+        "circuit_breakers": breaker_stats(),
+        "failover": failover_stats.snapshot()
+    })
+
+
+@chatbot_bp.route("/api/rate-limit-stats", methods=["GET"])
+@admin_required
+def rate_limit_statistics():
+    """Budget token bucket, concurrency AIMD dan antrean per provider (khusus admin)"""
+    return jsonify(rate_limiter.stats())
+
+
+@chatbot_bp.route("/api/cache-stats", methods=["GET"])
+@admin_required
+def cache_stats():
+    """Statistik response cache, semantic cache, single-flight dan context cache provider (khusus admin)"""
+    return jsonify({
+        "exact": response_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "history_summary": summarizer.stats(),
+        "history_store": history_store.stats(),
+        "context": {
+            "prompt_cache": prompt_cache_stats.snapshot(),
+            "gemini_cached_contents": gemini_context_cache.stats()
+        }
+    })
+
+
+@chatbot_bp.route("/api/image-stats", methods=["GET"])
+@admin_required
+def image_statistics():
+    """Penghematan ukuran upload gambar dan hit rate vision cache (khusus admin)"""
+    return jsonify({
+        "prep": image_prep_stats.snapshot(),
+        "vision_cache": vision_cache.stats()
+    })
+
+
+@chatbot_bp.route("/api/metrics-stats", methods=["GET"])
+@admin_required
+def metrics_statistics():
+    """p50/p95/p99 per route, provider dan tahap proses dari histogram /metrics (khusus admin)"""
+    return jsonify(metrics.summary())
+
+
+@chatbot_bp.route("/api/usage-stats", methods=["GET"])
+@admin_required
+def usage_statistics():
+    """Token, biaya dan error per model/mode per jam & hari (hanya dari tabel rollup, khusus admin)"""
+    hours = max(1, min(request.args.get('hours', 48, type=int), 24 * 14))
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    return jsonify(usage_ledger.summary(hours, days))
+
+
+@chatbot_bp.route("/api/job-stats", methods=["GET"])
+@admin_required
+def job_statistics():
+    """Jumlah job per status dan umur antrean tertua (khusus admin)"""
+    return jsonify(job_queue.stats())
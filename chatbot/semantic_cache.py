@@ -0,0 +1,255 @@
+import os
+import re
+import time
+import zlib
+import itertools
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Set
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv('CALAVERA_SEMANTIC_CACHE_ENABLED', '1') == '1'
+SEMANTIC_THRESHOLD = float(os.getenv('CALAVERA_SEMANTIC_THRESHOLD', '0.82'))
+SEMANTIC_CAPACITY = int(os.getenv('CALAVERA_SEMANTIC_CAPACITY', '512'))
+SEMANTIC_DIM = int(os.getenv('CALAVERA_SEMANTIC_DIM', '4096'))
+SEMANTIC_TTL = int(os.getenv('CALAVERA_SEMANTIC_TTL', str(6 * 60 * 60)))
+
+# Kata pengisi percakapan yang tidak mengubah maksud pertanyaan
+STOPWORDS = {
+    'ya', 'yah', 'sih', 'dong', 'deh', 'nih', 'kak', 'min', 'tolong', 'aja', 'saja',
+    'bang', 'gan', 'bro', 'kok', 'nah', 'hmm', 'eh', 'si', 'itu', 'ini', 'apa', 'ada',
+    'yang', 'dan', 'di', 'ke', 'dari', 'adalah', 'dengan', 'untuk', 'kah', 'lah', 'pun'
+}
+# Partikel/klitik yang sering menempel di akhir kata ("ujiannya", "benarkah")
+SUFFIXES = ('nya', 'lah', 'kah', 'pun')
+NGRAM_SIZES = (3, 4)
+
+_NON_WORD = re.compile(r'[^\w\s]')
+
+
+def tokenize(text: str) -> List[str]:
+    """Pecah teks jadi kata, huruf kecil, partikel di akhir kata dibuang"""
+    tokens = []
+    for word in _NON_WORD.sub(' ', (text or '').casefold()).split():
+        for suffix in SUFFIXES:
+            if len(word) > len(suffix) + 2 and word.endswith(suffix):
+                word = word[:-len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+
+def content_words(text: str) -> Set[str]:
+    """Kata bermakna (tanpa stopword) untuk pengecekan presisi"""
+    return {word for word in tokenize(text) if word not in STOPWORDS}
+
+
+def _words_close(a: str, b: str) -> bool:
+    """Kata dianggap sama jika identik atau salah satunya prefix (min. 4 huruf)"""
+    if a == b:
+        return True
+    return min(len(a), len(b)) >= 4 and (a.startswith(b) or b.startswith(a))
+
+
+def same_content_words(a: Set[str], b: Set[str]) -> bool:
+    """
+    Pengaman presisi: setiap kata bermakna di satu pertanyaan harus punya
+    pasangan di pertanyaan lain. Mencegah 'jadwal senin' menjawab
+    'jadwal selasa' atau 'newton 1' menjawab 'newton 2' walau cosine tinggi.
+    """
+    return (all(any(_words_close(x, y) for y in b) for x in a) and
+            all(any(_words_close(x, y) for y in a) for x in b))
+
+
+class HashedNgramVectorizer:
+    """
+    Embedding lokal tanpa layanan eksternal: n-gram karakter dan kata
+    di-hash (crc32, stabil antar proses) ke vektor berdimensi tetap,
+    dengan term frequency sublinear.
+    """
+
+    def __init__(self, dim: int = SEMANTIC_DIM, ngram_sizes=NGRAM_SIZES):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+
+    def features(self, text: str) -> List[str]:
+        features = []
+        for word in tokenize(text):
+            if word in STOPWORDS:
+                continue
+            padded = f' {word} '
+            for n in self.ngram_sizes:
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+            features.append('w:' + word)
+        return features
+
+    def transform(self, text: str) -> np.ndarray:
+        """Vektor term frequency (1 + log tf) untuk satu teks"""
+        indexes = [zlib.crc32(f.encode('utf-8')) % self.dim for f in self.features(text)]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if indexes:
+            np.add.at(vector, np.array(indexes, dtype=np.int64), 1.0)
+            nonzero = vector > 0
+            vector[nonzero] = 1.0 + np.log(vector[nonzero])
+        return vector
+
+
+class SemanticCache:
+    """
+    Cache jawaban untuk pertanyaan yang mirip (parafrase).
+
+    Vektor TF disimpan di satu matriks NumPy (capacity x dim). Saat lookup,
+    bobot IDF dihitung dari document frequency entri yang tersimpan, lalu
+    cosine similarity ke semua baris dalam namespace yang sama dihitung
+    sekaligus (satu perkalian matriks). Namespace = model + kepribadian +
+    digest history, sama seperti response cache.
+
+    Setiap namespace mendapat id unik (bukan hash, jadi tidak bisa bertabrakan)
+    yang dihitung per baris; mapping-nya dihapus saat baris terakhirnya dibuang.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_THRESHOLD, capacity: int = SEMANTIC_CAPACITY,
+                 dim: int = SEMANTIC_DIM, ttl: int = SEMANTIC_TTL):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.vectorizer = HashedNgramVectorizer(dim)
+        self._tf = np.zeros((capacity, dim), dtype=np.float32)
+        self._df = np.zeros(dim, dtype=np.float32)
+        self._namespaces = np.full(capacity, -1, dtype=np.int64)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_access = np.zeros(capacity, dtype=np.float64)
+        self._answers: List[Optional[str]] = [None] * capacity
+        self._words: List[Set[str]] = [set()] * capacity
+        self._prompts: List[Optional[str]] = [None] * capacity
+        self._row_namespaces: List[Optional[str]] = [None] * capacity
+        self._namespace_ids: Dict[str, int] = {}
+        self._namespace_rows: Dict[str, int] = {}
+        self._next_namespace_id = itertools.count()
+        self._count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def _acquire_namespace(self, namespace: str) -> int:
+        """Id namespace untuk baris baru (dibuat jika belum ada)"""
+        if namespace not in self._namespace_ids:
+            self._namespace_ids[namespace] = next(self._next_namespace_id)
+        self._namespace_rows[namespace] = self._namespace_rows.get(namespace, 0) + 1
+        return self._namespace_ids[namespace]
+
+    def _release_namespace(self, namespace: str):
+        remaining = self._namespace_rows.get(namespace, 0) - 1
+        if remaining > 0:
+            self._namespace_rows[namespace] = remaining
+        else:
+            self._namespace_rows.pop(namespace, None)
+            self._namespace_ids.pop(namespace, None)
+
+    def _idf(self) -> np.ndarray:
+        return np.log((1.0 + self._count) / (1.0 + self._df)) + 1.0
+
+    def _free_slot(self, row: int):
+        """Kosongkan satu baris dan kurangi document frequency-nya"""
+        if self._answers[row] is not None:
+            self._df -= (self._tf[row] > 0)
+            self._count -= 1
+        if self._row_namespaces[row] is not None:
+            self._release_namespace(self._row_namespaces[row])
+        self._tf[row] = 0
+        self._namespaces[row] = -1
+        self._answers[row] = None
+        self._words[row] = set()
+        self._prompts[row] = None
+        self._row_namespaces[row] = None
+
+    def get(self, namespace: str, prompt: str) -> Optional[str]:
+        """Cari jawaban untuk pertanyaan yang mirip di namespace yang sama"""
+        query_tf = self.vectorizer.transform(prompt)
+        if not query_tf.any():
+            return None
+
+        now = time.time()
+        with self._lock:
+            namespace_id = self._namespace_ids.get(namespace)
+            rows = np.flatnonzero((self._namespaces == namespace_id) & (self._expires > now)) \
+                if namespace_id is not None else np.empty(0, dtype=np.int64)
+            if rows.size == 0:
+                self.misses += 1
+                return None
+
+            idf = self._idf()
+            candidates = self._tf[rows] * idf
+            norms = np.linalg.norm(candidates, axis=1)
+            query = query_tf * idf
+            query /= np.linalg.norm(query)
+            scores = (candidates @ query) / np.where(norms > 0, norms, 1.0)
+
+            best = int(np.argmax(scores))
+            row = int(rows[best])
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            if not same_content_words(content_words(prompt), self._words[row]):
+                self.rejected += 1
+                self.misses += 1
+                return None
+
+            self._last_access[row] = now
+            self.hits += 1
+            return self._answers[row]
+
+    def set(self, namespace: str, prompt: str, answer: str):
+        """
+        Simpan jawaban; prompt yang sudah ada di namespace ini diperbarui di tempat.
+        Jika penuh, ganti entri kedaluwarsa / paling lama tidak dipakai.
+        """
+        tf = self.vectorizer.transform(prompt)
+        if not tf.any():
+            return
+
+        now = time.time()
+        with self._lock:
+            namespace_id = self._namespace_ids.get(namespace)
+            if namespace_id is not None:
+                for row in np.flatnonzero(self._namespaces == namespace_id):
+                    if self._prompts[row] == prompt:
+                        self._expires[row] = now + self.ttl
+                        self._last_access[row] = now
+                        self._answers[row] = answer
+                        return
+
+            expired = np.flatnonzero(self._expires <= now)
+            row = int(expired[0]) if expired.size else int(np.argmin(self._last_access))
+            self._free_slot(row)
+
+            self._tf[row] = tf
+            self._df += (tf > 0)
+            self._count += 1
+            self._namespaces[row] = self._acquire_namespace(namespace)
+            self._row_namespaces[row] = namespace
+            self._prompts[row] = prompt
+            self._expires[row] = now + self.ttl
+            self._last_access[row] = now
+            self._answers[row] = answer
+            self._words[row] = content_words(prompt)
+
+    def stats(self) -> Dict:
+        """Statistik hit/miss semantic cache di proses ini"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "pid": os.getpid(),
+                "entries": self._count,
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected_by_word_check": self.rejected,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,280 @@
+import os
+import time
+import sqlite3
+import threading
+import contextvars
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .response_cache import CACHE_DB
+
+
+SINGLE_FLIGHT_ENABLED = os.getenv('CALAVERA_SINGLE_FLIGHT', '1') == '1'
+# Koordinasi lintas worker lewat SQLite; butuh CALAVERA_CACHE_DB agar jawaban
+# leader bisa dibaca worker lain dari response cache persisten
+SINGLE_FLIGHT_SHARED = os.getenv('CALAVERA_SINGLE_FLIGHT_SHARED', '0') == '1' and bool(CACHE_DB)
+# Follower berhenti menunggu jika tidak ada potongan baru selama ini
+SINGLE_FLIGHT_WAIT = float(os.getenv('CALAVERA_SINGLE_FLIGHT_WAIT', '90'))
+SHARED_POLL_INTERVAL = 0.25
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Follower tidak menerima potongan baru dari leader selama wait_timeout"""
+
+
+class _Flight:
+    """Satu panggilan upstream yang sedang berjalan, hasilnya dibagi ke semua subscriber"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+    def push(self, chunk: str):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: BaseException = None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def follow(self, timeout: float) -> Iterator[str]:
+        """Yield semua potongan dari awal, lalu potongan baru sampai flight selesai"""
+        index = 0
+        try:
+            while True:
+                with self.cond:
+                    if index >= len(self.chunks) and not self.done:
+                        self.cond.wait_for(lambda: index < len(self.chunks) or self.done, timeout)
+                    new_chunks = self.chunks[index:]
+                    done, error = self.done, self.error
+                if not new_chunks and not done:
+                    # Jangan selesai diam-diam: jawaban kosong/terpotong akan dianggap sukses
+                    raise SingleFlightTimeout(f"Tidak ada potongan baru dari leader selama {timeout:g}s")
+                index += len(new_chunks)
+                yield from new_chunks
+                if done and index >= len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+
+class SingleFlight:
+    """
+    Gabungkan request identik yang datang bersamaan menjadi satu panggilan ke provider.
+
+    Dalam satu proses, request pertama untuk sebuah key menjadi leader dan
+    request berikutnya ikut menerima hasil yang sama (termasuk potongan
+    streaming). Dengan SINGLE_FLIGHT_SHARED, klaim leader juga dicatat di
+    SQLite sehingga worker lain menunggu jawaban muncul di response cache
+    persisten alih-alih memanggil provider lagi.
+    """
+
+    def __init__(self, db_path: str = CACHE_DB, shared: bool = SINGLE_FLIGHT_SHARED,
+                 wait_timeout: float = SINGLE_FLIGHT_WAIT):
+        self.db_path = db_path
+        self.shared = shared
+        self.wait_timeout = wait_timeout
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.leaders = 0
+        self.coalesced = 0
+        self.shared_coalesced = 0
+        self.timeouts = 0
+
+        if self.shared:
+            self._init_db()
+
+    def _get_db(self) -> sqlite3.Connection:
+        """Satu koneksi SQLite per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._get_db().execute('''CREATE TABLE IF NOT EXISTS single_flight
+                                  (key TEXT PRIMARY KEY,
+                                   pid INTEGER NOT NULL,
+                                   expires_at REAL NOT NULL)''')
+
+    def _join(self, key: str):
+        """Ambil flight yang sedang berjalan untuk key, atau buat baru sebagai leader"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        with flight.cond:
+            flight.subscribers += 1
+        return flight, leader
+
+    def _remove(self, key: str, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _claim_shared(self, key: str) -> bool:
+        """True jika worker ini menjadi leader lintas worker untuk key"""
+        if not self.shared:
+            return True
+        now = time.time()
+        try:
+            conn = self._get_db()
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM single_flight WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO single_flight (key, pid, expires_at) VALUES (?, ?, ?)',
+                                  (key, os.getpid(), now + self.wait_timeout))
+            conn.execute('COMMIT')
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            print(f"⚠️ [SINGLE FLIGHT] Klaim SQLite gagal: {e}")
+            return True
+
+    def _release_shared(self, key: str):
+        if not self.shared:
+            return
+        try:
+            self._get_db().execute('DELETE FROM single_flight WHERE key = ? AND pid = ?', (key, os.getpid()))
+        except sqlite3.Error as e:
+            print(f"⚠️ [SINGLE FLIGHT] Gagal melepas klaim: {e}")
+
+    def _wait_shared(self, key: str, poll: Callable[[], Optional[str]]) -> Optional[str]:
+        """
+        Tunggu jawaban leader di worker lain. None jika leader hilang
+        (klaim dihapus tanpa jawaban di cache) atau waktu habis.
+        """
+        with self._lock:
+            self.shared_coalesced += 1
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            value = poll()
+            if value is not None:
+                return value
+            try:
+                row = self._get_db().execute('SELECT 1 FROM single_flight WHERE key = ? AND expires_at > ?',
+                                             (key, time.time())).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                return poll()
+            time.sleep(SHARED_POLL_INTERVAL)
+        return None
+
+    def run(self, key: str, call: Callable[[], str], on_result: Callable[[str], None],
+            poll: Callable[[], Optional[str]]) -> str:
+        """
+        Versi non-streaming: leader memanggil call(), follower menerima hasil yang sama.
+        Follower yang menunggu lebih dari wait_timeout memanggil call() sendiri.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                return "".join(flight.follow(self.wait_timeout))
+            except SingleFlightTimeout as e:
+                with self._lock:
+                    self.timeouts += 1
+                print(f"⚠️ [SINGLE FLIGHT] Follower memanggil provider sendiri: {e}")
+                result = call()
+                on_result(result)
+                return result
+
+        claimed = self._claim_shared(key)
+        try:
+            result = None if claimed else self._wait_shared(key, poll)
+            if result is None:
+                result = call()
+                on_result(result)
+            flight.push(result)
+            flight.finish()
+            return result
+        except BaseException as e:
+            flight.finish(e)
+            raise
+        finally:
+            with flight.cond:
+                flight.subscribers -= 1
+            self._remove(key, flight)
+            if claimed:
+                self._release_shared(key)
+
+    def stream(self, key: str, start: Callable[[], Iterator[str]], on_result: Callable[[str], None],
+               poll: Callable[[], Optional[str]]) -> Iterator[str]:
+        """
+        Versi streaming: upstream dibaca satu thread pump, setiap subscriber
+        (termasuk leader) membaca dari buffer bersama. Jika semua subscriber
+        pergi, pump berhenti dan stream upstream ditutup. Upstream yang diam
+        lebih dari wait_timeout mengakhiri stream dengan SingleFlightTimeout.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            # Context leader ikut ke thread pump (span tracing, pencatat usage)
+            threading.Thread(target=contextvars.copy_context().run,
+                             args=(self._pump, key, flight, start, on_result, poll),
+                             name='single-flight-pump', daemon=True).start()
+        return flight.follow(self.wait_timeout)
+
+    def _pump(self, key: str, flight: _Flight, start: Callable[[], Iterator[str]],
+              on_result: Callable[[str], None], poll: Callable[[], Optional[str]]):
+        claimed = self._claim_shared(key)
+        error = None
+        try:
+            result = None if claimed else self._wait_shared(key, poll)
+            if result is not None:
+                flight.push(result)
+                return
+
+            chunks = start()
+            completed = True
+            for chunk in chunks:
+                flight.push(chunk)
+                with flight.cond:
+                    abandoned = flight.subscribers <= 0
+                if abandoned:
+                    completed = False
+                    if hasattr(chunks, 'close'):
+                        chunks.close()
+                    break
+            if completed:
+                on_result("".join(flight.chunks))
+        except Exception as e:
+            error = e
+        finally:
+            flight.finish(error)
+            self._remove(key, flight)
+            if claimed:
+                self._release_shared(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "enabled": SINGLE_FLIGHT_ENABLED,
+                "shared": self.shared,
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "shared_coalesced": self.shared_coalesced,
+                "follower_timeouts": self.timeouts
+            }
+
+
+single_flight = SingleFlight()
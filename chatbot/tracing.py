@@ -0,0 +1,365 @@
+import os
+import re
+import json
+import time
+import glob
+import uuid
+import logging
+import tempfile
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+
+from flask import g, request
+
+
+TRACING_ENABLED = os.getenv('CALAVERA_TRACING', '1') == '1'
+# Nama dasar file trace; setiap worker gunicorn menulis (dan merotasi) filenya
+# sendiri, calavera_traces.<pid>.jsonl, supaya rotasi tidak saling berebut
+TRACE_FILE = os.getenv('CALAVERA_TRACE_FILE', os.path.join(tempfile.gettempdir(), 'calavera_traces.jsonl'))
+TRACE_MAX_BYTES = int(os.getenv('CALAVERA_TRACE_MAX_BYTES', str(5 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv('CALAVERA_TRACE_BACKUPS', '3'))
+# File worker yang sudah tidak ditulis selama ini (worker lama) dihapus
+TRACE_RETENTION = int(os.getenv('CALAVERA_TRACE_RETENTION', str(24 * 3600)))
+# Request lebih cepat dari ini tidak ditulis (0 = semua request)
+TRACE_MIN_MS = float(os.getenv('CALAVERA_TRACE_MIN_MS', '0'))
+# Aset statis tidak perlu di-trace
+TRACE_SKIP_PREFIXES = ('/static/',)
+SERVICE_NAME = 'calavera'
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('calavera_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes', 'start_ns', 'end_ns', 'error', 'token')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None or self.parent_id == self.trace.remote_parent else 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Semua span dari satu request; ditulis sekaligus saat span root selesai"""
+
+    def __init__(self, trace_id: str = None, remote_parent: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.remote_parent = remote_parent
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+def otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    """
+    Tracing ringan tanpa dependency: span bersarang lewat contextvars, satu
+    baris OTLP/JSON (format file exporter OpenTelemetry) per request di file
+    berputar per worker (lihat TRACE_FILE); recent() menggabungkan semua file.
+    Pekerjaan di thread lain ikut trace yang sama jika context-nya dibawa
+    (copy_context di run_batch, with_caller_context di async_runtime).
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._logger = None
+        self._handler = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def worker_path(self, pid: int = None) -> str:
+        """File trace milik satu proses: calavera_traces.jsonl -> calavera_traces.<pid>.jsonl"""
+        base, ext = os.path.splitext(self.path)
+        return f"{base}.{pid or os.getpid()}{ext}"
+
+    def worker_files(self) -> List[str]:
+        """File trace semua worker (beserta hasil rotasi .1)"""
+        base, ext = os.path.splitext(self.path)
+        pattern = f"{glob.escape(base)}.*{ext}"
+        return sorted(glob.glob(pattern) + glob.glob(pattern + '.1'))
+
+    def _prune(self):
+        """Hapus file trace worker lama yang sudah tidak ditulis"""
+        cutoff = time.time() - TRACE_RETENTION
+        base, ext = os.path.splitext(self.path)
+        for path in glob.glob(f"{glob.escape(base)}.*{ext}*"):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def _get_logger(self) -> logging.Logger:
+        # Handler dibuat ulang setelah fork: setiap worker punya file sendiri
+        if self._logger is None or self._pid != os.getpid():
+            with self._lock:
+                if self._logger is None or self._pid != os.getpid():
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self._prune()
+                    logger = logging.getLogger('calavera.traces')
+                    logger.propagate = False
+                    logger.setLevel(logging.INFO)
+                    if self._handler is not None:
+                        logger.removeHandler(self._handler)
+                    handler = RotatingFileHandler(self.worker_path(), maxBytes=TRACE_MAX_BYTES,
+                                                  backupCount=TRACE_BACKUPS, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.addHandler(handler)
+                    self._handler = handler
+                    self._pid = os.getpid()
+                    self._logger = logger
+        return self._logger
+
+    def start_trace(self, name: str, traceparent: str = None, **attributes) -> Optional[Span]:
+        """Span root baru untuk satu request (melanjutkan header W3C traceparent jika ada)"""
+        if not TRACING_ENABLED:
+            return None
+        match = TRACEPARENT.match(traceparent or '')
+        trace = Trace(*match.groups()) if match else Trace()
+        span = Span(trace, name, trace.remote_parent, attributes)
+        trace.add(span)
+        span.token = _current_span.set(span)
+        return span
+
+    def detach(self, span: Optional[Span]):
+        """Lepas span dari context thread ini (span belum selesai)"""
+        if span is not None and span.token is not None:
+            try:
+                _current_span.reset(span.token)
+            except ValueError:
+                # Token dibuat di context lain
+                pass
+            span.token = None
+
+    def end_trace(self, span: Optional[Span], error: str = None):
+        if span is None:
+            return
+        self.detach(span)
+        span.end_ns = time.time_ns()
+        span.error = span.error or error
+        if (span.end_ns - span.start_ns) / 1e6 >= TRACE_MIN_MS:
+            self.export(span.trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """with tracer.span('file.parse', format='pdf') as span: ..."""
+        parent = _current_span.get()
+        if parent is None or not TRACING_ENABLED:
+            yield None
+            return
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        parent.trace.add(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{e.__class__.__name__}: {e}"[:300]
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+
+    def traced(self, name: str = None):
+        """Decorator: seluruh pemanggilan fungsi menjadi satu span"""
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stream(self, iterable, span: Span):
+        """Iterasi body response streaming dengan span request tetap aktif"""
+        iterator = iter(iterable)
+        try:
+            while True:
+                token = _current_span.set(span)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _current_span.reset(token)
+                yield chunk
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def annotate(self, **attributes):
+        """Tambah atribut ke span yang sedang aktif (jika ada)"""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def current_trace_id(self) -> Optional[str]:
+        span = _current_span.get()
+        return span.trace.trace_id if span else None
+
+    def export(self, trace: Trace):
+        record = {"resourceSpans": [{
+            "resource": {"attributes": [otlp_attribute("service.name", SERVICE_NAME),
+                                        otlp_attribute("process.pid", os.getpid())]},
+            "scopeSpans": [{"scope": {"name": "calavera.tracing"},
+                            "spans": [span.to_otlp() for span in trace.spans]}]
+        }]}
+        try:
+            self._get_logger().info(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        except Exception as e:
+            print(f"⚠️ [TRACE] Gagal menulis trace: {e}")
+
+    def recent(self, limit: int = 500) -> List[Dict]:
+        """Trace terbaru dari file semua worker, digabung urut waktu selesai"""
+        records = []
+        for path in self.worker_files():
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(0, os.SEEK_END)
+                    # Cukup baca ekor file: ~4KB per trace (baris pertama mungkin terpotong)
+                    offset = max(0, f.tell() - limit * 4096)
+                    f.seek(offset)
+                    tail = f.read().decode('utf-8', errors='ignore').splitlines()
+            except OSError:
+                # File dirotasi/dihapus worker lain saat dibaca
+                continue
+            for line in tail[1 if offset else 0:][-limit:]:
+                try:
+                    record = json.loads(line)
+                    spans = record["resourceSpans"][0]["scopeSpans"][0]["spans"]
+                    records.append((max(int(span["endTimeUnixNano"]) for span in spans), record))
+                except (ValueError, KeyError, IndexError):
+                    continue
+        records.sort(key=lambda item: item[0])
+        traces = []
+        for _, record in records[-limit:]:
+            try:
+                traces.append(parse_trace(record))
+            except (ValueError, KeyError, IndexError):
+                continue
+        return traces
+
+    def slowest(self, limit: int = 20, scan: int = 500) -> List[Dict]:
+        return sorted(self.recent(scan), key=lambda trace: trace["duration_ms"], reverse=True)[:limit]
+
+
+def parse_trace(record: Dict) -> Dict:
+    """Baris OTLP/JSON -> dict siap digambar sebagai waterfall"""
+    spans = record["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    start = min(int(span["startTimeUnixNano"]) for span in spans)
+    end = max(int(span["endTimeUnixNano"]) for span in spans)
+    total = max(end - start, 1)
+    by_id = {span["spanId"]: span for span in spans}
+
+    def depth(span) -> int:
+        level = 0
+        while span.get("parentSpanId") in by_id and level < 20:
+            span = by_id[span["parentSpanId"]]
+            level += 1
+        return level
+
+    root = next((span for span in spans if span.get("parentSpanId") not in by_id), spans[0])
+    rows = []
+    for span in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+        span_start = int(span["startTimeUnixNano"])
+        span_end = int(span["endTimeUnixNano"])
+        rows.append({
+            "name": span["name"],
+            "depth": depth(span),
+            "offset_ms": round((span_start - start) / 1e6, 1),
+            "duration_ms": round((span_end - span_start) / 1e6, 1),
+            "left": round((span_start - start) / total * 100, 2),
+            "width": max(round((span_end - span_start) / total * 100, 2), 0.3),
+            "attributes": {attr["key"]: next(iter(attr["value"].values())) for attr in span.get("attributes", [])},
+            "error": span.get("status", {}).get("message")
+        })
+    return {
+        "trace_id": root["traceId"],
+        "name": root["name"],
+        "start": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start / 1e9)),
+        "duration_ms": round(total / 1e6, 1),
+        "error": any(row["error"] for row in rows),
+        "spans": rows
+    }
+
+
+tracer = Tracer()
+
+
+def init_app(app):
+    """Span root + correlation id (X-Request-ID) untuk setiap request Flask"""
+    if not TRACING_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_trace():
+        if request.path.startswith(TRACE_SKIP_PREFIXES):
+            return
+        g.trace_span = tracer.start_trace(f"{request.method} {request.path}",
+                                          request.headers.get('traceparent'),
+                                          **{"http.method": request.method, "http.target": request.path})
+
+    @app.after_request
+    def add_trace_headers(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set(**{"http.status_code": response.status_code,
+                        "http.route": request.url_rule.rule if request.url_rule else ''})
+            response.headers['X-Request-ID'] = span.trace.trace_id
+            response.headers['traceparent'] = f"00-{span.trace.trace_id}-{span.span_id}-01"
+            if response.is_streamed:
+                # SSE: span root baru selesai saat body terakhir terkirim
+                g.trace_streamed = True
+                response.response = tracer.stream(response.response, span)
+                response.call_on_close(lambda: tracer.end_trace(span))
+        return response
+
+    @app.teardown_request
+    def end_request_trace(error=None):
+        span = g.pop('trace_span', None)
+        if g.pop('trace_streamed', False):
+            tracer.detach(span)
+        else:
+            tracer.end_trace(span, f"{error.__class__.__name__}: {error}" if error else None)
@@ -0,0 +1,131 @@
+import io
+import os
+import mmap
+import tempfile
+from typing import Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+# Upload di bawah batas ini tetap di memori; di atasnya tumpah ke file sementara
+UPLOAD_SPOOL_BYTES = int(os.getenv('CALAVERA_UPLOAD_SPOOL_BYTES', str(1024 * 1024)))
+IMAGE_MAX_BYTES = int(os.getenv('CALAVERA_IMAGE_MAX_BYTES', str(15 * 1024 * 1024)))
+DOCUMENT_MAX_BYTES = int(os.getenv('CALAVERA_DOCUMENT_MAX_BYTES', str(10 * 1024 * 1024)))
+# Simpan gambar chat ke static/img/chat_uploads (untuk image_url); 0 = analisis saja
+PERSIST_CHAT_UPLOADS = os.getenv('CALAVERA_PERSIST_CHAT_UPLOADS', '1') == '1'
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+DOCUMENT_EXTENSIONS = {'pdf', 'docx', 'doc', 'txt'}
+
+
+def upload_limit(filename: Optional[str]) -> Optional[int]:
+    """Batas ukuran per mode, ditentukan dari ekstensi file"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return IMAGE_MAX_BYTES
+    if extension in DOCUMENT_EXTENSIONS:
+        return DOCUMENT_MAX_BYTES
+    return None
+
+
+class LimitedSpooledFile(tempfile.SpooledTemporaryFile):
+    """
+    Buffer upload di memori yang baru tumpah ke disk di atas UPLOAD_SPOOL_BYTES.
+    Upload yang melewati batas mode-nya dihentikan saat body multipart
+    masih dibaca, bukan setelah seluruh MAX_CONTENT_LENGTH masuk.
+    """
+
+    def __init__(self, limit: Optional[int], label: str):
+        super().__init__(max_size=UPLOAD_SPOOL_BYTES, mode='w+b')
+        self.limit = limit
+        self.label = label
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        if self.limit is not None and self.written > self.limit:
+            raise RequestEntityTooLarge(
+                f"{self.label} terlalu besar! Maksimal {self.limit // (1024 * 1024)}MB."
+            )
+        return super().write(data)
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            # Masih ada memoryview yang hidup; buffer dibebaskan GC setelahnya
+            pass
+
+
+class UploadRequest(Request):
+    """Request Flask dengan stream upload LimitedSpooledFile untuk endpoint chatbot"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.blueprint != 'chatbot':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        limit = upload_limit(filename)
+        label = "🖼️ Gambar" if limit == IMAGE_MAX_BYTES else "📄 File"
+        return LimitedSpooledFile(limit, label)
+
+
+def upload_buffer(file_storage) -> memoryview:
+    """
+    memoryview isi upload tanpa menyalin: langsung ke buffer BytesIO jika
+    upload masih di memori, atau mmap file sementara jika sudah tumpah ke disk.
+    """
+    stream = file_storage.stream
+    raw = getattr(stream, '_file', stream)
+    if isinstance(raw, io.BytesIO):
+        return raw.getbuffer()
+    raw.flush()
+    size = os.fstat(raw.fileno()).st_size
+    if size == 0:
+        return memoryview(b'')
+    return memoryview(mmap.mmap(raw.fileno(), size, access=mmap.ACCESS_READ))
+
+
+class MemoryReader(io.RawIOBase):
+    """File-like read-only di atas memoryview (untuk PIL, PyPDF2, python-docx)"""
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        chunk = self._buffer[self._pos:self._pos + len(target)]
+        target[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        # Lepas view agar buffer upload bisa ditutup Werkzeug di akhir request
+        self._buffer.release()
+        super().close()
+
+
+def open_buffer(buffer) -> io.BufferedReader:
+    return io.BufferedReader(MemoryReader(buffer))
+
+
+def persist_upload(buffer, filepath: str):
+    """Tulis upload ke disk hanya saat file-nya memang dibutuhkan (image_url)"""
+    with open(filepath, 'wb') as f:
+        f.write(buffer)
@@ -0,0 +1,345 @@
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+
+USAGE_ENABLED = os.getenv('CALAVERA_USAGE_LEDGER', '1') == '1'
+USAGE_DB = os.getenv('CALAVERA_USAGE_DB', os.path.join(tempfile.gettempdir(), 'calavera_usage.db'))
+# Write-behind: request hanya memasukkan ke antrean memori, thread writer menulis per batch
+USAGE_QUEUE_SIZE = int(os.getenv('CALAVERA_USAGE_QUEUE_SIZE', '10000'))
+USAGE_FLUSH_INTERVAL = float(os.getenv('CALAVERA_USAGE_FLUSH_INTERVAL', '2'))
+USAGE_BATCH_SIZE = 500
+# Baris mentah usage_calls dihapus setelah ini; rollup jam/hari disimpan terus
+USAGE_RETENTION_DAYS = int(os.getenv('CALAVERA_USAGE_RETENTION_DAYS', '30'))
+# Rollup harian mengikuti WIB
+USAGE_TZ = timezone(timedelta(hours=float(os.getenv('CALAVERA_USAGE_TZ_OFFSET', '7'))))
+
+# Harga USD per 1 juta token (input, output); model :free di OpenRouter = 0
+DEFAULT_PRICES = "gemini=0.30/2.50,groq=0.59/0.79,deepseek=0/0,mistral=0/0"
+
+
+def parse_prices(value: str) -> Dict[str, Tuple[float, float]]:
+    """'gemini=0.30/2.50,groq=0.59/0.79' -> {'gemini': (0.30, 2.50), ...}"""
+    prices = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        model, price = item.split('=', 1)
+        try:
+            prompt_price, _, completion_price = price.partition('/')
+            prices[model.strip()] = (float(prompt_price), float(completion_price or prompt_price))
+        except ValueError:
+            print(f"⚠️ [USAGE] Harga tidak valid: {item}")
+    return prices
+
+
+USAGE_PRICES = parse_prices(os.getenv('CALAVERA_USAGE_PRICES', DEFAULT_PRICES))
+
+ROLLUP_COLUMNS = ('calls', 'errors', 'cache_hits', 'prompt_tokens', 'completion_tokens', 'latency_ms', 'cost')
+
+
+class UsageCall:
+    """Satu panggilan yang sedang dicatat; token diisi engine lewat record_*_usage"""
+    __slots__ = ('model', 'mode', 'operation', 'start', 'prompt_tokens', 'completion_tokens',
+                 'provider_called', 'error')
+
+    def __init__(self, model: str, mode: str, operation: str):
+        self.model = model
+        self.mode = mode
+        self.operation = operation
+        self.start = time.perf_counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.provider_called = False
+        self.error = None
+
+    def result(self, response):
+        """Tandai respons error engine (engine mengembalikan teks error, bukan exception)"""
+        from .ai_utils import is_ai_error_response
+        if isinstance(response, str) and is_ai_error_response(response):
+            self.error = self.error or 'ProviderError'
+        return response
+
+
+_current_call: ContextVar[Optional[UsageCall]] = ContextVar('calavera_usage_call', default=None)
+
+
+def record_openai_usage(result: Dict):
+    """Blok usage format OpenAI (Groq, OpenRouter) ke panggilan yang sedang dicatat"""
+    call = _current_call.get()
+    usage = (result or {}).get('usage') or {}
+    if call is not None and usage:
+        call.prompt_tokens += usage.get('prompt_tokens') or 0
+        call.completion_tokens += usage.get('completion_tokens') or 0
+
+
+def record_gemini_usage(result: Dict):
+    """usageMetadata Gemini ke panggilan yang sedang dicatat"""
+    call = _current_call.get()
+    usage = (result or {}).get('usageMetadata') or {}
+    if call is not None and usage:
+        call.prompt_tokens += usage.get('promptTokenCount') or 0
+        call.completion_tokens += (usage.get('candidatesTokenCount') or 0) + (usage.get('thoughtsTokenCount') or 0)
+
+
+def mark_provider_call():
+    """Dipanggil tepat sebelum engine dipanggil (bukan cache / single-flight follower)"""
+    call = _current_call.get()
+    if call is not None:
+        call.provider_called = True
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = USAGE_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def hour_bucket(ts: float) -> int:
+    return int(ts // 3600 * 3600)
+
+
+def day_bucket(ts: float) -> int:
+    day = datetime.fromtimestamp(ts, USAGE_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(day.timestamp())
+
+
+class UsageLedger:
+    """
+    Ledger token & biaya per panggilan AI di SQLite (WAL).
+
+    record() hanya memasukkan baris ke antrean memori (tidak pernah memblokir
+    request; jika antrean penuh baris dibuang dan dihitung). Thread writer
+    menulis per batch dalam satu transaksi: baris mentah ke usage_calls dan
+    upsert inkremental ke usage_hourly / usage_daily, jadi dashboard cukup
+    membaca rollup yang ukurannya tidak tumbuh dengan jumlah panggilan.
+    """
+
+    def __init__(self, db_path: str = USAGE_DB, queue_size: int = USAGE_QUEUE_SIZE):
+        self.db_path = db_path
+        self.queue_size = queue_size
+        self._local = threading.local()
+        self._ready = False
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._pid = None
+        self._dropped = 0
+        self._written = 0
+        self._last_prune = 0.0
+
+    def _get_db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if not self._ready:
+                db_dir = os.path.dirname(self.db_path)
+                if db_dir:
+                    os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._ready:
+                conn.execute('''CREATE TABLE IF NOT EXISTS usage_calls
+                                (id INTEGER PRIMARY KEY,
+                                 ts REAL NOT NULL,
+                                 model TEXT NOT NULL,
+                                 mode TEXT NOT NULL,
+                                 operation TEXT NOT NULL,
+                                 prompt_tokens INTEGER NOT NULL,
+                                 completion_tokens INTEGER NOT NULL,
+                                 latency_ms REAL NOT NULL,
+                                 cache_hit INTEGER NOT NULL,
+                                 error TEXT,
+                                 cost REAL NOT NULL)''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_usage_calls_ts ON usage_calls (ts)')
+                for table in ('usage_hourly', 'usage_daily'):
+                    conn.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                                     (bucket INTEGER NOT NULL,
+                                      model TEXT NOT NULL,
+                                      mode TEXT NOT NULL,
+                                      calls INTEGER NOT NULL,
+                                      errors INTEGER NOT NULL,
+                                      cache_hits INTEGER NOT NULL,
+                                      prompt_tokens INTEGER NOT NULL,
+                                      completion_tokens INTEGER NOT NULL,
+                                      latency_ms REAL NOT NULL,
+                                      cost REAL NOT NULL,
+                                      PRIMARY KEY (bucket, model, mode))''')
+                conn.commit()
+                self._ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get_queue(self) -> queue.Queue:
+        """Antrean + thread writer per proses (dibuat ulang setelah fork gunicorn)"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    self._dropped = 0
+                    threading.Thread(target=self._writer, args=(self._queue,),
+                                     name='calavera-usage', daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    @contextmanager
+    def track(self, model: str, mode: str, operation: str):
+        """
+        with usage_ledger.track('gemini', 'text', 'generate_text') as call:
+            response = call.result(engine.generate_text(...))
+
+        Token dari engine di dalam blok (termasuk thread pool / event loop
+        async yang membawa context pemanggil) masuk ke call ini.
+        """
+        if not USAGE_ENABLED:
+            yield UsageCall(model, mode, operation)
+            return
+        call = UsageCall(model, mode, operation)
+        token = _current_call.set(call)
+        try:
+            yield call
+        except GeneratorExit:
+            # Client menutup stream sebelum selesai
+            call.error = 'Cancelled'
+            raise
+        except BaseException as e:
+            call.error = e.__class__.__name__
+            raise
+        finally:
+            try:
+                _current_call.reset(token)
+            except ValueError:
+                # Stream ditutup dari context lain
+                pass
+            self.record(call)
+
+    def record(self, call: UsageCall):
+        row = (time.time(), call.model, call.mode, call.operation, call.prompt_tokens, call.completion_tokens,
+               round((time.perf_counter() - call.start) * 1000, 1), 0 if call.provider_called or call.error else 1, call.error,
+               call_cost(call.model, call.prompt_tokens, call.completion_tokens))
+        try:
+            self._get_queue().put_nowait(row)
+        except queue.Full:
+            self._dropped += 1
+
+    def _writer(self, rows: queue.Queue):
+        while True:
+            batch = [rows.get()]
+            deadline = time.monotonic() + USAGE_FLUSH_INTERVAL
+            while len(batch) < USAGE_BATCH_SIZE:
+                try:
+                    batch.append(rows.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def flush(self):
+        """Tulis semua baris yang masih di antrean (dipanggil saat proses berhenti)"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def write(self, batch: List[Tuple]):
+        rollups: Dict[Tuple[str, int, str, str], List[float]] = {}
+        for ts, model, mode, _, prompt_tokens, completion_tokens, latency_ms, cache_hit, error, cost in batch:
+            values = (1, 1 if error else 0, cache_hit, prompt_tokens, completion_tokens, latency_ms, cost)
+            for table, bucket in (('usage_hourly', hour_bucket(ts)), ('usage_daily', day_bucket(ts))):
+                totals = rollups.setdefault((table, bucket, model, mode), [0] * len(ROLLUP_COLUMNS))
+                for i, value in enumerate(values):
+                    totals[i] += value
+
+        updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in ROLLUP_COLUMNS)
+        try:
+            conn = self._get_db()
+            with conn:
+                conn.executemany('''INSERT INTO usage_calls (ts, model, mode, operation, prompt_tokens,
+                                    completion_tokens, latency_ms, cache_hit, error, cost)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+                for table in ('usage_hourly', 'usage_daily'):
+                    conn.executemany(f'''INSERT INTO {table} (bucket, model, mode, {', '.join(ROLLUP_COLUMNS)})
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                         ON CONFLICT (bucket, model, mode) DO UPDATE SET {updates}''',
+                                     [(bucket, model, mode, *totals)
+                                      for (name, bucket, model, mode), totals in rollups.items() if name == table])
+            self._written += len(batch)
+        except sqlite3.Error as e:
+            print(f"⚠️ [USAGE] Gagal menulis {len(batch)} baris usage: {e}")
+            return
+        if time.time() - self._last_prune > 3600:
+            self.prune()
+
+    def prune(self, now: float = None):
+        """Hapus baris mentah lama (rollup tidak ikut dihapus)"""
+        now = now or time.time()
+        self._last_prune = now
+        try:
+            conn = self._get_db()
+            with conn:
+                conn.execute('DELETE FROM usage_calls WHERE ts < ?', (now - USAGE_RETENTION_DAYS * 86400,))
+        except sqlite3.Error as e:
+            print(f"⚠️ [USAGE] Gagal membersihkan usage lama: {e}")
+
+    def rollup(self, table: str, since: float) -> List[Dict]:
+        """Baca tabel rollup saja (tidak menyentuh usage_calls)"""
+        fmt = '%Y-%m-%d %H:00' if table == 'usage_hourly' else '%Y-%m-%d'
+        rows = self._get_db().execute(f'''SELECT bucket, model, mode, {', '.join(ROLLUP_COLUMNS)}
+                                          FROM {table} WHERE bucket >= ? ORDER BY bucket, model, mode''',
+                                      (since,)).fetchall()
+        result = []
+        for bucket, model, mode, calls, errors, cache_hits, prompt_tokens, completion_tokens, latency_ms, cost in rows:
+            result.append({
+                "bucket": datetime.fromtimestamp(bucket, USAGE_TZ).strftime(fmt),
+                "model": model,
+                "mode": mode,
+                "calls": calls,
+                "errors": errors,
+                "cache_hits": cache_hits,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "avg_latency_ms": round(latency_ms / calls, 1) if calls else 0.0,
+                "cost_usd": round(cost, 6)
+            })
+        return result
+
+    def summary(self, hours: int = 48, days: int = 30) -> Dict:
+        now = time.time()
+        daily = self.rollup('usage_daily', day_bucket(now - (days - 1) * 86400))
+        models: Dict[str, Dict] = {}
+        for row in daily:
+            totals = models.setdefault(row["model"], {"calls": 0, "errors": 0, "cache_hits": 0, "prompt_tokens": 0,
+                                                      "completion_tokens": 0, "cost_usd": 0.0})
+            for key in totals:
+                totals[key] += row[key]
+        for totals in models.values():
+            totals["cost_usd"] = round(totals["cost_usd"], 6)
+        return {
+            "enabled": USAGE_ENABLED,
+            "db": self.db_path,
+            "pid": os.getpid(),
+            "pending": self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            "dropped": self._dropped,
+            "written": self._written,
+            "prices_per_million": {model: {"input": prompt_price, "output": completion_price}
+                                   for model, (prompt_price, completion_price) in USAGE_PRICES.items()},
+            "models": models,
+            "hourly": self.rollup('usage_hourly', hour_bucket(now - (hours - 1) * 3600)),
+            "daily": daily
+        }
+
+
+usage_ledger = UsageLedger()
+atexit.register(usage_ledger.flush)
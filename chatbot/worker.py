@@ -0,0 +1,104 @@
+"""
+Worker job queue Calavera AI: mengerjakan job image/file yang dimasukkan
+/calavera-ai/api/chat (async=1) ke antrean SQLite.
+
+    CALAVERA_JOB_QUEUE=1 python -m chatbot.worker --threads 4
+
+Jalankan di mesin yang sama dengan web (berbagi file CALAVERA_JOB_DB,
+history store, dan static/img/chat_uploads). Jumlah proses/thread worker
+bisa diatur terpisah dari jumlah worker gunicorn.
+"""
+import os
+import time
+import signal
+import socket
+import argparse
+import threading
+
+from .job_queue import job_queue, JOB_QUEUE_ENABLED
+from .tracing import tracer
+from . import routes
+
+
+POLL_INTERVAL = float(os.getenv('CALAVERA_JOB_POLL', '0.5'))
+
+stop_event = threading.Event()
+
+
+def keep_alive(job_id: str, worker_id: str, done: threading.Event):
+    """Perpanjang lease selama job masih dikerjakan"""
+    while not done.wait(job_queue.lease / 3):
+        job_queue.heartbeat(job_id, worker_id)
+
+
+def process_job(job, worker_id: str):
+    done = threading.Event()
+    threading.Thread(target=keep_alive, args=(job["id"], worker_id, done), daemon=True).start()
+    start = time.perf_counter()
+    span = tracer.start_trace(f"JOB {job['kind']}", job_id=job["id"], attempt=job["attempt"])
+    error = None
+    try:
+        result = routes.run_job(job)
+    except ValueError as e:
+        # Input tidak valid (gambar rusak, file tidak terbaca): tidak perlu diulang
+        error = f"ValueError: {e}"
+        job_queue.fail(job["id"], worker_id, str(e))
+        print(f"⚠️ [WORKER] {job['kind']} {job['id'][:8]} ditolak: {e}")
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+        job_queue.fail(job["id"], worker_id, routes.sanitize_error(str(e)), retry=True)
+        print(f"⚠️ [WORKER] {job['kind']} {job['id'][:8]} gagal (percobaan {job['attempt']}): {e}")
+    else:
+        if job_queue.complete(job["id"], worker_id, result):
+            print(f"📊 [WORKER] {job['kind']} {job['id'][:8]} selesai ({time.perf_counter() - start:.1f}s)")
+        else:
+            print(f"⚠️ [WORKER] {job['kind']} {job['id'][:8]} lease habis, hasil dibuang (job diambil worker lain)")
+    finally:
+        done.set()
+        tracer.end_trace(span, error)
+
+
+def work(worker_id: str):
+    while not stop_event.is_set():
+        try:
+            job = job_queue.claim(worker_id)
+        except Exception as e:
+            print(f"⚠️ [WORKER] Gagal mengambil job: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(POLL_INTERVAL)
+            continue
+        process_job(job, worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker job queue Calavera AI")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('CALAVERA_JOB_THREADS', '2')),
+                        help="Jumlah job yang dikerjakan bersamaan (I/O ke provider, bukan CPU)")
+    args = parser.parse_args()
+
+    if not JOB_QUEUE_ENABLED:
+        print("⚠️ [WORKER] CALAVERA_JOB_QUEUE belum diaktifkan; web tidak akan mengirim job ke antrean")
+
+    def shutdown(signum, frame):
+        # Job yang sedang jalan diselesaikan dulu; job baru tidak diambil
+        print("🛑 [WORKER] Berhenti setelah job yang sedang berjalan selesai...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [threading.Thread(target=work, args=(f"{prefix}:{i}",), name=f"job-worker-{i}")
+               for i in range(max(1, args.threads))]
+    for thread in threads:
+        thread.start()
+    print(f"🚀 [WORKER] {len(threads)} thread siap, antrean: {job_queue.db_path}")
+
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+
+# Konfigurasi gunicorn untuk Calavera.
+#
+# Panggilan LLM bisa menunggu 30-60 detik. Dengan worker sync, satu request
+# chat memegang satu worker penuh sehingga /jadwal dan /galeri ikut macet.
+# Worker gthread memberi banyak thread per proses.
+#
+# Batas kapasitas: view Flask tetap sync, jadi setiap request chat yang sedang
+# menunggu provider memegang satu thread (menunggu Future dari event loop di
+# chatbot/async_runtime.py). Satu worker melayani paling banyak GUNICORN_THREADS
+# request bersamaan, satu deployment GUNICORN_WORKERS x GUNICORN_THREADS; request
+# berikutnya antre di socket. Event loop hanya memultipleks koneksi ke provider
+# (pool, pembatalan hedging), bukan menambah jumlah request yang dilayani.
+# Ukur dengan: python benchmarks/bench_load.py --workers 1 --threads 8 --levels 4,8,16,32
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:' + os.getenv('PORT', '5000'))
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '64'))
+
+# Vision dan file mode bisa mendekati 60 detik
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_fork(server, worker):
+    # Koneksi ke provider dibuka per worker (socket tidak boleh dibagi lewat fork)
+    if os.getenv('CALAVERA_HTTP_WARMUP', '1') == '1':
+        from chatbot.routes import warm_up_engines
+        warm_up_engines()
@@ -145,6 +145,7 @@ class SimpleChatbot {
         this.isStopRequested = false;
         this.currentTypingMessageId = null;
         this.isAnimatingTyping = false;
+        this.currentStreamReader = null;
         
         this.lightboxImages = [];
         this.lightboxInstance = null;
@@ -156,6 +157,13 @@ class SimpleChatbot {
         this.currentModelLabel = savedModelLabel || "Gemini 2.5 Flash";
         this.updateModelCapabilities();
         
+        const savedCompareModels = JSON.parse(localStorage.getItem('calavera_compare_models') || 'null');
+        
+        this.compareMode = localStorage.getItem('calavera_compare_mode') === 'true';
+        this.compareModels = Array.isArray(savedCompareModels) && savedCompareModels.length >= 2
+            ? savedCompareModels
+            : ['gemini', 'groq', 'mistral', 'deepseek'];
+        
         const savedPersonality = localStorage.getItem('calavera_personality');
         const savedPersonalityLabel = localStorage.getItem('calavera_personality_label');
         
@@ -261,6 +269,7 @@ class SimpleChatbot {
         this.updateSendButtonVisibility();
         this.loadPersonalitySettings();
         this.loadModelSettings();
+        this.updateCompareModeUI();
         this.initializeLightbox();
         this.setupScrollToBottom();
         
@@ -536,6 +545,30 @@ class SimpleChatbot {
             });
         }
         
+        const compareModeCheckbox = document.getElementById('compareModeCheckbox');
+        
+        if (compareModeCheckbox) {
+            compareModeCheckbox.checked = this.compareMode;
+            
+            compareModeCheckbox.addEventListener('change', (e) => {
+                if (this.isTyping || this.isAnimatingTyping) {
+                    e.target.checked = this.compareMode;
+                    this.showToast('Tunggu respons selesai sebelum ganti mode!', 'warning');
+                    return;
+                }
+                
+                this.compareMode = e.target.checked;
+                localStorage.setItem('calavera_compare_mode', this.compareMode);
+                this.updateCompareModeUI();
+                
+                if (this.compareMode) {
+                    this.showToast('Mode bandingkan aktif! Pilih model yang dibandingkan di menu Model AI', 'success');
+                } else {
+                    this.showToast(`Mode bandingkan nonaktif, kembali ke ${this.currentModelLabel}`, 'info');
+                }
+            });
+        }
+        
         const clearChatOption = document.getElementById('clearChatOption');
         if (clearChatOption && settingsDropdown) {
             clearChatOption.addEventListener('click', (e) => {
@@ -605,6 +638,11 @@ class SimpleChatbot {
                     return;
                 }
                 
+                if (this.compareMode) {
+                    this.toggleCompareModel(option.getAttribute('data-model'));
+                    return;
+                }
+                
                 const model = option.getAttribute('data-model');
                 const label = option.querySelector('.option-title').textContent;
                 const currentInput = this.elements.chatInput.value.trim();
@@ -785,8 +823,9 @@ class SimpleChatbot {
         this.showToast('File harus berupa gambar!', 'error');
         return;
       }
-      if (file.size > 5 * 1024 * 1024) {
-        this.showToast('Ukuran gambar maksimal 5MB!', 'error');
+      // Sama dengan CALAVERA_IMAGE_MAX_BYTES di server (foto HP dikecilkan di server)
+      if (file.size > 15 * 1024 * 1024) {
+        this.showToast('Ukuran gambar maksimal 15MB!', 'error');
         return;
       }
       
@@ -1012,6 +1051,10 @@ class SimpleChatbot {
         if (this.isTyping || this.isAnimatingTyping) {
             this.isStopRequested = true;
             
+            if (this.currentStreamReader) {
+                this.currentStreamReader.cancel().catch(() => {});
+            }
+            
             if (this.currentTypingMessageId) {
                 const currentMessage = document.querySelector(`[data-message-id="${this.currentTypingMessageId}"]`);
                 if (currentMessage) {
@@ -1117,6 +1160,11 @@ class SimpleChatbot {
             return;
         }
         
+        if (this.compareMode && !this.isSearchMode) {
+            await this.sendCompareMessage(message);
+            return;
+        }
+        
         await this.sendTextMessage(message);
     }
 
@@ -1142,6 +1190,10 @@ class SimpleChatbot {
             
             formData.append('mode', mode);
             
+            if (mode === 'text') {
+                formData.append('stream', '1');
+            }
+            
             const response = await fetch('/calavera-ai/api/chat', {
                 method: 'POST',
                 body: formData
@@ -1154,6 +1206,11 @@ class SimpleChatbot {
                 return;
             }
             
+            if (response.ok && this.isEventStream(response)) {
+                await this.renderStreamingResponse(response);
+                return;
+            }
+            
             const data = await response.json();
             this.removeTypingIndicator();
             
@@ -1175,6 +1232,113 @@ class SimpleChatbot {
         }
     }
 
+    async sendCompareMessage(message) {
+        this.addMessage(message, 'user');
+        this.elements.chatInput.value = '';
+        this.elements.chatInput.style.height = 'auto';
+        
+        this.showTypingIndicator();
+        this.transformToStopButton();
+        
+        const labels = {};
+        document.querySelectorAll('.model-option').forEach(option => {
+            labels[option.getAttribute('data-model')] = option.querySelector('.option-title').textContent;
+        });
+        
+        let compareMessage = null;
+        const sections = {};
+        const answers = [];
+        
+        try {
+            const formData = new FormData();
+            formData.append('message', message);
+            formData.append('personality', this.getPersonality());
+            formData.append('models', this.compareModels.join(','));
+            
+            const response = await fetch('/calavera-ai/api/compare', {
+                method: 'POST',
+                body: formData
+            });
+            
+            if (!response.ok || !this.isEventStream(response)) {
+                const data = await response.json();
+                this.removeTypingIndicator();
+                this.addMessage(data.error || '⚠️ Terjadi kesalahan saat memproses permintaan kamu. Coba lagi ya!', 'bot', null, false);
+                return;
+            }
+            
+            await this.readEventStream(response, (event, data) => {
+                if (this.isStopRequested) return;
+                
+                if (event === 'start') {
+                    // Satu bubble, satu bagian per model; diisi sesuai urutan selesai
+                    this.removeTypingIndicator();
+                    compareMessage = this.createStreamingBotMessage();
+                    
+                    data.models.forEach(model => {
+                        const section = document.createElement('div');
+                        section.className = 'compare-result pending';
+                        section.innerHTML = `
+                            <div class="compare-result-header">
+                                <span class="compare-result-model">${this.escapeHtml(labels[model] || model)}</span>
+                                <span class="compare-result-latency"></span>
+                            </div>
+                            <div class="compare-result-body">Menunggu jawaban...</div>
+                        `;
+                        compareMessage.textDiv.appendChild(section);
+                        sections[model] = section;
+                    });
+                    this.scrollToBottom();
+                } else if (event === 'result' && sections[data.model]) {
+                    const section = sections[data.model];
+                    const body = section.querySelector('.compare-result-body');
+                    
+                    section.classList.remove('pending');
+                    
+                    if (data.latency !== null && data.latency !== undefined) {
+                        section.querySelector('.compare-result-latency').textContent = `${data.latency.toFixed(1)} detik`;
+                    }
+                    
+                    if (data.error) {
+                        section.classList.add('failed');
+                        body.innerHTML = this.formatText(data.error);
+                    } else {
+                        body.innerHTML = this.formatText(data.response);
+                        answers.push(`${labels[data.model] || data.model}:\n${data.response}`);
+                    }
+                    this.scrollToBottom();
+                }
+            });
+        } catch (error) {
+            console.error('❌ Compare error:', error);
+            
+            if (!compareMessage && !this.isStopRequested) {
+                this.removeTypingIndicator();
+                this.addMessage('⚠️ Tidak bisa terhubung ke server. Pastikan koneksi internet kamu stabil, lalu coba lagi.', 'bot', null, false);
+            }
+        }
+        
+        this.removeTypingIndicator();
+        
+        if (compareMessage) {
+            compareMessage.textBubble.classList.remove('typing-animation');
+            // Hanya tombol salin: jawaban bandingan tidak masuk history server, jadi tidak bisa di-regenerate
+            const actions = document.createElement('div');
+            actions.className = 'message-actions';
+            actions.appendChild(this.createActionButton('bx bx-copy', 'Salin', () => {
+                this.copyMessage(answers.join('\n\n'));
+            }));
+            compareMessage.contentWrapper.appendChild(actions);
+        }
+        
+        this.currentTypingMessageId = null;
+        this.isTyping = false;
+        this.isAnimatingTyping = false;
+        this.transformToSendButton();
+        this.scrollToBottom();
+        this.saveChatHistory();
+    }
+
     async sendImageMessage(message) {
         const imageUrlForBubble = this.selectedImageUrl;
         const imageFileForUpload = this.selectedImageFile;
@@ -1196,12 +1360,20 @@ class SimpleChatbot {
             formData.append('model', this.currentModel);
             formData.append('image', imageFileForUpload);
             formData.append('mode', 'image');
+            formData.append('async', '1');
             
             const response = await fetch('/calavera-ai/api/chat', {
                 method: 'POST',
                 body: formData
             });
             
+            let data = await response.json();
+            let ok = response.ok;
+            
+            if (response.status === 202 && data.job_id) {
+                ({ ok, data } = await this.waitForJob(data.job_id));
+            }
+            
             if (this.isStopRequested) {
                 this.removeTypingIndicator();
                 this.transformToSendButton();
@@ -1209,10 +1381,9 @@ class SimpleChatbot {
                 return;
             }
             
-            const data = await response.json();
             this.removeTypingIndicator();
             
-            if (response.ok) {
+            if (ok) {
                 if (data.image_url) {
                     this.lastUploadedImageUrl = data.image_url;
                 }
@@ -1261,12 +1432,20 @@ class SimpleChatbot {
             formData.append('personality', this.getPersonality());
             formData.append('model', this.currentModel);
             formData.append('mode', 'file');
+            formData.append('async', '1');
             
             const response = await fetch('/calavera-ai/api/chat', {
                 method: 'POST',
                 body: formData
             });
             
+            let data = await response.json();
+            let ok = response.ok;
+            
+            if (response.status === 202 && data.job_id) {
+                ({ ok, data } = await this.waitForJob(data.job_id));
+            }
+            
             if (this.isStopRequested) {
                 this.removeTypingIndicator();
                 this.transformToSendButton();
@@ -1274,10 +1453,9 @@ class SimpleChatbot {
                 return;
             }
             
-            const data = await response.json();
             this.removeTypingIndicator();
             
-            if (response.ok) {
+            if (ok) {
                 this.addMessage(data.response, 'bot', null, true);
                 this.showToast('File berhasil diproses!', 'success');
             } else {
@@ -1320,7 +1498,8 @@ class SimpleChatbot {
                 },
                 body: JSON.stringify({
                     personality: this.getPersonality(),
-                    model: this.currentModel
+                    model: this.currentModel,
+                    stream: true
                 })
             });
             
@@ -1331,6 +1510,11 @@ class SimpleChatbot {
                 return;
             }
             
+            if (response.ok && this.isEventStream(response)) {
+                await this.renderStreamingResponse(response, true);
+                return;
+            }
+            
             const data = await response.json();
             this.removeTypingIndicator();
             
@@ -1358,6 +1542,182 @@ class SimpleChatbot {
         }
     }
 
+    isEventStream(response) {
+        const contentType = response.headers.get('Content-Type') || '';
+        return contentType.includes('text/event-stream');
+    }
+
+    async waitForJob(jobId) {
+        // Job image/file di antrean server: polling status dengan backoff (0.5s naik sampai 5s, maks. 10 menit)
+        const deadline = Date.now() + 10 * 60 * 1000;
+        let delay = 500;
+        
+        while (!this.isStopRequested && Date.now() < deadline) {
+            await new Promise(resolve => setTimeout(resolve, delay));
+            if (this.isStopRequested) break;
+            
+            let response;
+            try {
+                response = await fetch(`/calavera-ai/api/jobs/${jobId}`);
+            } catch (error) {
+                // Koneksi putus sesaat: coba lagi di putaran berikutnya
+                delay = Math.min(delay * 2, 5000);
+                continue;
+            }
+            
+            const data = await response.json();
+            if (!response.ok) {
+                return { ok: false, data };
+            }
+            if (data.status === 'done') {
+                return { ok: true, data: data.result };
+            }
+            if (data.status === 'failed') {
+                return { ok: false, data };
+            }
+            
+            delay = Math.min(Math.round(delay * 1.5), 5000);
+        }
+        
+        return { ok: false, data: {} };
+    }
+
+    async readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        this.currentStreamReader = reader;
+        
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                
+                buffer += decoder.decode(value, { stream: true });
+                
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    
+                    let eventName = 'message';
+                    const dataLines = [];
+                    
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) {
+                            eventName = line.slice(6).trim();
+                        } else if (line.startsWith('data:')) {
+                            dataLines.push(line.slice(5).trim());
+                        }
+                    });
+                    
+                    if (dataLines.length) {
+                        onEvent(eventName, JSON.parse(dataLines.join('\n')));
+                    }
+                }
+            }
+        } finally {
+            this.currentStreamReader = null;
+        }
+    }
+
+    createStreamingBotMessage() {
+        const messageId = 'msg-' + Date.now();
+        const wrapper = document.createElement('div');
+        wrapper.className = 'message-wrapper bot';
+        wrapper.dataset.messageId = messageId;
+        
+        const avatar = document.createElement('div');
+        avatar.className = 'message-avatar';
+        avatar.innerHTML = '<i class="fas fa-robot"></i>';
+        
+        const contentWrapper = document.createElement('div');
+        contentWrapper.className = 'message-content-wrapper';
+        
+        const textBubble = document.createElement('div');
+        textBubble.className = 'message-bubble message-bubble-text typing-animation';
+        
+        const textDiv = document.createElement('div');
+        textDiv.className = 'message-text-content';
+        
+        textBubble.appendChild(textDiv);
+        contentWrapper.appendChild(textBubble);
+        wrapper.appendChild(avatar);
+        wrapper.appendChild(contentWrapper);
+        
+        this.elements.chatMessages.appendChild(wrapper);
+        this.currentTypingMessageId = messageId;
+        
+        return { messageId, contentWrapper, textBubble, textDiv };
+    }
+
+    async renderStreamingResponse(response, replaceLastBot = false) {
+        let streamMessage = null;
+        let streamedText = '';
+        let donePayload = null;
+        
+        const ensureMessage = () => {
+            if (streamMessage) return;
+            
+            this.removeTypingIndicator();
+            
+            if (replaceLastBot) {
+                const botMessages = this.elements.chatMessages.querySelectorAll('.message-wrapper.bot');
+                const lastBotMessage = botMessages[botMessages.length - 1];
+                if (lastBotMessage) {
+                    lastBotMessage.remove();
+                }
+            }
+            
+            streamMessage = this.createStreamingBotMessage();
+        };
+        
+        try {
+            await this.readEventStream(response, (event, data) => {
+                if (this.isStopRequested) return;
+                
+                if (event === 'delta') {
+                    ensureMessage();
+                    streamedText += data.text;
+                    streamMessage.textDiv.innerHTML = this.formatText(streamedText);
+                    this.scrollToBottom();
+                } else if (event === 'done') {
+                    donePayload = data;
+                }
+            });
+        } catch (error) {
+            console.error('❌ Stream error:', error);
+        }
+        
+        this.removeTypingIndicator();
+        
+        if (!streamMessage && !this.isStopRequested) {
+            const fallback = donePayload ? donePayload.response : '';
+            const errorMsg = fallback || '⚠️ Koneksi terputus saat menerima respons. Coba lagi ya!';
+            ensureMessage();
+            streamedText = errorMsg;
+            streamMessage.textDiv.innerHTML = this.formatText(errorMsg);
+        }
+        
+        if (streamMessage) {
+            streamMessage.textBubble.classList.remove('typing-animation');
+            
+            if (!streamMessage.contentWrapper.querySelector('.message-actions')) {
+                streamMessage.contentWrapper.appendChild(
+                    this.createMessageActions(streamMessage.messageId, streamedText)
+                );
+            }
+        }
+        
+        this.currentTypingMessageId = null;
+        this.isTyping = false;
+        this.isAnimatingTyping = false;
+        this.transformToSendButton();
+        this.scrollToBottom();
+        this.saveChatHistory();
+    }
+
     addMessage(content, sender, imageUrl = null, enableTyping = false) {
         const messageId = 'msg-' + Date.now();
         const wrapper = document.createElement('div');
@@ -1894,6 +2254,39 @@ class SimpleChatbot {
         }
     }
     
+    toggleCompareModel(model) {
+        const index = this.compareModels.indexOf(model);
+        
+        if (index === -1) {
+            this.compareModels.push(model);
+        } else if (this.compareModels.length <= 2) {
+            this.showToast('Pilih minimal 2 model untuk dibandingkan!', 'warning');
+            return;
+        } else {
+            this.compareModels.splice(index, 1);
+        }
+        
+        localStorage.setItem('calavera_compare_models', JSON.stringify(this.compareModels));
+        this.updateCompareModeUI();
+    }
+    
+    updateCompareModeUI() {
+        const compareModeStatus = document.getElementById('compareModeStatus');
+        const modelOptions = document.querySelectorAll('.model-option');
+        
+        if (compareModeStatus) {
+            compareModeStatus.textContent = this.compareMode ? `Aktif (${this.compareModels.length} model)` : 'Nonaktif';
+        }
+        
+        modelOptions.forEach(option => {
+            const model = option.getAttribute('data-model');
+            const selected = this.compareMode ? this.compareModels.includes(model) : model === this.currentModel;
+            option.classList.toggle('selected', selected);
+        });
+        
+        this.updateModelLabel(this.compareMode ? `Bandingkan ${this.compareModels.length} model` : this.currentModelLabel);
+    }
+    
     updateModelLabel(label) {
         const labelElement = document.getElementById('currentModelLabel');
         if (labelElement) {